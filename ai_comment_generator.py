@@ -4,10 +4,8 @@ Handles OpenAI API integration for generating fake engagement comments
 """
 
 import os
-import openai
 from typing import Optional, Dict, Any
 import logging
-import maricon
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -16,6 +14,11 @@ logger = logging.getLogger(__name__)
 class AICommentGenerator:
     def __init__(self):
         """Initialize the AI comment generator with OpenAI API key"""
+        # Imported here: openai is slow to import and maricon only exists
+        # where comments are generated, so neither should be needed to boot
+        import openai
+        import maricon
+
         self.api_key = maricon.gptkey
         
         openai.api_key = self.api_key
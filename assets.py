@@ -0,0 +1,220 @@
+"""
+Assets Module
+Build step for the CSS and JS under static/ (see the build-assets CLI):
+
+- every stylesheet and script, plus the per-page bundles in ASSET_BUNDLES,
+  is minified and written to static/build/ under a content-hashed name,
+  e.g. build/css/style.3f2a9c1b04.css
+- each output gets .gz and .br siblings so no request compresses them
+- static/build/manifest.json maps source (or bundle) names to the outputs
+
+asset_url() in easycore turns a source or bundle name into the URL of its
+built file; those URLs never change content and are cached as immutable.
+Without a build (development), sources are served as before and bundles
+are concatenated per request.
+
+Minification uses rcssmin/rjsmin and Brotli uses brotli when they are
+installed. Otherwise CSS gets a built-in comment and whitespace pass, JS is
+only bundled, and no .br files are written. Scripts gain little from
+whitespace removal once compressed.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# Bundle name -> sources (static-relative), concatenated in this order
+ASSET_BUNDLES: Dict[str, List[str]] = {
+    'bundle/index.css': ['css/style.css', 'css/index.css'],
+    'bundle/upload.css': ['css/style.css', 'css/upload.css'],
+    'bundle/bulk_upload.css': ['css/style.css', 'css/bulk_upload.css'],
+    'bundle/artist_detail.css': ['css/style.css', 'css/artist_detail.css'],
+    'bundle/track_detail.css': ['css/style.css', 'css/track_detail.css'],
+    'bundle/upload.js': ['js/chunked_upload.js', 'js/jobs.js'],
+    'bundle/video_detail.js': ['js/video_detail.js', 'js/storyboard.js'],
+}
+# Folders (static-relative) whose files are built one by one
+ASSET_SOURCE_DIRS = ('css', 'js')
+ASSET_EXTENSIONS = ('.css', '.js')
+# Output folder (static-relative) and the manifest inside it
+BUILD_DIRNAME = 'build'
+MANIFEST_NAME = 'manifest.json'
+# Hex characters of the content hash in built names
+FINGERPRINT_CHARS = 10
+# Encodings written next to each output, best first: (Accept-Encoding token, suffix)
+PRECOMPRESSED = (('br', '.br'), ('gzip', '.gz'))
+
+_CSS_LITERAL = re.compile(r'/\*.*?\*/|"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'', re.S)
+
+
+def _squeeze_css(css: str) -> str:
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    css = re.sub(r':\s+', ':', css)
+    return css.replace(';}', '}')
+
+
+def _minify_css_builtin(css: str) -> str:
+    """Drop comments and collapse whitespace, leaving strings untouched"""
+    out = []
+    position = 0
+    for match in _CSS_LITERAL.finditer(css):
+        out.append(_squeeze_css(css[position:match.start()]))
+        if not match.group().startswith('/*'):
+            out.append(match.group())
+        position = match.end()
+    out.append(_squeeze_css(css[position:]))
+    return ''.join(out).strip()
+
+
+def minify(text: str, ext: str) -> str:
+    if ext == '.css':
+        try:
+            import rcssmin
+            return rcssmin.cssmin(text)
+        except ImportError:
+            return _minify_css_builtin(text)
+    try:
+        import rjsmin
+        return rjsmin.jsmin(text)
+    except ImportError:
+        return text.strip()
+
+
+def concat_sources(sources: List[str], static_folder: str) -> str:
+    """Sources joined in order; scripts are separated so one missing a final
+    semicolon cannot run into the next"""
+    separator = '\n;\n' if sources[0].endswith('.js') else '\n'
+    texts = []
+    for rel_path in sources:
+        with open(os.path.join(static_folder, rel_path), encoding='utf-8') as f:
+            texts.append(f.read())
+    return separator.join(texts)
+
+
+def _source_names(static_folder: str) -> List[str]:
+    names = []
+    for folder in ASSET_SOURCE_DIRS:
+        abs_folder = os.path.join(static_folder, folder)
+        if os.path.isdir(abs_folder):
+            names.extend(f"{folder}/{name}" for name in sorted(os.listdir(abs_folder))
+                         if name.endswith(ASSET_EXTENSIONS))
+    return names
+
+
+def _write(abs_path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+    tmp_path = f"{abs_path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, abs_path)
+
+
+def _compressed(data: bytes) -> Dict[str, bytes]:
+    variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    try:
+        import brotli
+        variants['.br'] = brotli.compress(data, quality=11)
+    except ImportError:
+        pass
+    return variants
+
+
+def build_assets(static_folder: str) -> List[Tuple[str, str, int, Dict[str, int]]]:
+    """
+    Build every source and bundle into static/build and write the manifest.
+    Outputs of the previous build are kept, so pages rendered before a
+    deploy can still load them; older ones are removed.
+
+    Returns:
+        (name, built path, source bytes, {output suffix: bytes}) per output
+    """
+    build_folder = os.path.join(static_folder, BUILD_DIRNAME)
+    manifest_path = os.path.join(build_folder, MANIFEST_NAME)
+    previous = AssetManifest(static_folder).load() or {}
+
+    entries = [(name, [name]) for name in _source_names(static_folder)]
+    entries.extend(ASSET_BUNDLES.items())
+    manifest: Dict[str, str] = {}
+    report = []
+    for name, sources in entries:
+        ext = os.path.splitext(name)[1]
+        source = concat_sources(sources, static_folder)
+        data = minify(source, ext).encode('utf-8')
+        digest = hashlib.sha1(data).hexdigest()[:FINGERPRINT_CHARS]
+        stem = os.path.splitext(name)[0]
+        built = f"{BUILD_DIRNAME}/{stem}.{digest}{ext}"
+        abs_built = os.path.join(static_folder, built)
+        sizes = {'min': len(data)}
+        if not os.path.exists(abs_built):
+            _write(abs_built, data)
+            for suffix, compressed in _compressed(data).items():
+                _write(abs_built + suffix, compressed)
+        for _, suffix in PRECOMPRESSED:
+            if os.path.exists(abs_built + suffix):
+                sizes[suffix] = os.path.getsize(abs_built + suffix)
+        manifest[name] = built
+        report.append((name, built, len(source.encode('utf-8')), sizes))
+
+    _write(manifest_path, json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+
+    keep = {os.path.join(static_folder, path) for path in list(manifest.values()) + list(previous.values())}
+    for root, _, files in os.walk(build_folder):
+        for filename in files:
+            abs_path = os.path.join(root, filename)
+            original = abs_path
+            for _, suffix in PRECOMPRESSED:
+                if abs_path.endswith(suffix):
+                    original = abs_path[:-len(suffix)]
+            if abs_path != manifest_path and original not in keep:
+                os.remove(abs_path)
+    return report
+
+
+class AssetManifest:
+    """The build manifest, re-read whenever build-assets rewrites it."""
+
+    def __init__(self, static_folder: str):
+        self.path = os.path.join(static_folder, BUILD_DIRNAME, MANIFEST_NAME)
+        self._mtime_ns: Optional[int] = None
+        self._entries: Optional[Dict[str, str]] = None
+        self._lock = threading.Lock()
+
+    def load(self) -> Optional[Dict[str, str]]:
+        """Name -> built path, or None when nothing has been built"""
+        try:
+            mtime_ns = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+        with self._lock:
+            if mtime_ns != self._mtime_ns:
+                with open(self.path, encoding='utf-8') as f:
+                    self._entries = json.load(f)
+                self._mtime_ns = mtime_ns
+            return self._entries
+
+    def lookup(self, name: str) -> Optional[str]:
+        entries = self.load()
+        return entries.get(name) if entries else None
+
+
+def precompressed_variant(abs_path: str, accept_encodings) -> Tuple[str, Optional[str]]:
+    """
+    The best pre-built variant of a file the client accepts.
+
+    Args:
+        abs_path: The built file
+        accept_encodings: The request's parsed Accept-Encoding
+            (request.accept_encodings); an encoding with q=0 is refused
+
+    Returns:
+        (path to send, Content-Encoding or None for the plain file)
+    """
+    for encoding, suffix in PRECOMPRESSED:
+        if accept_encodings[encoding] and os.path.exists(abs_path + suffix):
+            return abs_path + suffix, encoding
+    return abs_path, None
@@ -0,0 +1,323 @@
+"""
+Audio Extraction Module
+Pulls the audio track out of an uploaded file and streams it from ffmpeg's
+stdout, so nothing is written to the upload folders. ffmpeg reads the upload
+through an inherited file descriptor (seekable, so MP4s with the index at the
+end work) and audio that is already MP3 or AAC is stream-copied instead of
+re-encoded.
+
+Batches (extract_zip) run several extractions at once and stream the results
+into a ZIP in the order they finish. Each extraction holds one of the shared
+ffmpeg slots (ingest_pool.slot()), so batches and ingest together never run
+more ffmpeg processes than the machine is sized for.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+import ffmpeg
+
+import ingest_pool
+from media_metadata import first_stream
+
+# Size of the reads from ffmpeg's stdout
+EXTRACT_CHUNK_SIZE = 64 * 1024
+# Bitrate when the audio has to be encoded to MP3
+EXTRACT_MP3_BITRATE = '192k'
+# Source codec -> (ffmpeg muxer, extension, mimetype) when it can be copied as is
+COPY_FORMATS: Dict[str, Tuple[str, str, str]] = {
+    'mp3': ('mp3', '.mp3', 'audio/mpeg'),
+    'aac': ('adts', '.aac', 'audio/aac'),
+}
+# Last bytes of ffmpeg's stderr kept for error messages
+STDERR_TAIL_BYTES = 4096
+# A finished batch entry stays in memory up to this size before spilling to
+# an anonymous temp file; bounds a batch to about (workers + 1) of these
+BATCH_SPOOL_BYTES = 8 * 1024 * 1024
+
+
+class ExtractionError(Exception):
+    """ffmpeg could not read the upload or produced no audio"""
+
+
+def _upload_fd(stream: BinaryIO) -> Tuple[int, Optional[BinaryIO]]:
+    """
+    A real file descriptor for an upload stream. Large uploads are already
+    spooled to an anonymous temp file; small in-memory ones are copied into
+    one (in the system temp dir, never the shared upload folder).
+
+    Returns:
+        The fd and, if one was created, the temp file the caller must close
+    """
+    stream.seek(0)
+    try:
+        return stream.fileno(), None
+    except (AttributeError, OSError, ValueError):
+        spool = tempfile.TemporaryFile()
+        shutil.copyfileobj(stream, spool)
+        spool.flush()
+        spool.seek(0)
+        return spool.fileno(), spool
+
+
+def _audio_codec(fd: int) -> Optional[str]:
+    """Codec of the first audio stream of an open file"""
+    result = subprocess.run(['ffprobe', '-v', 'error', '-select_streams', 'a:0', '-show_streams',
+                             '-of', 'json', f'/dev/fd/{fd}'],
+                            capture_output=True, pass_fds=(fd,))
+    if result.returncode != 0:
+        raise ExtractionError(result.stderr.decode(errors='replace').strip() or 'Could not read the file')
+    audio = first_stream(json.loads(result.stdout or b'{}'), 'audio')
+    if audio is None:
+        raise ExtractionError('The file has no audio track')
+    return audio.get('codec_name')
+
+
+class AudioExtraction:
+    """
+    One running ffmpeg extraction. Iterate it for the audio bytes; it cleans
+    up (and stops ffmpeg if the client went away) when iteration ends.
+
+        extraction = AudioExtraction(file.stream, 'clip')
+        Response(extraction, mimetype=extraction.mimetype)
+    """
+
+    def __init__(self, stream: BinaryIO, basename: str,
+                 on_start: Optional[Callable[['AudioExtraction'], None]] = None):
+        """on_start is called once ffmpeg runs, e.g. to be able to kill() it"""
+        fd, self._spool = _upload_fd(stream)
+        try:
+            codec = _audio_codec(fd)
+            if codec in COPY_FORMATS:
+                muxer, extension, self.mimetype = COPY_FORMATS[codec]
+                codec_args = {'acodec': 'copy'}
+            else:
+                muxer, extension, self.mimetype = 'mp3', '.mp3', 'audio/mpeg'
+                codec_args = {'acodec': 'libmp3lame', 'audio_bitrate': EXTRACT_MP3_BITRATE}
+            self.copied = codec_args['acodec'] == 'copy'
+            self.filename = basename + extension
+            args = (
+                ffmpeg
+                .input(f'/dev/fd/{fd}')
+                .audio
+                .output('pipe:1', f=muxer, **codec_args)
+                .global_args('-v', 'error', '-nostdin')
+                .compile()
+            )
+            self._stderr = tempfile.TemporaryFile()
+            self._process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=self._stderr,
+                                             stdin=subprocess.DEVNULL, pass_fds=(fd,))
+            if on_start is not None:
+                on_start(self)
+            # Read ahead one chunk so a file ffmpeg cannot decode fails before
+            # any response headers are sent
+            self._first = self._process.stdout.read(EXTRACT_CHUNK_SIZE)
+            if not self._first and self._process.wait() != 0:
+                raise ExtractionError(self._stderr_tail() or 'ffmpeg produced no audio')
+        except Exception:
+            self.close()
+            raise
+
+    def _stderr_tail(self) -> str:
+        self._stderr.seek(0, os.SEEK_END)
+        self._stderr.seek(max(0, self._stderr.tell() - STDERR_TAIL_BYTES))
+        return self._stderr.read().decode(errors='replace').strip()
+
+    def __iter__(self) -> Iterator[bytes]:
+        try:
+            if self._first:
+                yield self._first
+            for chunk in iter(lambda: self._process.stdout.read(EXTRACT_CHUNK_SIZE), b''):
+                yield chunk
+            if self._process.wait() != 0:
+                # Headers are already out; all that is left is to log it
+                print(f"Error extracting audio for {self.filename}: {self._stderr_tail()}")
+        finally:
+            self.close()
+
+    def kill(self) -> None:
+        """Stop ffmpeg from another thread; the reading thread then sees the
+        output end and cleans up"""
+        process = getattr(self, '_process', None)
+        if process is not None and process.poll() is None:
+            process.kill()
+
+    def close(self) -> None:
+        process = getattr(self, '_process', None)
+        if process is not None:
+            if process.poll() is None:
+                process.kill()
+            process.stdout.close()
+            process.wait()
+        for handle in (getattr(self, '_stderr', None), self._spool):
+            if handle is not None:
+                handle.close()
+
+
+# A batch item: the name to use in the archive and a callable that opens the
+# source (the opened stream is closed once the extraction is done)
+BatchSource = Tuple[str, Callable[[], BinaryIO]]
+
+
+class _ZipOutput:
+    """Write-only, unseekable sink for ZipFile; the bytes written are picked
+    up with drain() and sent to the client"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class _BatchState:
+    """The extractions of one batch that are running, so they can all be
+    stopped when the client goes away"""
+
+    def __init__(self):
+        self.cancelled = threading.Event()
+        self._running = set()
+        self._lock = threading.Lock()
+
+    def started(self, extraction: AudioExtraction) -> None:
+        with self._lock:
+            self._running.add(extraction)
+            if self.cancelled.is_set():
+                extraction.kill()
+
+    def finished(self, extraction: AudioExtraction) -> None:
+        with self._lock:
+            self._running.discard(extraction)
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled.set()
+            for extraction in self._running:
+                extraction.kill()
+
+    def check(self) -> None:
+        if self.cancelled.is_set():
+            raise ExtractionError('Batch cancelled')
+
+
+def _extract_to_spool(basename: str, open_source: Callable[[], BinaryIO],
+                      batch: _BatchState) -> Tuple[str, BinaryIO]:
+    """Run one extraction to completion. Returns the output filename and a
+    spooled file holding the audio, rewound."""
+    spool = tempfile.SpooledTemporaryFile(max_size=BATCH_SPOOL_BYTES)
+    try:
+        with ingest_pool.slot():
+            batch.check()
+            with open_source() as source:
+                extraction = None
+                try:
+                    extraction = AudioExtraction(source, basename, on_start=batch.started)
+                    for chunk in extraction:
+                        spool.write(chunk)
+                finally:
+                    if extraction is not None:
+                        batch.finished(extraction)
+        # A killed ffmpeg ends its output early; that is not a result
+        batch.check()
+        spool.seek(0)
+        return extraction.filename, spool
+    except Exception:
+        spool.close()
+        raise
+
+
+def _close_result(future) -> None:
+    if not future.cancelled() and future.exception() is None:
+        future.result()[1].close()
+
+
+def _unique_name(name: str, used: set) -> str:
+    stem, extension = os.path.splitext(name)
+    counter = 1
+    while name in used:
+        counter += 1
+        name = f"{stem}_{counter}{extension}"
+    used.add(name)
+    return name
+
+
+def extract_zip(sources: List[BatchSource], workers: int) -> Iterator[bytes]:
+    """
+    Extract the audio of several files at once and stream a ZIP of the results.
+
+    Each entry is added as soon as its extraction finishes, so the archive is
+    never built on disk. At most workers extractions run at a time, each
+    holding a shared ffmpeg slot, and no more finished ones are held back than
+    that, so memory stays bounded however slowly the client reads. Files that
+    fail are listed in errors.txt at the end of the archive instead of
+    aborting the whole download. If the client goes away, the running ffmpeg
+    processes are killed.
+
+    Args:
+        sources: (basename, opener) pairs, see BatchSource
+        workers: Extractions to run in parallel
+
+    Returns:
+        Iterator over the bytes of the ZIP
+    """
+    output = _ZipOutput()
+    used_names: set = set()
+    errors: List[str] = []
+    pending_sources = list(reversed(sources))
+    executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='audio-extract')
+    batch = _BatchState()
+    in_flight: Dict = {}
+    try:
+        with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_STORED) as archive:
+            while pending_sources or in_flight:
+                while pending_sources and len(in_flight) < workers:
+                    basename, opener = pending_sources.pop()
+                    in_flight[executor.submit(_extract_to_spool, basename, opener, batch)] = basename
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    basename = in_flight.pop(future)
+                    try:
+                        filename, spool = future.result()
+                    except Exception as e:
+                        print(f"Error extracting audio for {basename}: {str(e)}")
+                        errors.append(f"{basename}: {str(e)}")
+                        continue
+                    with spool:
+                        info = zipfile.ZipInfo(_unique_name(filename, used_names),
+                                               date_time=time.localtime()[:6])
+                        # A known size lets zipfile pick ZIP64 up front for huge entries
+                        info.file_size = spool.seek(0, os.SEEK_END)
+                        spool.seek(0)
+                        with archive.open(info, 'w') as entry:
+                            for chunk in iter(lambda: spool.read(EXTRACT_CHUNK_SIZE), b''):
+                                entry.write(chunk)
+                                yield output.drain()
+                    yield output.drain()
+            if errors:
+                archive.writestr(_unique_name('errors.txt', used_names), '\n'.join(errors) + '\n')
+        yield output.drain()
+    finally:
+        # Client went away: stop ffmpeg, drop queued work and release the
+        # results of extractions that finished (now or once they wind down)
+        batch.cancel()
+        for future in in_flight:
+            future.cancel()
+            future.add_done_callback(_close_result)
+        executor.shutdown(wait=False)
@@ -0,0 +1,205 @@
+"""
+Compression Module
+WSGI middleware that compresses text responses (HTML, JSON, CSS, JS...) on
+the fly with Brotli or gzip, whichever the client prefers of the ones
+available (Brotli needs the brotli package).
+
+Skipped: clients that accept neither, HEAD and Range requests, partial and
+bodiless statuses, media and other binary types, responses that already
+carry a Content-Encoding (e.g. the precompressed /assets/ files), proxy
+offloads, no-transform responses and bodies known to be below
+COMPRESSION_MIN_BYTES. Bodies without a Content-Length (streamed responses)
+are compressed chunk by chunk and flushed after each one, so they keep
+streaming.
+
+stats() reports how many responses were compressed and the bytes saved.
+"""
+
+import threading
+import zlib
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Smaller bodies are sent as they are; compression would barely pay off
+COMPRESSION_MIN_BYTES = 1024
+# Tuned for speed: these responses are compressed on every request
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+# Content types worth compressing (prefix match; parameters are ignored)
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml',
+                      'application/xhtml+xml', 'image/svg+xml')
+SKIP_STATUSES = (204, 206, 304)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class _Gzip:
+    def __init__(self):
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class _Brotli:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+CODINGS = {'gzip': _Gzip}
+if brotli is not None:
+    CODINGS['br'] = _Brotli
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """The best supported coding the Accept-Encoding header allows, or None"""
+    qualities = {}
+    for part in accept_encoding.split(','):
+        token, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[token.strip().lower()] = quality
+    best = None
+    for coding in ('br', 'gzip'):
+        quality = qualities.get(coding, qualities.get('*', 0.0))
+        if coding in CODINGS and quality > 0 and (best is None or quality > best[1]):
+            best = (coding, quality)
+    return best[0] if best else None
+
+
+def _compressible(status: int, headers: List[Tuple[str, str]], min_size: int) -> Tuple[bool, bool]:
+    """(compress?, streamed?) from the status and response headers"""
+    if status in SKIP_STATUSES or status < 200:
+        return False, False
+    values = {name.lower(): value for name, value in headers}
+    content_type = values.get('content-type', '').split(';')[0].strip().lower()
+    if not content_type.startswith(COMPRESSIBLE_TYPES):
+        return False, False
+    if ('content-encoding' in values or 'content-range' in values or 'x-accel-redirect' in values
+            or 'x-sendfile' in values or 'no-transform' in values.get('cache-control', '')):
+        return False, False
+    length = values.get('content-length')
+    if length is not None:
+        return length.isdigit() and int(length) >= min_size, False
+    return True, True
+
+
+def _weaken(etag: str) -> str:
+    """A compressed body is no longer byte-identical to the strong ETag's"""
+    return etag if etag.startswith('W/') else f"W/{etag}"
+
+
+class CompressionMiddleware:
+    """Wraps a WSGI app (app.wsgi_app = CompressionMiddleware(app.wsgi_app))."""
+
+    def __init__(self, app: Callable, min_size: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.min_size = min_size
+        self._lock = threading.Lock()
+        self.compressed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def _count(self, bytes_in: int, bytes_out: int) -> None:
+        with self._lock:
+            self.compressed += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+    def __call__(self, environ, start_response):
+        coding = choose_encoding(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if coding is None or environ.get('REQUEST_METHOD') == 'HEAD' or environ.get('HTTP_RANGE'):
+            return self.app(environ, start_response)
+
+        state = {}
+
+        def compressing_start_response(status, headers, exc_info=None):
+            compress, streamed = _compressible(int(status.split(' ', 1)[0]), headers, self.min_size)
+            state['compressor'] = CODINGS[coding]() if compress else None
+            state['streamed'] = streamed
+            if compress:
+                headers = [(name, value) for name, value in headers if name.lower() != 'content-length']
+                headers = [(name, _weaken(value)) if name.lower() == 'etag' else (name, value)
+                           for name, value in headers]
+                vary = [value for name, value in headers if name.lower() == 'vary']
+                headers = [(name, value) for name, value in headers if name.lower() != 'vary']
+                headers.append(('Vary', ', '.join(vary + ['Accept-Encoding'])))
+                headers.append(('Content-Encoding', coding))
+            write = start_response(status, headers, exc_info)
+            if not compress:
+                return write
+            compressor = state['compressor']
+
+            def compressing_write(data):
+                write(compressor.compress(data) + compressor.flush())
+            return compressing_write
+
+        app_iter = self.app(environ, compressing_start_response)
+        if 'compressor' in state and state['compressor'] is None:
+            return app_iter
+        return self._compressed_body(app_iter, state)
+
+    def _compressed_body(self, app_iter: Iterable[bytes], state: Dict):
+        bytes_in = bytes_out = 0
+        compressor = None
+        try:
+            for chunk in app_iter:
+                # An app may only call start_response once it yields its first chunk
+                compressor = state['compressor']
+                if compressor is None:
+                    yield chunk
+                    continue
+                if not chunk:
+                    continue
+                bytes_in += len(chunk)
+                out = compressor.compress(chunk)
+                if state['streamed']:
+                    # Keep streamed responses moving instead of buffering them
+                    out += compressor.flush()
+                if out:
+                    bytes_out += len(out)
+                    yield out
+            compressor = state.get('compressor')
+            if compressor is not None:
+                out = compressor.finish()
+                bytes_out += len(out)
+                yield out
+        finally:
+            close = getattr(app_iter, 'close', None)
+            if close is not None:
+                close()
+            if compressor is not None:
+                self._count(bytes_in, bytes_out)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                'compressed_responses': self.compressed,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'bytes_saved': self.bytes_in - self.bytes_out,
+                'ratio': round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else 0.0,
+                'codings': sorted(CODINGS),
+            }
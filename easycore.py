@@ -1,36 +1,89 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify, send_file, Response, make_response
+from flask import Flask, render_template, request, redirect, url_for, jsonify, send_file, Response, make_response, abort, stream_with_context, get_template_attribute
 import os
 from sqlalchemy import desc, func
 import re
 from werkzeug.utils import secure_filename
-import ffmpeg
-from PIL import Image
+from werkzeug.security import safe_join
 import io
 from werkzeug.datastructures import FileStorage
-from datetime import datetime
+from datetime import datetime, timedelta
 import uuid
-import random
-import string
+import hashlib
+import mimetypes
 import unicodedata
-import markdown
+from markupsafe import Markup
+import click
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+import json
 
 # Import models
-from models import db, Video, Comment, Playlist, PlaylistVideo, PlaylistComment, TagDescription, TagComment, Track, TrackComment, ArtistComment, Artist, TrackArtist, VideoArtist, AuthorProfile
+from models import db, Video, Comment, Playlist, PlaylistVideo, PlaylistComment, TagDescription, TagComment, Track, TrackComment, ArtistComment, Artist, TrackArtist, VideoArtist, AuthorProfile, UploadSession, ensure_schema
 
 # Import blueprints
-from routes import video_bp, playlist_bp, comment_bp, filter_bp
+from routes import video_bp, playlist_bp, comment_bp, filter_bp, upload_bp, jobs_bp
 
 # Import AI comment generator
 from ai_comment_generator import get_ai_generator
 
+# Import media helpers
+import image_derivatives
+import ingest_pool
+from thumbnails import generate_video_thumbnail
+from ingest import (generate_unique_filename, generate_video_filename, ingest_track, save_track_cover,
+                    hash_stream, hash_file, find_duplicate_video, find_duplicate_track, link_to_playlist,
+                    enqueue_video_batch, batch_video_nickname, allowed_files_message,
+                    VIDEO_EXTENSIONS, AUDIO_EXTENSIONS)
+from image_cache import ImageCache, static_version
+from compression import CompressionMiddleware
+from assets import AssetManifest, ASSET_BUNDLES, build_assets, concat_sources, precompressed_variant
+from file_handles import FileHandleCache
+from page_cache import PageCache, install_invalidation, invalidate
+from feed import (feed_page, count_items, artists_by_track, parse_fields, parse_types, FeedQueryError,
+                  DEFAULT_LIMIT, MAX_LIMIT)
+from markdown_render import render_markdown, render_uncached, markdown_cache, MARKDOWN_EXTENSIONS
+from media_delivery import offload_response, delivery_mode, DEFAULT_ACCEL_PREFIX
+from storage import get_storage, publish_media, DEFAULT_URL_SECONDS
+from media_metadata import format_duration, format_file_size, probe_metadata
+from transcode import probe_plan, estimate_plan
+from smart_trim import plan_trim, enqueue_trim
+from audio_extract import AudioExtraction, ExtractionError, extract_zip
+from reconcile import reconcile, format_report, ReconcileError, TooManyMissing, ORPHAN_MIN_AGE_SECONDS, MAX_MISSING_SHARE
+from storage_layout import sharded_path, sharded_rel_path, shard_target, move_file, migrate_rows
+from jobs import JobWorkerPool, run_jobs_until_idle, JOB_WORKERS
+from storyboard import (safe_generate_storyboard, remove_storyboard, has_storyboard, storyboard_index_rel_path,
+                        migrate_legacy_storyboard)
+
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///videos.db'
+# Background job workers write concurrently with requests; wait for locks instead of failing
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': 30}}
 app.config['UPLOAD_FOLDER'] = os.path.join(app.root_path, 'uploads')
 app.config['STEALTH_UPLOAD_FOLDER'] = os.path.join(app.root_path, 'stealth_uploads')
 app.config['AUDIO_UPLOAD_FOLDER'] = os.path.join(app.root_path, 'uploads_audio')
 app.config['STEALTH_AUDIO_UPLOAD_FOLDER'] = os.path.join(app.root_path, 'stealth_audio_uploads')
 app.config['COVER_FOLDER'] = os.path.join(app.static_folder, 'covers')
 app.config['AVATAR_FOLDER'] = os.path.join(app.static_folder, 'avatars')
+# Who sends media bytes: 'direct' (this app), 'x-accel' (nginx) or 'x-sendfile'; see media_delivery.py
+app.config['MEDIA_DELIVERY'] = delivery_mode(os.environ.get('EASYCORE_MEDIA_DELIVERY'))
+app.config['MEDIA_ACCEL_PREFIX'] = os.environ.get('EASYCORE_MEDIA_ACCEL_PREFIX', DEFAULT_ACCEL_PREFIX)
+# Where ingested media is kept: 'local' or 's3' (any S3-compatible store); see storage.py
+app.config['STORAGE_BACKEND'] = os.environ.get('EASYCORE_STORAGE', 'local')
+app.config['S3_BUCKET'] = os.environ.get('EASYCORE_S3_BUCKET')
+app.config['S3_ENDPOINT_URL'] = os.environ.get('EASYCORE_S3_ENDPOINT_URL')  # e.g. http://localhost:9000 for MinIO
+app.config['S3_REGION'] = os.environ.get('EASYCORE_S3_REGION')
+app.config['S3_PREFIX'] = os.environ.get('EASYCORE_S3_PREFIX', '')
+app.config['S3_URL_SECONDS'] = int(os.environ.get('EASYCORE_S3_URL_SECONDS', DEFAULT_URL_SECONDS))
+# gzip/Brotli for HTML, JSON and other text responses; set EASYCORE_COMPRESSION=0
+# when a front proxy compresses instead (see compression.py)
+app.config['RESPONSE_COMPRESSION'] = os.environ.get('EASYCORE_COMPRESSION', '1') != '0'
+# Run background jobs inside the WSGI server process (create_app); off by default, in
+# which case `flask run-jobs` must run next to the server (see create_app)
+app.config['WEB_JOB_WORKERS'] = os.environ.get('EASYCORE_WEB_JOB_WORKERS', '0') == '1'
+
+response_compression = CompressionMiddleware(app.wsgi_app)
+if app.config['RESPONSE_COMPRESSION']:
+    app.wsgi_app = response_compression
 
 # Initialize the db with this app
 db.init_app(app)
@@ -40,13 +93,15 @@ app.register_blueprint(video_bp, url_prefix='/video')
 app.register_blueprint(playlist_bp, url_prefix='/playlist')
 app.register_blueprint(comment_bp, url_prefix='/comment')
 app.register_blueprint(filter_bp, url_prefix='/filter')
+app.register_blueprint(upload_bp, url_prefix='/uploads')
+app.register_blueprint(jobs_bp, url_prefix='/jobs')
 
 # Add markdown filter
 @app.template_filter('markdown')
 def markdown_filter(text):
     if not text:
         return ''
-    return markdown.markdown(text, extensions=['nl2br', 'fenced_code'])
+    return Markup(render_markdown(text))
 
 def slugify_author(author_name: str) -> str:
     """Create a URL-safe slug from an author name.
@@ -91,6 +146,131 @@ def get_or_create_artist_by_name(artist_name: str) -> Artist:
 
 # Expose slugify to templates
 app.jinja_env.filters['slugify'] = slugify_author
+# Stored media metadata, e.g. {{ video.duration|duration }}
+app.jinja_env.filters['duration'] = format_duration
+app.jinja_env.filters['filesize'] = format_file_size
+
+def static_url(rel_path):
+    """url_for('static') with a version that changes with the file, so it can be cached forever."""
+    version = static_version(os.path.join(app.static_folder, rel_path))
+    if version:
+        return url_for('static', filename=rel_path, v=version)
+    return url_for('static', filename=rel_path)
+
+asset_manifest = AssetManifest(app.static_folder)
+
+def asset_url(filename):
+    """URL of a stylesheet, script or bundle (see assets.py): the minified,
+    fingerprinted build when build-assets has run, the source otherwise."""
+    built = asset_manifest.lookup(filename)
+    if built:
+        return url_for('serve_asset', filename=built)
+    if filename in ASSET_BUNDLES:
+        versions = '.'.join(static_version(os.path.join(app.static_folder, source)) or ''
+                            for source in ASSET_BUNDLES[filename])
+        return url_for('serve_asset', filename=filename, v=hashlib.sha1(versions.encode()).hexdigest()[:10])
+    return static_url(filename)
+
+def image_url(rel_path, width=320, ext='jpg'):
+    """URL of the smallest derivative at least `width` wide, or the original."""
+    if not rel_path:
+        return ''
+    widths = image_derivatives.available_widths(rel_path, app.static_folder)
+    if not widths:
+        return static_url(rel_path)
+    chosen = next((w for w in widths if w >= width), widths[-1])
+    return static_url(image_derivatives.derivative_rel_path(rel_path, chosen, ext))
+
+def image_srcset(rel_path, ext='jpg'):
+    """srcset value listing every derivative of rel_path in the given format."""
+    if not rel_path:
+        return ''
+    return ', '.join(
+        f"{static_url(image_derivatives.derivative_rel_path(rel_path, w, ext))} {w}w"
+        for w in image_derivatives.available_widths(rel_path, app.static_folder)
+    )
+
+# Expose responsive image helpers to templates
+app.jinja_env.globals['image_url'] = image_url
+app.jinja_env.globals['image_srcset'] = image_srcset
+app.jinja_env.globals['static_url'] = static_url
+app.jinja_env.globals['asset_url'] = asset_url
+
+# id -> thumbnail file/ETag map plus hot thumbnail bytes, shared by request threads
+thumbnail_cache = ImageCache()
+# Open descriptors of the videos/tracks being streamed, reused across Range requests
+stream_handles = FileHandleCache()
+# Rendered browse pages, invalidated by writes from any worker (see page_cache.py)
+page_cache = PageCache()
+install_invalidation()
+
+def range_response(path, mime_type):
+    """Serve a media file, honouring a Range header from cached descriptors"""
+    # Published to object storage: the store sends the bytes
+    remote_url = get_storage().stream_url(path, mime_type)
+    if remote_url:
+        resp = redirect(remote_url)
+        # Never cache the redirect longer than the presigned URL lives
+        resp.headers.set('Cache-Control', 'private, max-age=60')
+        return resp
+
+    offloaded = offload_response(path, mime_type)
+    if offloaded is not None:
+        return offloaded
+
+    range_header = request.headers.get('Range', None)
+    match = re.search(r'(\d*)-(\d*)', range_header) if range_header else None
+    if not match or not any(match.groups()):
+        return send_file(path, mimetype=mime_type)
+
+    first, last = match.groups()
+    try:
+        if first:
+            chunks, byte1, byte2, file_size = stream_handles.open_range(path, int(first), int(last) if last else None)
+        else:
+            # Suffix range: the last N bytes
+            file_size = os.path.getsize(path)
+            chunks, byte1, byte2, file_size = stream_handles.open_range(path, max(0, file_size - int(last)), None)
+    except ValueError:
+        resp = make_response('', 416)
+        resp.headers.set('Content-Range', f'bytes */{os.path.getsize(path)}')
+        return resp
+
+    resp = Response(chunks, status=206, mimetype=mime_type, direct_passthrough=True)
+    resp.headers.set('Content-Range', f'bytes {byte1}-{byte2}/{file_size}')
+    resp.headers.set('Accept-Ranges', 'bytes')
+    resp.headers.set('Content-Length', str(byte2 - byte1 + 1))
+    return resp
+
+@app.after_request
+def cache_versioned_static(response):
+    # Versioned static URLs change whenever the content does
+    if request.endpoint == 'static' and request.args.get('v') and response.status_code == 200:
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+@app.route('/assets/<path:filename>')
+def serve_asset(filename):
+    """Built assets, precompressed when the client accepts it; without a
+    build, bundles are concatenated from their sources"""
+    if filename in ASSET_BUNDLES:
+        resp = Response(concat_sources(ASSET_BUNDLES[filename], app.static_folder),
+                        mimetype=mimetypes.guess_type(filename)[0])
+        resp.headers['Cache-Control'] = 'no-cache'
+        return resp
+    if not filename.startswith('build/'):
+        abort(404)
+    abs_path = safe_join(app.static_folder, filename)
+    if abs_path is None or not os.path.isfile(abs_path):
+        abort(404)
+    path, encoding = precompressed_variant(abs_path, request.accept_encodings)
+    resp = send_file(path, mimetype=mimetypes.guess_type(filename)[0], conditional=True)
+    if encoding:
+        resp.headers['Content-Encoding'] = encoding
+    resp.headers['Vary'] = 'Accept-Encoding'
+    # Built names carry a content hash
+    resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return resp
 
 @app.route('/artist/<artist_name>')
 def artist_by_name(artist_name: str):
@@ -119,10 +299,9 @@ def upload_artist_avatar(artist_id: int):
             return redirect(url_for('artist_detail', artist_id=artist_id))
 
         filename = secure_filename(f"artist_{artist_id}_{uuid.uuid4().hex}{ext}")
-        abs_path = os.path.join(app.config['AVATAR_FOLDER'], filename)
-        os.makedirs(app.config['AVATAR_FOLDER'], exist_ok=True)
-        avatar.save(abs_path)
-        rel_path = os.path.join('avatars', filename).replace('\\', '/')
+        avatar.save(sharded_path(app.config['AVATAR_FOLDER'], filename))
+        rel_path = sharded_rel_path('avatars', filename)
+        image_derivatives.safe_generate_derivatives(rel_path, app.static_folder)
 
         artist.avatar_path = rel_path
         db.session.commit()
@@ -138,53 +317,6 @@ def ensure_directories_exist():
     os.makedirs(app.config['COVER_FOLDER'], exist_ok=True)
     os.makedirs(app.config['AVATAR_FOLDER'], exist_ok=True)
 
-def convert_webm_to_mp4(input_path):
-    """Convert WebM file to MP4 and return the new filepath"""
-    output_path = os.path.splitext(input_path)[0] + '.mp4'
-    try:
-        (
-            ffmpeg
-            .input(input_path)
-            .output(output_path, acodec='aac', vcodec='h264', **{'b:v': '2M'})
-            .overwrite_output()
-            .run(capture_stdout=True, capture_stderr=True)
-        )
-        os.remove(input_path)  # Remove original WebM file
-        return output_path
-    except ffmpeg.Error as e:
-        print(f"Error converting WebM to MP4: {e.stderr.decode()}")
-        raise
-
-def generate_unique_filename(original_filename, upload_folder):
-    """Generate a unique filename by adding timestamp and random string if needed"""
-    name, ext = os.path.splitext(original_filename)
-    filename = secure_filename(name + ext)
-    filepath = os.path.join(upload_folder, filename)
-    
-    # If file already exists, add timestamp and random string
-    if os.path.exists(filepath):
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        random_string = ''.join(random.choices(string.ascii_lowercase + string.digits, k=4))
-        filename = secure_filename(f"{name}_{timestamp}_{random_string}{ext}")
-        filepath = os.path.join(upload_folder, filename)
-    
-    return filename, filepath
-
-def generate_video_filename(extension, upload_folder):
-    """Generate a unique video filename using yyyymmdd format + random characters"""
-    date_str = datetime.now().strftime('%Y%m%d')
-    random_string = ''.join(random.choices(string.ascii_lowercase + string.digits, k=8))
-    filename = secure_filename(f"{date_str}_{random_string}{extension}")
-    filepath = os.path.join(upload_folder, filename)
-    
-    # If file already exists, add more random characters to ensure uniqueness
-    while os.path.exists(filepath):
-        random_string = ''.join(random.choices(string.ascii_lowercase + string.digits, k=8))
-        filename = secure_filename(f"{date_str}_{random_string}{extension}")
-        filepath = os.path.join(upload_folder, filename)
-    
-    return filename, filepath
-
 def get_mime_type_for_audio(file_path):
     ext = os.path.splitext(file_path)[1].lower()
     if ext in ['.mp3']:  # default and most common
@@ -215,6 +347,7 @@ def get_related_tracks(current_track, limit=8):
     return [track for track, score in track_scores[:limit]]
 
 @app.route('/artists')
+@page_cache.cached('artists')
 def artists_index():
     page = request.args.get('page', 1, type=int)
     per_page = 20
@@ -260,40 +393,26 @@ def artists_index():
     return render_template('artists.html', artists_with_stats=paginated_artists_with_stats, page=page, total_pages=total_pages)
 
 @app.route('/tracks')
+@page_cache.cached('tracks')
 def tracks_index():
     page = request.args.get('page', 1, type=int)
     artist = request.args.get('artist')
     sort_by = request.args.get('sort', 'newest')
     per_page = 20
     
-    # Base query for tracks
-    query = Track.query
-    
-    # Filter by artist if specified
-    if artist:
-        query = query.join(TrackArtist).join(Artist).filter(Artist.name.ilike(f'%{artist}%'))
-    
-    # Apply sorting
-    if sort_by == 'newest':
-        query = query.order_by(desc(Track.id))
-    elif sort_by == 'oldest':
-        query = query.order_by(Track.id)
-    elif sort_by == 'most_viewed':
-        query = query.order_by(desc(Track.view_count))
-    elif sort_by == 'most_liked':
-        query = query.order_by(desc(Track.likes))
-    
-    tracks = query.paginate(page=page, per_page=per_page, error_out=False)
+    # Optionally only the tracks of matching artists
+    tracks = feed_page(sort_by, per_page, offset=(max(page, 1) - 1) * per_page, types=('track',), artist=artist)
+    total_pages = (count_items(('track',), artist=artist) + per_page - 1) // per_page
     
     # Get artists for each track
-    track_artists = {}
-    for track in tracks.items:
-        track_artists[track.id] = db.session.query(Artist).join(TrackArtist).filter(TrackArtist.track_id == track.id).all()
+    track_artists = artists_by_track(item['id'] for item in tracks.items)
     
     return render_template('tracks.html', 
-                         tracks=tracks.items, 
+                         tracks=[item['object'] for item in tracks.items], 
                          page=page, 
-                         total_pages=tracks.pages,
+                         per_page=per_page,
+                         total_pages=total_pages,
+                         next_cursor=tracks.next_cursor,
                          artist=artist,
                          sort_by=sort_by,
                          track_artists=track_artists)
@@ -448,10 +567,9 @@ def add_artist():
                 ext = os.path.splitext(avatar.filename)[1].lower()
                 if ext in ['.jpg', '.jpeg', '.png', '.webp']:
                     filename = secure_filename(f"avatar_{uuid.uuid4().hex}{ext}")
-                    abs_path = os.path.join(app.config['AVATAR_FOLDER'], filename)
-                    os.makedirs(app.config['AVATAR_FOLDER'], exist_ok=True)
-                    avatar.save(abs_path)
-                    avatar_path_rel = os.path.join('avatars', filename).replace('\\', '/')
+                    avatar.save(sharded_path(app.config['AVATAR_FOLDER'], filename))
+                    avatar_path_rel = sharded_rel_path('avatars', filename)
+                    image_derivatives.safe_generate_derivatives(avatar_path_rel, app.static_folder)
             artist = Artist(name=name, bio=bio, avatar_path=avatar_path_rel)
             db.session.add(artist)
             db.session.commit()
@@ -478,8 +596,7 @@ def add_track():
 
         original_filepath = file.filename
         original_extension = os.path.splitext(original_filepath)[1].lower()
-        allowed_audio_exts = ['.mp3', '.wav', '.ogg', '.oga', '.flac', '.m4a', '.aac']
-        if original_extension not in allowed_audio_exts:
+        if original_extension not in AUDIO_EXTENSIONS:
             return jsonify({"error": "Unsupported audio format"}), 400
 
         base_filename = secure_filename((nickname or os.path.splitext(original_filepath)[0]) + original_extension)
@@ -487,40 +604,27 @@ def add_track():
         new_filename, stored_filepath = generate_unique_filename(base_filename, upload_folder)
 
         try:
+            # Same bytes uploaded before: point at the existing track instead
+            content_hash = hash_stream(file.stream)
+            duplicate = find_duplicate_track(content_hash, upload_folder)
+            if duplicate:
+                return jsonify({"success": True, "track_id": duplicate.id, "duplicate": True}), 200
+
             os.makedirs(upload_folder, exist_ok=True)
             file.save(stored_filepath)
 
             # Optional background image upload
-            relative_cover_path = None
-            if background and background.filename:
-                cover_ext = os.path.splitext(background.filename)[1].lower()
-                if cover_ext in ['.jpg', '.jpeg', '.png', '.webp']:
-                    cover_filename = secure_filename(f"cover_{os.path.splitext(new_filename)[0]}{cover_ext}")
-                    cover_path = os.path.join(app.config['COVER_FOLDER'], cover_filename)
-                    os.makedirs(app.config['COVER_FOLDER'], exist_ok=True)
-                    background.save(cover_path)
-                    relative_cover_path = os.path.join('covers', cover_filename).replace('\\', '/')
-
-            new_track = Track(
-                original_filepath=original_filepath,
-                stored_filepath=stored_filepath,
-                nickname=nickname,
-                description=description,
-                tags=tags,
-                background_image_path=relative_cover_path,
-                view_count=0,
-                likes=0,
-            )
-            db.session.add(new_track)
-            # Optional artist association (create if missing)
-            if artist_name:
-                artist = Artist.query.filter(Artist.name.ilike(artist_name)).first()
-                if not artist:
-                    artist = Artist(name=artist_name)
-                    db.session.add(artist)
-                    db.session.flush()
-                db.session.add(TrackArtist(track_id=new_track.id, artist_id=artist.id))
+            relative_cover_path = save_track_cover(background, new_filename, app.config['COVER_FOLDER'], app.static_folder)
+
+            new_track = ingest_track(stored_filepath, original_filepath,
+                                     nickname=nickname,
+                                     description=description,
+                                     tags=tags,
+                                     artist_name=artist_name,
+                                     background_image_path=relative_cover_path,
+                                     content_hash=content_hash)
             db.session.commit()
+            publish_media(new_track.stored_filepath)
 
             return jsonify({"success": True, "track_id": new_track.id}), 200
         except Exception as e:
@@ -534,30 +638,7 @@ def add_track():
 def stream_track(track_id):
     track = Track.query.get_or_404(track_id)
     mime_type = get_mime_type_for_audio(track.stored_filepath)
-    range_header = request.headers.get('Range', None)
-    file_size = os.path.getsize(track.stored_filepath)
-    if range_header:
-        byte1, byte2 = 0, None
-        match = re.search(r'(\d+)-(\d*)', range_header)
-        groups = match.groups()
-        if groups[0]:
-            byte1 = int(groups[0])
-        if groups[1]:
-            byte2 = int(groups[1])
-        if byte2 is None:
-            byte2 = file_size - 1
-        length = byte2 - byte1 + 1
-        with open(track.stored_filepath, 'rb') as f:
-            f.seek(byte1)
-            data = f.read(length)
-        resp = make_response(data)
-        resp.headers.set('Content-Type', mime_type)
-        resp.headers.set('Content-Range', f'bytes {byte1}-{byte2}/{file_size}')
-        resp.headers.set('Accept-Ranges', 'bytes')
-        resp.headers.set('Content-Length', str(length))
-        return resp, 206
-    else:
-        return send_file(track.stored_filepath, mimetype=mime_type)
+    return range_response(track.stored_filepath, mime_type)
 
 @app.route('/track/<int:track_id>')
 def track_detail(track_id):
@@ -595,16 +676,13 @@ def update_track_photo(track_id):
     try:
         # Generate unique filename
         cover_filename = secure_filename(f"cover_{track.id}_{os.path.splitext(photo.filename)[0]}{cover_ext}")
-        cover_path = os.path.join(app.config['COVER_FOLDER'], cover_filename)
-        
-        # Ensure cover directory exists
-        os.makedirs(app.config['COVER_FOLDER'], exist_ok=True)
         
-        # Save the new photo
-        photo.save(cover_path)
+        # Save the new photo (the shard folder is created as needed)
+        photo.save(sharded_path(app.config['COVER_FOLDER'], cover_filename))
         
         # Update track with new background image path
-        relative_cover_path = os.path.join('covers', cover_filename).replace('\\', '/')
+        relative_cover_path = sharded_rel_path('covers', cover_filename)
+        image_derivatives.safe_generate_derivatives(relative_cover_path, app.static_folder)
         track.background_image_path = relative_cover_path
         db.session.commit()
         
@@ -794,7 +872,7 @@ def update_artist_bio(artist_id):
         db.session.commit()
         
         # Convert markdown to HTML for preview
-        bio_html = markdown.markdown(bio, extensions=['nl2br', 'fenced_code']) if bio else ''
+        bio_html = render_markdown(bio)
         
         return jsonify({
             "success": True,
@@ -909,83 +987,26 @@ def get_ai_comment_prompts():
         }), 500
 
 @app.route('/')
+@page_cache.cached('feed')
 def index():
     page = request.args.get('page', 1, type=int)
     sort_by = request.args.get('sort', 'newest')  # Default sort by newest
     per_page = 10
 
-    # Get both videos and tracks
-    video_query = Video.query
-    track_query = Track.query
-
-    # Apply sorting to videos
-    if sort_by == 'newest':
-        video_query = video_query.order_by(desc(Video.id))
-        track_query = track_query.order_by(desc(Track.id))
-    elif sort_by == 'oldest':
-        video_query = video_query.order_by(Video.id)
-        track_query = track_query.order_by(Track.id)
-    elif sort_by == 'most_viewed':
-        video_query = video_query.order_by(desc(Video.view_count))
-        track_query = track_query.order_by(desc(Track.view_count))
-    elif sort_by == 'most_liked':
-        video_query = video_query.order_by(desc(Video.likes))
-        track_query = track_query.order_by(desc(Track.likes))
-
-    # Get all videos and tracks
-    all_videos = video_query.all()
-    all_tracks = track_query.all()
-    
-    # Combine and sort by creation time (using id as proxy)
-    combined_content = []
-    
-    # Add videos with type indicator
-    for video in all_videos:
-        combined_content.append({
-            'type': 'video',
-            'id': video.id,
-            'object': video,
-            'sort_key': video.id
-        })
-    
-    # Add tracks with type indicator
-    for track in all_tracks:
-        combined_content.append({
-            'type': 'track',
-            'id': track.id,
-            'object': track,
-            'sort_key': track.id
-        })
-    
-    # Sort combined content by sort_key (id) in descending order for newest first
-    if sort_by == 'newest':
-        combined_content.sort(key=lambda x: x['sort_key'], reverse=True)
-    elif sort_by == 'oldest':
-        combined_content.sort(key=lambda x: x['sort_key'])
-    elif sort_by == 'most_viewed':
-        combined_content.sort(key=lambda x: x['object'].view_count or 0, reverse=True)
-    elif sort_by == 'most_liked':
-        combined_content.sort(key=lambda x: x['object'].likes or 0, reverse=True)
-    
-    # Manual pagination
-    start_idx = (page - 1) * per_page
-    end_idx = start_idx + per_page
-    paginated_content = combined_content[start_idx:end_idx]
-    
-    # Calculate total pages
-    total_items = len(combined_content)
-    total_pages = (total_items + per_page - 1) // per_page
-    
-    # Get artists for each track in the paginated content
-    track_artists = {}
-    for item in paginated_content:
-        if item['type'] == 'track':
-            track_artists[item['id']] = db.session.query(Artist).join(TrackArtist).filter(TrackArtist.track_id == item['id']).all()
-    
+    # Videos and tracks merged and paged in SQL; the infinite scroll goes on
+    # from next_cursor through /api/v1/feed in the same order
+    feed = feed_page(sort_by, per_page, offset=(max(page, 1) - 1) * per_page)
+    total_pages = (count_items() + per_page - 1) // per_page
+
+    # Get artists for each track in the page
+    track_artists = artists_by_track(item['id'] for item in feed.items if item['type'] == 'track')
+
     return render_template('index.html', 
-                         content=paginated_content, 
+                         content=feed.items, 
                          page=page, 
+                         per_page=per_page,
                          total_pages=total_pages, 
+                         next_cursor=feed.next_cursor,
                          tag=None,
                          sort_by=sort_by,
                          track_artists=track_artists)
@@ -1000,35 +1021,7 @@ def stream_video(video_id):
     file_extension = os.path.splitext(video.stored_filepath)[1].lower()
     mime_type = 'video/webm' if file_extension == '.webm' else 'video/mp4'
     
-    range_header = request.headers.get('Range', None)
-    file_size = os.path.getsize(video.stored_filepath)
-
-    if range_header:
-        byte1, byte2 = 0, None
-        match = re.search(r'(\d+)-(\d*)', range_header)
-        groups = match.groups()
-
-        if groups[0]:
-            byte1 = int(groups[0])
-        if groups[1]:
-            byte2 = int(groups[1])
-
-        if byte2 is None:
-            byte2 = file_size - 1
-        length = byte2 - byte1 + 1
-
-        with open(video.stored_filepath, 'rb') as f:
-            f.seek(byte1)
-            data = f.read(length)
-
-        resp = make_response(data)
-        resp.headers.set('Content-Type', mime_type)  # Use dynamic mime type
-        resp.headers.set('Content-Range', f'bytes {byte1}-{byte2}/{file_size}')
-        resp.headers.set('Accept-Ranges', 'bytes')
-        resp.headers.set('Content-Length', str(length))
-        return resp, 206
-    else:
-        return send_file(video.stored_filepath, mimetype=mime_type)  # Use dynamic mime type
+    return range_response(video.stored_filepath, mime_type)
 
 @app.route('/filter')
 def filter_videos():
@@ -1038,87 +1031,18 @@ def filter_videos():
     if tag:
         return redirect(url_for('tag_detail', tag=tag))
     
-    # Otherwise, continue with the existing filtering logic
-    page = request.args.get('page', 1, type=int)
-    sort_by = request.args.get('sort', 'newest')
-    per_page = 10
-
-    # Get both videos and tracks
-    video_query = Video.query
-    track_query = Track.query
-
-    # Apply sorting to videos
-    if sort_by == 'newest':
-        video_query = video_query.order_by(desc(Video.id))
-        track_query = track_query.order_by(desc(Track.id))
-    elif sort_by == 'oldest':
-        video_query = video_query.order_by(Video.id)
-        track_query = track_query.order_by(Track.id)
-    elif sort_by == 'most_viewed':
-        video_query = video_query.order_by(desc(Video.view_count))
-        track_query = track_query.order_by(desc(Track.view_count))
-    elif sort_by == 'most_liked':
-        video_query = video_query.order_by(desc(Video.likes))
-        track_query = track_query.order_by(desc(Track.likes))
-
-    # Get all videos and tracks
-    all_videos = video_query.all()
-    all_tracks = track_query.all()
-    
-    # Combine and sort by creation time (using id as proxy)
-    combined_content = []
-    
-    # Add videos with type indicator
-    for video in all_videos:
-        combined_content.append({
-            'type': 'video',
-            'id': video.id,
-            'object': video,
-            'sort_key': video.id
-        })
-    
-    # Add tracks with type indicator
-    for track in all_tracks:
-        combined_content.append({
-            'type': 'track',
-            'id': track.id,
-            'object': track,
-            'sort_key': track.id
-        })
-    
-    # Sort combined content by sort_key (id) in descending order for newest first
-    if sort_by == 'newest':
-        combined_content.sort(key=lambda x: x['sort_key'], reverse=True)
-    elif sort_by == 'oldest':
-        combined_content.sort(key=lambda x: x['sort_key'])
-    elif sort_by == 'most_viewed':
-        combined_content.sort(key=lambda x: x['object'].view_count or 0, reverse=True)
-    elif sort_by == 'most_liked':
-        combined_content.sort(key=lambda x: x['object'].likes or 0, reverse=True)
-    
-    # Manual pagination
-    start_idx = (page - 1) * per_page
-    end_idx = start_idx + per_page
-    paginated_content = combined_content[start_idx:end_idx]
-    
-    # Calculate total pages
-    total_items = len(combined_content)
-    total_pages = (total_items + per_page - 1) // per_page
-    
-    return render_template('index.html', 
-                         content=paginated_content, 
-                         page=page, 
-                         total_pages=total_pages,
-                         tag=tag,
-                         sort_by=sort_by)
+    # Without a tag this is the library feed itself
+    return redirect(url_for('index', page=request.args.get('page', 1, type=int),
+                            sort=request.args.get('sort', 'newest')))
 
 @app.route('/delete/<int:video_id>', methods=['POST'])
 def delete_video(video_id):
     video = Video.query.get_or_404(video_id)
     try:
         # Delete the file
-        if os.path.exists(video.stored_filepath):
-            os.remove(video.stored_filepath)
+        get_storage().delete(video.stored_filepath)
+        remove_storyboard(video.stored_filepath, app.static_folder)
+        thumbnail_cache.invalidate_prefix(('video', video.id))
         
         # Delete the database entry
         db.session.delete(video)
@@ -1133,8 +1057,7 @@ def delete_track(track_id):
     track = Track.query.get_or_404(track_id)
     try:
         # Delete the file
-        if os.path.exists(track.stored_filepath):
-            os.remove(track.stored_filepath)
+        get_storage().delete(track.stored_filepath)
         
         # Delete the database entry
         db.session.delete(track)
@@ -1219,9 +1142,38 @@ def get_tag_suggestions():
 
 @app.route('/thumbnail/<int:video_id>')
 def serve_thumbnail(video_id):
-    video = Video.query.get_or_404(video_id)
-    thumbnail_path = os.path.join(app.static_folder, video.thumbnail_path)
-    return send_file(thumbnail_path, mimetype='image/jpeg')
+    width = request.args.get('w', type=int)
+    key = ('video', video_id, width)
+    entry = thumbnail_cache.lookup(key)
+    if entry is None:
+        thumbnail_rel = db.session.query(Video.thumbnail_path).filter(Video.id == video_id).scalar()
+        if not thumbnail_rel:
+            abort(404)
+        if width:
+            widths = image_derivatives.available_widths(thumbnail_rel, app.static_folder)
+            if widths:
+                chosen = next((w for w in widths if w >= width), widths[-1])
+                thumbnail_rel = image_derivatives.derivative_rel_path(thumbnail_rel, chosen, 'jpg')
+        thumbnail_path = os.path.join(app.static_folder, thumbnail_rel)
+        if not os.path.exists(thumbnail_path):
+            abort(404)
+        entry = thumbnail_cache.remember(key, thumbnail_path)
+
+    if entry.etag in request.if_none_match:
+        resp = make_response('', 304)
+    else:
+        # A front proxy, when configured, sends the bytes; otherwise memory or disk
+        resp = offload_response(entry.path, 'image/jpeg')
+        if resp is None:
+            data = thumbnail_cache.read(entry)
+            if data is None:
+                resp = send_file(entry.path, mimetype='image/jpeg', conditional=False, etag=False)
+            else:
+                resp = make_response(data)
+                resp.headers.set('Content-Type', 'image/jpeg')
+    resp.set_etag(entry.etag)
+    resp.headers.set('Cache-Control', 'public, max-age=86400')
+    return resp
 
 @app.route('/increment_view/<int:video_id>', methods=['POST'])
 def increment_view(video_id):
@@ -1240,18 +1192,28 @@ def bulk_upload():
         
         if not uploaded_files:
             return jsonify({"error": "No files provided"}), 400
+        if not ingest_pool.admission_check(len(uploaded_files)):
+            return ingest_pool.busy_response()
         
         successful_uploads = 0
         errors = []
+        duplicates = []
+        batch_items = []
 
         for file in uploaded_files:
             if isinstance(file, FileStorage) and file.filename != '':
                 original_extension_lower = os.path.splitext(file.filename)[1].lower()
-                if original_extension_lower not in ['.mp4', '.webm']:
-                    errors.append(f"Skipped {file.filename}: Only MP4 and WebM files are allowed")
+                if original_extension_lower not in VIDEO_EXTENSIONS:
+                    errors.append(f"Skipped {file.filename}: {allowed_files_message(VIDEO_EXTENSIONS)}")
                     continue
 
                 try:
+                    content_hash = hash_stream(file.stream)
+                    duplicate = find_duplicate_video(content_hash, app.config['STEALTH_UPLOAD_FOLDER'])
+                    if duplicate:
+                        duplicates.append({"filename": file.filename, "video_id": duplicate.id})
+                        continue
+
                     original_extension = os.path.splitext(file.filename)[1]
                     new_filename, stored_filepath = generate_video_filename(
                         original_extension,
@@ -1260,97 +1222,64 @@ def bulk_upload():
                     
                     os.makedirs(app.config['STEALTH_UPLOAD_FOLDER'], exist_ok=True)
                     file.save(stored_filepath)
-                    
-                    # Convert WebM to MP4 if necessary
-                    if original_extension_lower == '.webm':
-                        stored_filepath = convert_webm_to_mp4(stored_filepath)
-                        new_filename = os.path.basename(stored_filepath)
-
-                    # Generate thumbnail
-                    thumbnail_filename = f"thumbnail_{os.path.splitext(new_filename)[0]}.jpg"
-                    thumbnails_dir = os.path.join(app.static_folder, 'thumbnails')
-                    os.makedirs(thumbnails_dir, exist_ok=True)
-                    thumbnail_path = os.path.join(thumbnails_dir, thumbnail_filename)
-                    
-                    # Get video duration more robustly
-                    probe = ffmpeg.probe(stored_filepath)
-                    duration = None
-                    # Try different methods to get duration
-                    for stream in probe['streams']:
-                        if 'duration' in stream:
-                            duration = float(stream['duration'])
-                            break
-                    
-                    # If duration not found in streams, try format
-                    if duration is None and 'format' in probe and 'duration' in probe['format']:
-                        duration = float(probe['format']['duration'])
-                    
-                    # If still no duration, use a default timestamp
-                    if duration is None:
-                        duration = 0
-                    
-                    # Extract middle frame
-                    (
-                        ffmpeg
-                        .input(stored_filepath, ss=duration/2 if duration > 0 else 0)
-                        .filter('scale', 320, -1)
-                        .output(thumbnail_path, vframes=1)
-                        .overwrite_output()
-                        .run(capture_stdout=True, capture_stderr=True)
-                    )
-                    
-                    # Set the thumbnail_path to be relative to the static folder
-                    relative_thumbnail_path = os.path.join('thumbnails', thumbnail_filename).replace('\\', '/')
-                    
-                    new_video = Video(
-                        original_filepath=file.filename, 
-                        stored_filepath=stored_filepath,
-                        thumbnail_path=relative_thumbnail_path,
-                        view_count=0
-                    )
-                    db.session.add(new_video)
+
+                    batch_items.append({"stored_filepath": stored_filepath,
+                                        "original_filepath": file.filename,
+                                        "content_hash": content_hash})
                     successful_uploads += 1
                 except Exception as e:
                     errors.append(f"Error uploading {file.filename}: {str(e)}")
         
-        db.session.commit()
+        # One background job processes the files in parallel and inserts them together
+        job_ids = []
+        if batch_items:
+            job = enqueue_video_batch(batch_items)
+            db.session.commit()
+            job_ids.append(job.id)
         
         return jsonify({
             "success": True,
             "uploaded": successful_uploads,
+            "jobs": job_ids,
+            "duplicates": duplicates,
             "errors": errors
-        }), 200
+        }), 202
 
     return render_template('bulk_upload.html')
 
+@app.route('/stream_stats')
+def stream_stats():
+    """Hit rate and throughput of the streaming descriptor cache (this process)"""
+    return jsonify(stream_handles.stats())
+
+@app.route('/compression_stats')
+def compression_stats():
+    """Responses compressed and bytes saved by the compression middleware (this process)"""
+    return jsonify(response_compression.stats())
+
+@app.route('/page_cache_stats')
+def page_cache_stats():
+    """Hit rate and size of the rendered page cache (this process)"""
+    return jsonify(page_cache.stats())
+
 @app.route('/cleanup_stealth', methods=['POST'])
 def cleanup_stealth():
     try:
-        # Get all videos in stealth folder
-        stealth_videos = Video.query.filter(
-            Video.stored_filepath.like(f"{app.config['STEALTH_UPLOAD_FOLDER']}%")
-        ).all()
-        
-        deleted_count = 0
-        for video in stealth_videos:
-            # Check if file exists
-            if not os.path.exists(video.stored_filepath):
-                # Delete thumbnail if it exists
-                if video.thumbnail_path:
-                    thumbnail_path = os.path.join(app.static_folder, video.thumbnail_path)
-                    if os.path.exists(thumbnail_path):
-                        os.remove(thumbnail_path)
-                
-                # Delete database entry
-                db.session.delete(video)
-                deleted_count += 1
-        
-        db.session.commit()
+        # One scan of the stealth folder, diffed against the stealth video rows
+        report = reconcile(app.config, app.static_folder, roots=[app.config['STEALTH_UPLOAD_FOLDER']],
+                           fix=True, remove_orphans=False, force=request.form.get('force') == '1')
+        for video_id in report['deleted_video_ids']:
+            thumbnail_cache.invalidate_prefix(('video', video_id))
+
+        deleted_count = len(report['deleted_video_ids'])
         return jsonify({
             "success": True,
             "deleted_count": deleted_count,
             "message": f"Cleaned up {deleted_count} missing video entries"
         }), 200
+    except TooManyMissing as e:
+        # The client asks before confirming with force=1
+        return jsonify({"error": str(e), "needs_force": True}), 409
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
@@ -1441,11 +1370,10 @@ def move_to_regular(video_id):
     try:
         # Create new filepath in regular uploads
         filename = os.path.basename(video.stored_filepath)
-        new_filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        new_filepath = sharded_path(app.config['UPLOAD_FOLDER'], filename)
         
         # Move the file
-        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-        os.rename(video.stored_filepath, new_filepath)
+        get_storage().move(video.stored_filepath, new_filepath)
         
         # Update database
         video.stored_filepath = new_filepath
@@ -1536,6 +1464,7 @@ def get_playlist(playlist_id):
                 "id": video.id,
                 "title": video.nickname or os.path.basename(video.original_filepath),
                 "thumbnail": video.thumbnail_path,
+                "duration": video.duration,
                 "position": pv.position,
                 "description": video.description,
                 "tags": video.tags,
@@ -1546,6 +1475,7 @@ def get_playlist(playlist_id):
     })
 
 @app.route('/get_playlists')
+@page_cache.cached('playlists')
 def playlists():
     playlists = Playlist.query.order_by(desc(Playlist.created_at)).all()
     
@@ -1596,6 +1526,7 @@ def playlist_detail(playlist_id):
         'nickname': video.nickname,
         'original_filepath': video.original_filepath,
         'thumbnail_path': video.thumbnail_path,
+        'duration': video.duration,
         'view_count': video.view_count or 0,
         'likes': video.likes or 0,
         'tags': video.tags
@@ -1740,6 +1671,8 @@ def add_multiple_videos():
         
         if not files:
             return jsonify({"error": "No files provided"}), 400
+        if not ingest_pool.admission_check(len(files)):
+            return ingest_pool.busy_response()
             
         try:
             # Create playlist first if name provided
@@ -1750,93 +1683,63 @@ def add_multiple_videos():
                 db.session.flush()  # Get playlist ID
             
             uploaded_videos = []
+            batch_items = []
             for idx, file in enumerate(files, 1):
                 if not file or not file.filename:
                     continue
                     
                 # Generate video nickname based on playlist name and/or tags
-                video_nickname = None
-                if playlist_name and apply_to_videos:
-                    if tags:
-                        video_nickname = f"{playlist_name} - {' '.join(tag.strip() for tag in tags.split(','))} {idx}"
-                    else:
-                        video_nickname = f"{playlist_name} - {idx}"
-                elif tags:
-                    tag_list = [tag.strip() for tag in tags.split(',')]
-                    timestamp = datetime.now().strftime('%H%M%S')
-                    video_nickname = f"{' '.join(tag_list)} {timestamp}_{idx}"
+                video_nickname = batch_video_nickname(playlist_name, apply_to_videos, tags, idx)
                 
+                upload_folder = app.config['STEALTH_UPLOAD_FOLDER'] if stealth else app.config['UPLOAD_FOLDER']
+
+                # Already in the library: link the existing video into the playlist
+                content_hash = hash_stream(file.stream)
+                duplicate = find_duplicate_video(content_hash, upload_folder)
+                if duplicate:
+                    if playlist:
+                        link_to_playlist(duplicate, playlist.id, idx)
+                    uploaded_videos.append(duplicate.id)
+                    continue
+
                 # Use existing upload logic
                 original_filepath = file.filename
                 original_extension = os.path.splitext(original_filepath)[1]
                 
-                upload_folder = app.config['STEALTH_UPLOAD_FOLDER'] if stealth else app.config['UPLOAD_FOLDER']
                 new_filename, stored_filepath = generate_video_filename(original_extension, upload_folder)
                 
-                # Save and process video file (similar to add_video route)
+                # Save the file; processing happens in the batch job below
                 os.makedirs(upload_folder, exist_ok=True)
                 file.save(stored_filepath)
-                
-                if original_extension == '.webm':
-                    stored_filepath = convert_webm_to_mp4(stored_filepath)
-                    new_filename = os.path.basename(stored_filepath)
-                
-                # Generate thumbnail (reuse existing thumbnail generation code)
-                thumbnail_filename = f"thumbnail_{os.path.splitext(new_filename)[0]}.jpg"
-                thumbnails_dir = os.path.join(app.static_folder, 'thumbnails')
-                os.makedirs(thumbnails_dir, exist_ok=True)
-                thumbnail_path = os.path.join(thumbnails_dir, thumbnail_filename)
-                
-                # Extract thumbnail (reuse existing thumbnail extraction code)
-                probe = ffmpeg.probe(stored_filepath)
-                duration = next((float(stream['duration']) for stream in probe['streams'] 
-                              if 'duration' in stream), None) or 0
-                
-                (
-                    ffmpeg
-                    .input(stored_filepath, ss=duration/2 if duration > 0 else 0)
-                    .filter('scale', 320, -1)
-                    .output(thumbnail_path, vframes=1)
-                    .overwrite_output()
-                    .run(capture_stdout=True, capture_stderr=True)
-                )
-                
-                relative_thumbnail_path = os.path.join('thumbnails', thumbnail_filename).replace('\\', '/')
-                
-                # Create video entry
-                new_video = Video(
-                    original_filepath=original_filepath,
-                    stored_filepath=stored_filepath,
-                    nickname=video_nickname,
-                    description=description,
-                    tags=tags,
-                    thumbnail_path=relative_thumbnail_path,
-                    view_count=0
-                )
-                db.session.add(new_video)
-                db.session.flush()  # Get video ID
-                
-                # Add to playlist if one was created
-                if playlist:
-                    playlist_video = PlaylistVideo(
-                        playlist_id=playlist.id,
-                        video_id=new_video.id,
-                        position=idx
-                    )
-                    db.session.add(playlist_video)
-                
-                uploaded_videos.append(new_video.id)
+
+                batch_items.append({"stored_filepath": stored_filepath,
+                                    "original_filepath": original_filepath,
+                                    "nickname": video_nickname,
+                                    "description": description,
+                                    "tags": tags,
+                                    "playlist_id": playlist.id if playlist else None,
+                                    "position": idx,
+                                    "content_hash": content_hash})
+            
+            # One background job processes the files in parallel and inserts them together
+            job_ids = []
+            if batch_items:
+                job = enqueue_video_batch(batch_items)
+                db.session.flush()  # Get job ID
+                job_ids.append(job.id)
             
             db.session.commit()
             
+            # Videos already in the library are listed now; new ones arrive with their jobs
             response_data = {
                 "success": True,
-                "videos": uploaded_videos
+                "videos": uploaded_videos,
+                "jobs": job_ids
             }
             if playlist:
                 response_data["playlist_id"] = playlist.id
                 
-            return jsonify(response_data), 200
+            return jsonify(response_data), 202
             
         except Exception as e:
             db.session.rollback()
@@ -1870,61 +1773,78 @@ def extract_mp3():
             return jsonify({"error": "No file provided"}), 400
             
         try:
-            # Generate unique filename for the input file
-            input_filename = secure_filename(file.filename)
-            input_filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"temp_{input_filename}")
-            
-            # Generate output filename (change extension to .mp3)
-            output_filename = os.path.splitext(input_filename)[0] + '.mp3'
-            output_filepath = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
-            
-            # Save uploaded file
-            os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-            file.save(input_filepath)
-            
-            # Extract audio using ffmpeg
-            try:
-                (
-                    ffmpeg
-                    .input(input_filepath)
-                    .output(output_filepath, acodec='libmp3lame', ab='192k')
-                    .overwrite_output()
-                    .run(capture_stdout=True, capture_stderr=True)
-                )
-                
-                # Clean up the input file
-                os.remove(input_filepath)
-                
-                # Send the MP3 file
-                return send_file(
-                    output_filepath,
-                    mimetype='audio/mpeg',
-                    as_attachment=True,
-                    download_name=output_filename
-                )
-                
-            except ffmpeg.Error as e:
-                return jsonify({"error": f"FFmpeg error: {e.stderr.decode()}"}), 500
-            finally:
-                # Clean up output file after sending
-                if os.path.exists(output_filepath):
-                    os.remove(output_filepath)
-                    
+            # ffmpeg reads the upload directly and its output is streamed to
+            # the client; MP3/AAC audio is copied rather than re-encoded
+            basename = os.path.splitext(secure_filename(file.filename))[0] or 'audio'
+            extraction = AudioExtraction(file.stream, basename)
+        except ExtractionError as e:
+            return jsonify({"error": f"FFmpeg error: {str(e)}"}), 500
         except Exception as e:
             return jsonify({"error": str(e)}), 500
+
+        return Response(extraction, mimetype=extraction.mimetype,
+                        headers={'Content-Disposition': f'attachment; filename={extraction.filename}'})
             
     return render_template('extract_mp3.html')
 
+@app.route('/extract_mp3/batch', methods=['POST'])
+def extract_mp3_batch():
+    """
+    Extract the audio of several uploads ('files') and/or library videos
+    ('video_ids', repeated or comma-separated) into one ZIP, streamed as the
+    extractions finish.
+    """
+    try:
+        video_ids = []
+        for value in request.form.getlist('video_ids'):
+            video_ids.extend(int(v) for v in value.split(',') if v.strip())
+    except ValueError:
+        return jsonify({"error": "Invalid video id"}), 400
+
+    sources = []
+    for file in request.files.getlist('files'):
+        if file and file.filename:
+            basename = os.path.splitext(secure_filename(file.filename))[0] or 'audio'
+            sources.append((basename, lambda file=file: file.stream))
+
+    if video_ids:
+        storage = get_storage()
+        videos = {video.id: video for video in Video.query.filter(Video.id.in_(video_ids)).all()}
+        missing = [str(video_id) for video_id in video_ids if video_id not in videos]
+        if missing:
+            return jsonify({"error": f"Videos not found: {', '.join(missing)}"}), 404
+        for video_id in video_ids:
+            video = videos[video_id]
+            name = video.nickname or os.path.splitext(os.path.basename(video.original_filepath))[0]
+            basename = secure_filename(name) or f"video_{video.id}"
+            sources.append((basename, lambda path=video.stored_filepath: storage.open(path)))
+
+    if not sources:
+        return jsonify({"error": "No files or videos provided"}), 400
+    # Extractions share the ffmpeg slots with ingest; turn batches away while
+    # the ingest queue is full, as uploads are
+    if not ingest_pool.admission_check(len(sources)):
+        return ingest_pool.busy_response()
+
+    # Uploads are read while the response streams, so keep the request open
+    return Response(stream_with_context(extract_zip(sources, ingest_pool.FFMPEG_CONCURRENCY)),
+                    mimetype='application/zip',
+                    headers={'Content-Disposition': 'attachment; filename=audio.zip'})
+
 @app.route('/trim_video/<int:video_id>', methods=['GET', 'POST'])
 def trim_video_view(video_id):
     """
     Render a page that lets the user select start and end times (in seconds)
-    and optionally a new title. On POST, create a trimmed version using ffmpeg.
+    and optionally a new title. On POST, show a preview of the cut: the
+    original file played between the two times, plus which parts the smart
+    trim will re-encode and which it will copy. Nothing is written until the
+    trim is accepted.
     """
     video = Video.query.get_or_404(video_id)
     preview = False
-    trimmed_video_available = False
     error = None
+    plan = None
+    start_time = end_time = None
     # Default new title to the current nickname
     new_title = video.nickname  
 
@@ -1933,194 +1853,100 @@ def trim_video_view(video_id):
             start_time = float(request.form.get('start_time', 0))
             end_time = float(request.form.get('end_time', 0))
             new_title = request.form.get('new_title', video.nickname).strip() or video.nickname
+            if video.duration:
+                # Stored at ingest, so the file does not need probing here
+                end_time = min(end_time, video.duration)
 
             if start_time < 0 or end_time <= start_time:
                 error = "Invalid start or end time. Please ensure end time is greater than start time."
             else:
-                # Determine the file extension
-                file_ext = os.path.splitext(video.stored_filepath)[1]
-                # Create a temporary trimmed file path:
-                trimmed_video_path = os.path.splitext(video.stored_filepath)[0] + "_trimmed" + file_ext
-
-                # Use ffmpeg to trim the video (using -ss and -to with copy mode)
-                (
-                    ffmpeg
-                    .input(video.stored_filepath, ss=start_time, to=end_time)
-                    .output(trimmed_video_path, c='copy')
-                    .overwrite_output()
-                    .run(capture_stdout=True, capture_stderr=True)
-                )
+                # Only packet headers near the cut points are read
+                plan = plan_trim(video.stored_filepath, start_time, end_time, video.video_codec)
                 preview = True
-                trimmed_video_available = True
         except Exception as e:
             error = f"Error during trimming: {str(e)}"
 
+    storyboard_url = None
+    if has_storyboard(video.stored_filepath, app.static_folder):
+        storyboard_url = url_for('static', filename=storyboard_index_rel_path(video.stored_filepath))
+
     return render_template(
         'trim_video.html',
         video=video,
         preview=preview,
-        trimmed_video_available=trimmed_video_available,
+        plan=plan,
+        start_time=start_time,
+        end_time=end_time,
+        trim_job_id=request.args.get('job', type=int),
         error=error,
-        new_title=new_title
+        new_title=new_title,
+        storyboard_url=storyboard_url
     )
 
 @app.route('/accept_trim_video/<int:video_id>', methods=['POST'])
 def accept_trim_video(video_id):
     """
-    Replace the original video with the previously trimmed version.
-    Optionally update the video title and regenerate the thumbnail.
+    Queue a smart trim of the video to the previewed times and update the
+    title. The trim page follows the job until the new file is in place.
     """
     video = Video.query.get_or_404(video_id)
     new_title = request.form.get('new_title', video.nickname).strip() or video.nickname
-    file_ext = os.path.splitext(video.stored_filepath)[1]
-    trimmed_video_path = os.path.splitext(video.stored_filepath)[0] + "_trimmed" + file_ext
-
-    if not os.path.exists(trimmed_video_path):
-        return jsonify({"error": "Trimmed video file not found."}), 404
+    try:
+        start_time = float(request.form.get('start_time', 0))
+        end_time = float(request.form.get('end_time', 0))
+    except ValueError:
+        return jsonify({"error": "Invalid start or end time."}), 400
+    if start_time < 0 or end_time <= start_time:
+        return jsonify({"error": "Invalid start or end time."}), 400
 
     try:
-        # Replace the original video with the trimmed version
-        os.replace(trimmed_video_path, video.stored_filepath)
-        
         # Update the video title if modified
         video.nickname = new_title
-        
-        # Regenerate a thumbnail based on the new trimmed video
-        thumbnail_filename = f"thumbnail_{os.path.splitext(os.path.basename(video.stored_filepath))[0]}.jpg"
-        thumbnails_dir = os.path.join(app.static_folder, 'thumbnails')
-        os.makedirs(thumbnails_dir, exist_ok=True)
-        thumbnail_path = os.path.join(thumbnails_dir, thumbnail_filename)
-        
-        # Determine the video duration (to get a middle frame)
-        probe = ffmpeg.probe(video.stored_filepath)
-        duration = None
-        for stream in probe['streams']:
-            if 'duration' in stream:
-                duration = float(stream['duration'])
-                break
-        if duration is None and 'format' in probe and 'duration' in probe['format']:
-            duration = float(probe['format']['duration'])
-        if duration is None:
-            duration = 0
-        
-        (
-            ffmpeg
-            .input(video.stored_filepath, ss=duration/2 if duration > 0 else 0)
-            .filter('scale', 320, -1)
-            .output(thumbnail_path, vframes=1)
-            .overwrite_output()
-            .run(capture_stdout=True, capture_stderr=True)
-        )
-        
-        relative_thumbnail_path = os.path.join('thumbnails', thumbnail_filename).replace('\\', '/')
-        video.thumbnail_path = relative_thumbnail_path
-        
+
+        # The cut, metadata, thumbnail, storyboard and content hash are all
+        # done in the background job queue
+        job = enqueue_trim(video, start_time, end_time)
+
         db.session.commit()
-        return redirect(url_for('video.video_detail', video_id=video.id))
+        return redirect(url_for('trim_video_view', video_id=video.id, job=job.id))
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
-@app.route('/preview_trim_video/<int:video_id>')
-def preview_trim_video(video_id):
-    """
-    Serve the trimmed video file so that it can be previewed.
-    """
-    video = Video.query.get_or_404(video_id)
-    file_ext = os.path.splitext(video.stored_filepath)[1]
-    trimmed_video_path = os.path.splitext(video.stored_filepath)[0] + "_trimmed" + file_ext
-    if os.path.exists(trimmed_video_path):
-        mimetype = 'video/mp4' if file_ext.lower() in ['.mp4'] else 'video/webm'
-        return send_file(trimmed_video_path, mimetype=mimetype)
-    else:
-        return "Trimmed video not found", 404
-
 @app.route('/tag/<tag>')
+@page_cache.cached('tags', 'tag:{tag}')
 def tag_detail(tag):
     """Display a dedicated page for a specific tag with additional features."""
     page = request.args.get('page', 1, type=int)
     sort_by = request.args.get('sort', 'newest')
     per_page = 10
 
-    # Create base queries for videos and tracks with this tag
-    video_query = Video.query.filter(Video.tags.contains(tag))
-    track_query = Track.query.filter(Track.tags.contains(tag))
-
-    # Apply sorting
-    if sort_by == 'newest':
-        video_query = video_query.order_by(desc(Video.id))
-        track_query = track_query.order_by(desc(Track.id))
-    elif sort_by == 'oldest':
-        video_query = video_query.order_by(Video.id)
-        track_query = track_query.order_by(Track.id)
-    elif sort_by == 'most_viewed':
-        video_query = video_query.order_by(desc(Video.view_count))
-        track_query = track_query.order_by(desc(Track.view_count))
-    elif sort_by == 'most_liked':
-        video_query = video_query.order_by(desc(Video.likes))
-        track_query = track_query.order_by(desc(Track.likes))
-
-    # Get all videos and tracks with this tag
-    all_videos = video_query.all()
-    all_tracks = track_query.all()
-    
-    # Combine and sort by creation time (using id as proxy)
-    combined_content = []
-    
-    # Add videos with type indicator
-    for video in all_videos:
-        combined_content.append({
-            'type': 'video',
-            'id': video.id,
-            'object': video,
-            'sort_key': video.id
-        })
-    
-    # Add tracks with type indicator
-    for track in all_tracks:
-        combined_content.append({
-            'type': 'track',
-            'id': track.id,
-            'object': track,
-            'sort_key': track.id
-        })
-    
-    # Sort combined content by sort_key (id) in descending order for newest first
-    if sort_by == 'newest':
-        combined_content.sort(key=lambda x: x['sort_key'], reverse=True)
-    elif sort_by == 'oldest':
-        combined_content.sort(key=lambda x: x['sort_key'])
-    elif sort_by == 'most_viewed':
-        combined_content.sort(key=lambda x: x['object'].view_count or 0, reverse=True)
-    elif sort_by == 'most_liked':
-        combined_content.sort(key=lambda x: x['object'].likes or 0, reverse=True)
-    
-    # Manual pagination
-    start_idx = (page - 1) * per_page
-    end_idx = start_idx + per_page
-    paginated_content = combined_content[start_idx:end_idx]
-    
-    # Calculate total pages
-    total_items = len(combined_content)
-    total_pages = (total_items + per_page - 1) // per_page
-    
-    # Get tag statistics (include both videos and tracks)
-    video_count = len(all_videos)
-    track_count = len(all_tracks)
+    # Statistics come from aggregates, so the page costs the same however
+    # much content the tag has
+    video_count, video_views, video_likes = db.session.query(
+        func.count(Video.id), func.sum(Video.view_count), func.sum(Video.likes)
+    ).filter(Video.tags.contains(tag)).one()
+    track_count, track_views, track_likes = db.session.query(
+        func.count(Track.id), func.sum(Track.view_count), func.sum(Track.likes)
+    ).filter(Track.tags.contains(tag)).one()
     total_content_count = video_count + track_count
-    
-    total_views = sum((v.view_count or 0) for v in all_videos) + sum((t.view_count or 0) for t in all_tracks)
-    total_likes = sum((v.likes or 0) for v in all_videos) + sum((t.likes or 0) for t in all_tracks)
-    
-    # Get related tags (tags that appear together with this tag)
-    related_tags = []
-    all_content_with_tag = all_videos + all_tracks
+    total_views = (video_views or 0) + (track_views or 0)
+    total_likes = (video_likes or 0) + (track_likes or 0)
+    total_pages = (total_content_count + per_page - 1) // per_page
+
+    # One page of videos and tracks merged in SQL; the infinite scroll goes
+    # on from next_cursor through /api/v1/tags/<tag>/items
+    feed = feed_page(sort_by, per_page, offset=(max(page, 1) - 1) * per_page, tag=tag)
+
+    # Get related tags (tags that appear together with this tag); only the
+    # tags column is read
     tag_counts = {}
-    
-    for content in all_content_with_tag:
-        if content.tags:
-            content_tags = [t.strip() for t in content.tags.split(',')]
-            for ctag in content_tags:
+    tag_rows = db.session.query(Video.tags).filter(Video.tags.contains(tag)).union_all(
+        db.session.query(Track.tags).filter(Track.tags.contains(tag))
+    ).all()
+    for (content_tags,) in tag_rows:
+        if content_tags:
+            for ctag in [t.strip() for t in content_tags.split(',')]:
                 if ctag.lower() != tag.lower() and ctag.strip():
                     tag_counts[ctag] = tag_counts.get(ctag, 0) + 1
     
@@ -2136,10 +1962,11 @@ def tag_detail(tag):
     return render_template(
         'tag_detail.html',
         tag=tag,
-        content=paginated_content,
-        all_content=combined_content,
+        content=feed.items,
         page=page,
+        per_page=per_page,
         total_pages=total_pages,
+        next_cursor=feed.next_cursor,
         sort_by=sort_by,
         video_count=video_count,
         track_count=track_count,
@@ -2151,6 +1978,93 @@ def tag_detail(tag):
         tag_comments=tag_comments
     )
 
+def feed_item_json(item, fields, track_artists, card):
+    """One listing item with the requested fields (see feed.FEED_FIELDS)"""
+    obj = item['object']
+    is_video = item['type'] == 'video'
+    data = {'type': item['type'], 'id': item['id']}
+    for field in fields:
+        if field == 'title':
+            data['title'] = obj.nickname or obj.original_filepath
+        elif field == 'description':
+            data['description'] = obj.description or ''
+        elif field == 'tags':
+            data['tags'] = [t.strip() for t in (obj.tags or '').split(',') if t.strip()]
+        elif field == 'views':
+            data['views'] = obj.view_count or 0
+        elif field == 'likes':
+            data['likes'] = obj.likes or 0
+        elif field == 'duration':
+            data['duration'] = obj.duration
+        elif field == 'thumbnail':
+            data['thumbnail'] = image_url(obj.thumbnail_path if is_video else obj.background_image_path) or None
+        elif field == 'url':
+            data['url'] = url_for('video.video_detail', video_id=obj.id) if is_video else url_for('track_detail', track_id=obj.id)
+        elif field == 'stream_url':
+            data['stream_url'] = url_for('stream_video', video_id=obj.id) if is_video else url_for('stream_track', track_id=obj.id)
+        elif field == 'artists':
+            data['artists'] = [{'id': artist.id, 'name': artist.name}
+                               for artist in track_artists.get(obj.id, [])] if not is_video else []
+        elif field == 'html':
+            data['html'] = str(card(item))
+    return data
+
+def feed_json(card_name, types=None, **filters):
+    """
+    JSON page of a listing for the /api/v1 endpoints.
+
+    Query args: sort (as on the pages), limit (up to feed.MAX_LIMIT), cursor
+    (next_cursor of the previous page), fields (comma-separated, see
+    feed.FEED_FIELDS; html is the card the page would render) and, unless
+    the endpoint fixes them, types (video, track).
+
+    Args:
+        card_name: Macro of feed_cards.html rendering the html field
+        types: Content types, or None to take them from the query string
+        filters: tag/artist filters for feed.feed_page
+    """
+    limit = min(max(request.args.get('limit', DEFAULT_LIMIT, type=int), 1), MAX_LIMIT)
+    try:
+        fields = parse_fields(request.args.get('fields'))
+        if types is None:
+            types = parse_types(request.args.get('types'))
+        feed = feed_page(request.args.get('sort', 'newest'), limit, cursor=request.args.get('cursor'),
+                         types=types, **filters)
+    except FeedQueryError as e:
+        return jsonify({"error": str(e)}), 400
+
+    track_artists = {}
+    if 'artists' in fields or 'html' in fields:
+        track_artists = artists_by_track(item['id'] for item in feed.items if item['type'] == 'track')
+    macro = get_template_attribute('feed_cards.html', card_name)
+
+    def card(item):
+        if card_name == 'tag_card':
+            return macro(item)
+        if card_name == 'track_card':
+            return macro(item['object'], track_artists)
+        return macro(item, track_artists)
+
+    return jsonify({
+        'items': [feed_item_json(item, fields, track_artists, card) for item in feed.items],
+        'next_cursor': feed.next_cursor
+    })
+
+@app.route('/api/v1/feed')
+def api_feed():
+    """The library feed (videos and tracks) as JSON"""
+    return feed_json('library_card')
+
+@app.route('/api/v1/tracks')
+def api_tracks():
+    """The tracks list as JSON; ?artist= filters by artist name"""
+    return feed_json('track_card', types=('track',), artist=request.args.get('artist') or None)
+
+@app.route('/api/v1/tags/<tag>/items')
+def api_tag_items(tag):
+    """A tag page's videos and tracks as JSON"""
+    return feed_json('tag_card', tag=tag)
+
 @app.route('/edit_tag_description/<tag>', methods=['POST'])
 def edit_tag_description(tag):
     description = request.form.get('description', '').strip()
@@ -2256,8 +2170,538 @@ def delete_playlist(playlist_id):
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
-if __name__ == '__main__':
+@app.cli.command('build-image-derivatives')
+@click.option('--force', is_flag=True, help='Regenerate derivatives that already exist.')
+def build_image_derivatives_command(force):
+    """Backfill resized WebP/JPEG derivatives for thumbnails, covers and avatars."""
+    rel_paths = set()
+    for column in (Video.thumbnail_path, Track.background_image_path, Artist.avatar_path, AuthorProfile.avatar_path):
+        rel_paths.update(path for (path,) in db.session.query(column).filter(column.isnot(None)).distinct() if path)
+
+    total = len(rel_paths)
+    failed = 0
+    print(f"Building derivatives for {total} images...")
+    for index, rel_path in enumerate(sorted(rel_paths), start=1):
+        if not os.path.exists(os.path.join(app.static_folder, rel_path)):
+            print(f"[{index}/{total}] Missing original: {rel_path}")
+            failed += 1
+            continue
+        try:
+            widths = image_derivatives.generate_derivatives(rel_path, app.static_folder, force=force)
+            print(f"[{index}/{total}] {rel_path}: {', '.join(str(w) for w in widths)}")
+        except Exception as e:
+            print(f"[{index}/{total}] Error processing {rel_path}: {str(e)}")
+            failed += 1
+    print(f"Derivative backfill completed ({total - failed} ok, {failed} failed).")
+
+@app.cli.command('build-storyboards')
+@click.option('--force', is_flag=True, help='Rebuild storyboards that already exist.')
+def build_storyboards_command(force):
+    """Backfill seek-preview sprite sheets for every video."""
+    videos = Video.query.order_by(Video.id).all()
+    total = len(videos)
+    built = 0
+    print(f"Checking storyboards for {total} videos...")
+    for index, video in enumerate(videos, start=1):
+        if not os.path.exists(video.stored_filepath):
+            print(f"[{index}/{total}] Video file not found: {video.stored_filepath}")
+            continue
+        if not force and has_storyboard(video.stored_filepath, app.static_folder):
+            continue
+        if safe_generate_storyboard(video.stored_filepath, app.static_folder):
+            built += 1
+            print(f"[{index}/{total}] Storyboard built for video {video.id}")
+    print(f"Storyboard backfill completed ({built} built).")
+
+def _require_local_media(command):
+    """Backfills that run ffmpeg/ffprobe over the whole library read the files
+    from disk; with a remote backend the published files are not there"""
+    if get_storage().remote:
+        raise click.ClickException(f"{command} reads media from local disk and cannot run with "
+                                   f"STORAGE_BACKEND {app.config.get('STORAGE_BACKEND')!r}.")
+
+def _thumbnail_is_stale(video):
+    """Thumbnail missing, or older than the video file it was taken from"""
+    if not video.thumbnail_path:
+        return True
+    thumbnail_path = os.path.join(app.static_folder, video.thumbnail_path)
+    if not os.path.exists(thumbnail_path):
+        return True
+    return os.path.getmtime(thumbnail_path) < os.path.getmtime(video.stored_filepath)
+
+@app.cli.command('build-thumbnails')
+@click.option('--force', is_flag=True, help='Regenerate every thumbnail, not just missing or stale ones.')
+@click.option('--since', type=click.DateTime(), help='Only videos whose file changed on or after this date.')
+@click.option('--batch-size', default=50, show_default=True, help='Thumbnails per database commit and checkpoint.')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint of an interrupted run.')
+def build_thumbnails_command(force, since, batch_size, restart):
+    """Regenerate missing or stale video thumbnails in the ingest process pool.
+    Progress is checkpointed, so an interrupted run resumes where it stopped;
+    videos that failed are retried on resume and listed at the end."""
+    _require_local_media('build-thumbnails')
+    ensure_schema()
+    checkpoint_path = os.path.join(app.instance_path, 'thumbnail_backfill.json')
+    selection = {'force': force, 'since': since.isoformat() if since else None}
+    done_ids = set()
+    failed_ids = set()
+    if not restart and os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+        # A checkpoint only applies to a run with the same selection
+        if checkpoint.get('selection') == selection:
+            done_ids = set(checkpoint.get('done_ids', []))
+            # Failures are not done; they are tried again
+            failed_ids = set(checkpoint.get('failed_ids', []))
+            print(f"Resuming: {len(done_ids)} videos already done, retrying {len(failed_ids)} that failed.")
+
+    def save_checkpoint():
+        os.makedirs(app.instance_path, exist_ok=True)
+        with open(checkpoint_path + '.tmp', 'w') as f:
+            json.dump({'selection': selection, 'done_ids': sorted(done_ids),
+                       'failed_ids': sorted(failed_ids)}, f)
+        os.replace(checkpoint_path + '.tmp', checkpoint_path)
+
+    todo = []
+    for video in Video.query.order_by(Video.id):
+        if video.id in done_ids or not os.path.exists(video.stored_filepath):
+            continue
+        if video.id in failed_ids:
+            todo.append(video)
+            continue
+        if since and datetime.fromtimestamp(os.path.getmtime(video.stored_filepath)) < since:
+            continue
+        if force or _thumbnail_is_stale(video):
+            todo.append(video)
+    total = len(todo)
+    print(f"Building thumbnails for {total} videos, {ingest_pool.FFMPEG_CONCURRENCY} at a time...")
+
+    built = failed = unsaved = 0
+    pending = {}
+
+    def collect(futures):
+        nonlocal built, failed, unsaved
+        for future in futures:
+            video = pending.pop(future)
+            try:
+                video.thumbnail_path = future.result()
+                built += 1
+                unsaved += 1
+                done_ids.add(video.id)
+                failed_ids.discard(video.id)
+            except Exception as e:
+                print(f"Error generating thumbnail for video {video.id}: {str(e)}")
+                failed += 1
+                failed_ids.add(video.id)
+        if unsaved >= batch_size:
+            flush()
+
+    def flush():
+        nonlocal unsaved
+        db.session.commit()
+        save_checkpoint()
+        unsaved = 0
+        print(f"[{built + failed}/{total}] {built} built, {failed} failed")
+
+    try:
+        for video in todo:
+            if len(pending) >= ingest_pool.FFMPEG_CONCURRENCY:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(finished)
+            # Stored metadata spares a probe per file
+            future = ingest_pool.submit(generate_video_thumbnail, video.stored_filepath, app.static_folder,
+                                        None, video.duration, video.width)
+            pending[future] = video
+        collect(list(pending))
+        if unsaved:
+            flush()
+    finally:
+        # Keep what finished before an interruption so the next run skips it
+        db.session.commit()
+        save_checkpoint()
+        ingest_pool.shutdown()
+    if failed_ids:
+        # Kept so a later run (without --restart) retries only what failed
+        print(f"Failed videos: {', '.join(str(video_id) for video_id in sorted(failed_ids))}. "
+              f"Run the command again to retry them.")
+    else:
+        os.remove(checkpoint_path)
+    print(f"Thumbnail backfill completed ({built} built, {failed} failed).")
+
+@app.cli.command('purge-uploads')
+@click.option('--hours', default=24, show_default=True, help='Age of an untouched partial upload before it is removed.')
+def purge_uploads_command(hours):
+    """Remove abandoned chunked uploads and their .part files."""
+    cutoff = datetime.utcnow() - timedelta(hours=hours)
+    stale = UploadSession.query.filter(UploadSession.status == 'uploading', UploadSession.updated_at < cutoff).all()
+    for upload in stale:
+        part_path = upload.stored_filepath + '.part'
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        db.session.delete(upload)
+    # Completed sessions are only kept so finalize can be retried
+    completed = UploadSession.query.filter(UploadSession.status == 'complete', UploadSession.updated_at < cutoff).delete()
+    db.session.commit()
+    print(f"Removed {len(stale)} abandoned and {completed} completed upload sessions.")
+
+@app.cli.command('hash-media')
+@click.option('--force', is_flag=True, help='Rehash files that already have a content hash.')
+def hash_media_command(force):
+    """Backfill content hashes so existing videos and tracks are deduplicated too."""
+    ensure_schema()
+    hashed = 0
+    for model in (Video, Track):
+        query = model.query.order_by(model.id)
+        if not force:
+            query = query.filter(model.content_hash.is_(None))
+        items = query.all()
+        total = len(items)
+        print(f"Hashing {total} {model.__tablename__} files...")
+        for index, item in enumerate(items, start=1):
+            if not os.path.exists(item.stored_filepath):
+                print(f"[{index}/{total}] File not found: {item.stored_filepath}")
+                continue
+            item.content_hash = hash_file(item.stored_filepath)
+            hashed += 1
+            if index % 50 == 0:
+                db.session.commit()
+        db.session.commit()
+
+    # Report files that were stored more than once before deduplication existed
+    for model in (Video, Track):
+        duplicates = (db.session.query(model.content_hash, db.func.count(model.id))
+                      .filter(model.content_hash.isnot(None))
+                      .group_by(model.content_hash)
+                      .having(db.func.count(model.id) > 1)
+                      .all())
+        for content_hash, count in duplicates:
+            ids = [item_id for (item_id,) in db.session.query(model.id).filter_by(content_hash=content_hash)]
+            print(f"Duplicate {model.__tablename__} content {content_hash[:12]}: ids {', '.join(map(str, ids))}")
+    print(f"Content hashing completed ({hashed} hashed).")
+
+@app.cli.command('probe-media')
+@click.option('--force', is_flag=True, help='Re-probe files that already have metadata.')
+@click.option('--workers', default=os.cpu_count() or 4, show_default=True, help='ffprobe processes to run at once.')
+def probe_media_command(force, workers):
+    """Backfill duration, dimensions, codecs, bitrate and size for existing videos and tracks."""
+    _require_local_media('probe-media')
+    ensure_schema()
+    probed = failed = 0
+    for model in (Video, Track):
+        query = db.session.query(model.id, model.stored_filepath).order_by(model.id)
+        if not force:
+            # file_size is set by every successful probe
+            query = query.filter(model.file_size.is_(None))
+        rows = [(item_id, path) for item_id, path in query if os.path.exists(path)]
+        total = len(rows)
+        print(f"Probing {total} {model.__tablename__} files with {workers} workers...")
+        # ffprobe runs as a subprocess, so threads are enough to probe in parallel
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(probe_metadata, path): (item_id, path) for item_id, path in rows}
+            for index, future in enumerate(as_completed(futures), start=1):
+                item_id, path = futures[future]
+                try:
+                    metadata = future.result()
+                except Exception as e:
+                    print(f"[{index}/{total}] Error probing {path}: {str(e)}")
+                    failed += 1
+                    continue
+                model.query.filter_by(id=item_id).update(metadata)
+                probed += 1
+                if index % 50 == 0:
+                    db.session.commit()
+                    print(f"[{index}/{total}] probed")
+        db.session.commit()
+    print(f"Metadata backfill completed ({probed} probed, {failed} failed).")
+
+@app.cli.command('plan-transcodes')
+@click.option('--verbose', is_flag=True, help='Print the plan for every video.')
+def plan_transcodes_command(verbose):
+    """Dry run: report what the transcode planner would do with every video and
+    the projected time and size compared with the old policy (re-encode WebM at
+    2 Mb/s, keep MP4 as uploaded)."""
+    _require_local_media('plan-transcodes')
+    ensure_schema()
+    videos = Video.query.order_by(Video.id).all()
+    counts = {}
+    totals = {'seconds': 0.0, 'size': 0.0, 'legacy_seconds': 0.0, 'legacy_size': 0.0}
+    missing = 0
+    for video in videos:
+        if not os.path.exists(video.stored_filepath):
+            missing += 1
+            continue
+        try:
+            # The container is not among the stored metadata columns, so every
+            # file is probed; ffprobe only reads the headers
+            plan, metadata = probe_plan(video.stored_filepath, threads=ingest_pool.FFMPEG_THREADS_PER_JOB)
+        except Exception as e:
+            print(f"Error probing {video.stored_filepath}: {str(e)}")
+            missing += 1
+            continue
+        estimate = estimate_plan(plan, metadata)
+        counts[plan['action']] = counts.get(plan['action'], 0) + 1
+        for key in totals:
+            totals[key] += estimate[key]
+        if verbose:
+            print(f"Video {video.id}: {plan['action']} ({plan['reason']}), "
+                  f"~{estimate['seconds']:.0f}s vs {estimate['legacy_seconds']:.0f}s, "
+                  f"~{format_file_size(int(estimate['size']))} vs {format_file_size(int(estimate['legacy_size']))}")
+
+    planned = sum(counts.values())
+    print(f"Planned {planned} videos ({missing} missing or unreadable): "
+          + ', '.join(f"{count} {action}" for action, count in sorted(counts.items())))
+    saved_seconds = totals['legacy_seconds'] - totals['seconds']
+    saved_bytes = totals['legacy_size'] - totals['size']
+    print(f"Projected processing time: {format_duration(totals['seconds']) or '0:00'} "
+          f"vs {format_duration(totals['legacy_seconds']) or '0:00'} with the old policy "
+          f"({format_duration(abs(saved_seconds)) or '0:00'} {'saved' if saved_seconds >= 0 else 'extra'})")
+    print(f"Projected library size: {format_file_size(int(totals['size'])) or '0 B'} "
+          f"vs {format_file_size(int(totals['legacy_size'])) or '0 B'} with the old policy "
+          f"({format_file_size(int(abs(saved_bytes))) or '0 B'} {'saved' if saved_bytes >= 0 else 'extra'})")
+    print("This was a dry run; nothing was changed.")
+
+@app.cli.command('reconcile-storage')
+@click.option('--fix', is_flag=True, help='Delete rows whose file is gone and remove orphan files (default: report only).')
+@click.option('--keep-orphans', is_flag=True, help='With --fix, only fix rows and leave orphan files alone.')
+@click.option('--min-age-hours', default=ORPHAN_MIN_AGE_SECONDS / 3600, show_default=True,
+              help='Orphans modified more recently than this are never removed.')
+@click.option('--force', is_flag=True,
+              help=f'With --fix, delete rows even when over {MAX_MISSING_SHARE:.0%} of them are missing.')
+@click.option('--verbose', is_flag=True, help='List every missing row and orphan file.')
+def reconcile_storage_command(fix, keep_orphans, min_age_hours, force, verbose):
+    """Diff the upload, stealth, audio and static media folders against the database."""
+    try:
+        report = reconcile(app.config, app.static_folder, fix=fix, remove_orphans=not keep_orphans,
+                           min_age=min_age_hours * 3600, force=force)
+    except TooManyMissing as e:
+        raise click.ClickException(f"{e} Check that the storage is complete, then rerun with --force.")
+    except ReconcileError as e:
+        raise click.ClickException(str(e))
+    for line in format_report(report, verbose):
+        print(line)
+    if fix:
+        print(f"Fixed {report['fixed_rows']} rows and removed {report['removed_files']} files.")
+    elif report['missing'] or report['orphans']:
+        print("Dry run; rerun with --fix to apply.")
+
+@app.cli.command('migrate-storage')
+@click.option('--batch-size', default=500, show_default=True, help='Rows moved per database commit.')
+@click.option('--dry-run', is_flag=True, help='Only count the files that would move.')
+def migrate_storage_command(batch_size, dry_run):
+    """Move media from the old flat folders into the sharded layout and rewrite
+    the stored paths. Stop the app and job workers first; an interrupted run
+    can simply be started again."""
+    static_folder = app.static_folder
+
+    def static_path(rel_path):
+        return os.path.join(static_folder, rel_path)
+
+    def move_storyboard(old_path, new_path):
+        migrate_legacy_storyboard(new_path, static_folder)
+
+    def move_image_derivatives(old_rel_path, new_rel_path):
+        image_derivatives.move_derivatives(old_rel_path, new_rel_path, static_folder)
+
+    columns = [
+        (Video, 'stored_filepath', lambda path: path, move_storyboard),
+        (Track, 'stored_filepath', lambda path: path, None),
+        (Video, 'thumbnail_path', static_path, move_image_derivatives),
+        (Track, 'background_image_path', static_path, move_image_derivatives),
+        (Artist, 'avatar_path', static_path, move_image_derivatives),
+        (AuthorProfile, 'avatar_path', static_path, move_image_derivatives),
+    ]
+    for model, column_name, resolve, move_extra in columns:
+        column = getattr(model, column_name)
+        label = f"{model.__tablename__}.{column_name}"
+        last_id = 0
+        moved_count = missing_count = 0
+        while True:
+            rows = (db.session.query(model.id, column)
+                    .filter(model.id > last_id, column.isnot(None), column != '')
+                    .order_by(model.id).limit(batch_size).all())
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            flat = [(row_id, path) for row_id, path in rows if shard_target(path)]
+            if dry_run:
+                moved_count += len(flat)
+                continue
+            moved, missing = migrate_rows(flat, resolve, move_extra)
+            for path in missing:
+                print(f"{label}: file not found: {path}")
+            db.session.bulk_update_mappings(model, [{'id': row_id, column_name: path}
+                                                    for row_id, path in moved.items()])
+            db.session.commit()
+            moved_count += len(moved)
+            missing_count += len(missing)
+            print(f"{label}: {moved_count} moved so far")
+        print(f"{label}: {moved_count} {'to move' if dry_run else 'moved'}, {missing_count} missing")
+
+    # Chunked uploads: the .part of an unfinished upload moves with its final path
+    sessions = [upload for upload in UploadSession.query if shard_target(upload.stored_filepath)]
+    if not dry_run:
+        for upload in sessions:
+            target = shard_target(upload.stored_filepath)
+            move_file(upload.stored_filepath + '.part', target + '.part')
+            move_file(upload.stored_filepath, target)
+            upload.stored_filepath = target
+        # bulk_update_mappings skips the flush hooks that invalidate cached pages
+        invalidate(db.session, ('feed', 'tracks', 'artists', 'playlists', 'tags'))
+        db.session.commit()
+    print(f"upload_session: {len(sessions)} {'to move' if dry_run else 'moved'}")
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Minify and bundle static CSS/JS into fingerprinted files with .gz/.br
+    variants and a manifest; run on deploy. Pages pick the new files up
+    without a restart."""
+    report = build_assets(app.static_folder)
+    total_source = total_sent = 0
+    for name, built, source_bytes, sizes in report:
+        sent = min(sizes.values())
+        total_source += source_bytes
+        total_sent += sent
+        variants = ', '.join(f"{suffix} {size}" for suffix, size in sizes.items())
+        print(f"{name} -> {built} ({source_bytes} bytes; {variants})")
+    print(f"{len(report)} assets built: {total_source} source bytes, {total_sent} bytes over the wire at best.")
+
+@app.cli.command('bench-markdown')
+@click.option('--repeat', default=20, show_default=True, help='Times each text and page is rendered.')
+def bench_markdown_command(repeat):
+    """Compare Markdown rendering the old way (a new parser per call) with the
+    reused parser and the cache, over the stored bios, descriptions and
+    comments, then time artist pages with a cold and a warm cache."""
+    import markdown
+
+    texts = [text for (text,) in db.session.query(Artist.bio).filter(Artist.bio.isnot(None))]
+    for model, column in ((Track, Track.description), (Video, Video.description), (TrackComment, TrackComment.content),
+                          (ArtistComment, ArtistComment.content), (Comment, Comment.content)):
+        texts.extend(text for (text,) in db.session.query(column).filter(column.isnot(None)))
+    texts = [text for text in texts if text.strip()]
+    if not texts:
+        print("No bios, descriptions or comments to render.")
+        return
+
+    def timed(render):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for text in texts:
+                render(text)
+        return (time.perf_counter() - started) / (repeat * len(texts)) * 1e6
+
+    markdown_cache.clear()
+    render_markdown(texts[0])
+    results = [
+        ('markdown.markdown() per call', timed(lambda text: markdown.markdown(text, extensions=MARKDOWN_EXTENSIONS))),
+        ('reused parser, no cache', timed(render_uncached)),
+        ('cached', timed(render_markdown)),
+    ]
+    print(f"{len(texts)} texts, {repeat} rounds")
+    for label, micros in results:
+        print(f"  {label:<30} {micros:9.1f} us/text  ({results[0][1] / micros:5.1f}x)")
+
+    artist_ids = [artist_id for (artist_id,) in db.session.query(Artist.id).filter(Artist.bio.isnot(None)).limit(20)]
+    if artist_ids:
+        client = app.test_client()
+        for label, clear in (('cold cache', True), ('warm cache', False)):
+            started = time.perf_counter()
+            for _ in range(repeat):
+                if clear:
+                    markdown_cache.clear()
+                for artist_id in artist_ids:
+                    client.get(f'/artist/{artist_id}')
+            millis = (time.perf_counter() - started) / (repeat * len(artist_ids)) * 1000
+            print(f"  artist page, {label:<17} {millis:9.2f} ms/page")
+
+# Seconds a new worker may take to import the app and prepare it
+WORKER_BOOT_TARGET_SECONDS = float(os.environ.get('EASYCORE_BOOT_TARGET_SECONDS', 1.0))
+# Run in a fresh interpreter by boot-profile, the way a WSGI worker boots
+BOOT_PROBE = ("import time; started = time.perf_counter(); import easycore; easycore.create_app(); "
+              "print(time.perf_counter() - started)")
+
+@app.cli.command('boot-profile')
+@click.option('--top', default=15, show_default=True, help='Slowest imports of easycore to list.')
+@click.option('--target', default=WORKER_BOOT_TARGET_SECONDS, show_default=True, type=float,
+              help='Boot time budget in seconds (env EASYCORE_BOOT_TARGET_SECONDS).')
+@click.option('--check', is_flag=True, help='Exit with an error when boot takes longer than the target.')
+def boot_profile_command(top, target, check):
+    """Boot the app in a fresh interpreter under -X importtime and report the
+    boot time and which imports it goes to."""
+    import subprocess
+    import sys
+
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', BOOT_PROBE], cwd=app.root_path,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise click.ClickException(f"Boot failed:\n{result.stderr[-2000:]}")
+
+    # "import time: self [us] | cumulative | <two spaces per level>package"
+    direct_imports = []
+    total_us = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        if depth == 0 and name.strip() == 'easycore':
+            total_us = int(cumulative_us)
+        elif depth == 1:
+            direct_imports.append((int(cumulative_us), name.strip()))
+
+    boot_seconds = float(result.stdout.strip().splitlines()[-1])
+    print(f"Boot: {boot_seconds:.3f}s (target {target:.3f}s), of which importing easycore {total_us / 1e6:.3f}s")
+    print("Slowest imports of easycore:")
+    for cumulative_us, name in sorted(direct_imports, reverse=True)[:top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+    if check and boot_seconds > target:
+        raise click.ClickException(f"Boot took {boot_seconds:.3f}s, over the {target:.3f}s target")
+
+@app.cli.command('run-jobs')
+@click.option('--workers', default=JOB_WORKERS, show_default=True, help='Worker threads to run.')
+@click.option('--once', is_flag=True, help='Run queued jobs until the queue is empty, then exit.')
+def run_jobs_command(workers, once):
+    """Process background jobs (ingest, post-trim refresh) outside the web server."""
+    ensure_schema()
+    if once:
+        print(f"Ran {run_jobs_until_idle(app)} jobs.")
+        ingest_pool.shutdown()
+        return
+    pool = JobWorkerPool(app, workers)
+    pool.start()
+    print(f"Running {workers} job workers, {ingest_pool.FFMPEG_CONCURRENCY} ffmpeg pipelines at a time. Press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pool.stop(timeout=5)
+        ingest_pool.shutdown()
+
+# Job workers started by create_app in this process, if any
+web_job_pool = None
+
+def create_app():
+    """
+    Application factory for WSGI servers, e.g. gunicorn 'easycore:create_app()'.
+    Prepares the folders and schema the way `python easycore.py` does; the AI,
+    image and Markdown libraries are only imported once a request needs them.
+
+    Unlike `python easycore.py` it does not process background jobs (ingest,
+    thumbnails, trims...) unless WEB_JOB_WORKERS (EASYCORE_WEB_JOB_WORKERS=1)
+    is set; otherwise run `flask run-jobs` next to the server or uploads stay
+    queued. Each server process starts its own workers (the ffmpeg slots
+    are shared, see ingest_pool.py), so prefer run-jobs with several.
+    """
+    global web_job_pool
     with app.app_context():
         ensure_directories_exist()
-        db.create_all()
+        ensure_schema()
+    if app.config['WEB_JOB_WORKERS'] and web_job_pool is None:
+        web_job_pool = JobWorkerPool(app)
+        web_job_pool.start()
+    return app
+
+if __name__ == '__main__':
+    create_app()
+    # With the reloader on, only the child process serves requests and runs jobs
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true' and web_job_pool is None:
+        JobWorkerPool(app).start()
     app.run("0.0.0.0", 5015, debug=True)
@@ -0,0 +1,219 @@
+"""
+Feed Module
+Listings of videos and tracks for the browse pages and the /api/v1 JSON
+endpoints behind their infinite scroll.
+
+Videos and tracks are merged in SQL (UNION ALL) and ordered by the sort's
+key columns plus a type/id tie-break, so every item has one fixed position.
+A cursor holds the sort key of the last item served and the next page is
+read as "the rows after it", which costs the same on page 50 as on page 1
+and neither repeats nor skips items when new uploads arrive in between.
+Pages opened by number (the no-JS fallback links) still use an offset in
+the same order.
+
+Cursors are opaque to clients: URL-safe base64 of a small JSON array.
+"""
+
+import base64
+import json
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, desc, func, literal, or_
+
+from models import db, Video, Track, Artist, TrackArtist, VideoArtist
+
+# Sort name -> key columns of the merged listing as (column, descending);
+# videos come first on ties
+FEED_SORTS: Dict[str, Tuple[Tuple[str, bool], ...]] = {
+    'newest': (('id', True), ('type', True)),
+    'oldest': (('id', False), ('type', True)),
+    'most_viewed': (('views', True), ('type', True), ('id', True)),
+    'most_liked': (('likes', True), ('type', True), ('id', True)),
+}
+FEED_TYPES = ('video', 'track')
+# Optional per-item fields of the JSON API; id and type are always sent
+FEED_FIELDS = ('title', 'description', 'tags', 'views', 'likes', 'duration', 'thumbnail',
+               'url', 'stream_url', 'artists', 'html')
+# Sent when the client does not ask for specific fields (html is opt-in)
+DEFAULT_FIELDS = tuple(field for field in FEED_FIELDS if field != 'html')
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+class FeedQueryError(ValueError):
+    """A malformed cursor, field list or type list sent by a client"""
+
+
+class FeedPage(NamedTuple):
+    # {'type', 'id', 'object'} dicts, as the page templates expect
+    items: List[Dict]
+    next_cursor: Optional[str]
+
+
+def _split(value: Optional[str]) -> List[str]:
+    return [part.strip() for part in (value or '').split(',') if part.strip()]
+
+
+def parse_fields(value: Optional[str]) -> Tuple[str, ...]:
+    """The fields requested as ?fields=title,views..., DEFAULT_FIELDS if none"""
+    fields = _split(value)
+    if not fields:
+        return DEFAULT_FIELDS
+    unknown = [field for field in fields if field not in FEED_FIELDS + ('id', 'type')]
+    if unknown:
+        raise FeedQueryError(f"Unknown fields: {', '.join(unknown)}")
+    return tuple(field for field in FEED_FIELDS if field in fields)
+
+
+def parse_types(value: Optional[str]) -> Tuple[str, ...]:
+    """The content types requested as ?types=video,track, all if none"""
+    types = _split(value)
+    if not types:
+        return FEED_TYPES
+    unknown = [item_type for item_type in types if item_type not in FEED_TYPES]
+    if unknown:
+        raise FeedQueryError(f"Unknown types: {', '.join(unknown)}")
+    return tuple(item_type for item_type in FEED_TYPES if item_type in types)
+
+
+def encode_cursor(sort: str, values: Sequence) -> str:
+    raw = json.dumps([sort] + list(values), separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str, sort: str) -> List:
+    """Sort key values stored in a cursor made by encode_cursor for this sort"""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        raise FeedQueryError("Invalid cursor")
+    keys = FEED_SORTS[sort]
+    if not isinstance(data, list) or len(data) != len(keys) + 1 or data[0] != sort:
+        raise FeedQueryError("Invalid cursor")
+    values = data[1:]
+    for (name, _), value in zip(keys, values):
+        valid = value in FEED_TYPES if name == 'type' else isinstance(value, int) and not isinstance(value, bool)
+        if not valid:
+            raise FeedQueryError("Invalid cursor")
+    return values
+
+
+def merged_listing(types: Iterable[str] = FEED_TYPES, tag: Optional[str] = None, artist: Optional[str] = None):
+    """
+    Subquery of (type, id, views, likes) rows over the matching content.
+
+    Args:
+        types: Content types to include
+        tag: Only content whose tags contain this (substring, as tag pages match)
+        artist: Only content credited to an artist whose name contains this
+
+    Returns:
+        The subquery, or None when no type is selected
+    """
+    parts = []
+    for item_type, model, link, link_column in (('video', Video, VideoArtist, VideoArtist.video_id),
+                                                ('track', Track, TrackArtist, TrackArtist.track_id)):
+        if item_type not in types:
+            continue
+        query = db.session.query(
+            literal(item_type).label('type'), model.id.label('id'),
+            func.coalesce(model.view_count, 0).label('views'),
+            func.coalesce(model.likes, 0).label('likes')
+        )
+        if tag:
+            query = query.filter(model.tags.contains(tag))
+        if artist:
+            credited = db.session.query(link_column).join(Artist, Artist.id == link.artist_id)\
+                .filter(Artist.name.ilike(f'%{artist}%'))
+            query = query.filter(model.id.in_(credited))
+        parts.append(query)
+    if not parts:
+        return None
+    return parts[0].union_all(*parts[1:]).subquery()
+
+
+def _after(columns, keys: Tuple[Tuple[str, bool], ...], values: Sequence):
+    """Rows strictly after the given sort key: (a, b) after (x, y) is
+    a past x, or a == x and b past y"""
+    clauses = []
+    for position, (name, descending) in enumerate(keys):
+        column = columns[name]
+        past = column < values[position] if descending else column > values[position]
+        equal = [columns[prev_name] == value for (prev_name, _), value in zip(keys[:position], values)]
+        clauses.append(and_(*equal, past))
+    return or_(*clauses)
+
+
+def count_items(types: Iterable[str] = FEED_TYPES, tag: Optional[str] = None, artist: Optional[str] = None) -> int:
+    listing = merged_listing(types, tag, artist)
+    if listing is None:
+        return 0
+    return db.session.query(func.count()).select_from(listing).scalar()
+
+
+def feed_page(sort: str = 'newest', limit: int = DEFAULT_LIMIT, cursor: Optional[str] = None, offset: int = 0,
+              types: Iterable[str] = FEED_TYPES, tag: Optional[str] = None,
+              artist: Optional[str] = None) -> FeedPage:
+    """
+    One page of the merged listing.
+
+    Args:
+        sort: A FEED_SORTS name; unknown names sort by newest
+        limit: Items per page
+        cursor: next_cursor of the previous page; the page starts after it
+        offset: Items to skip (page-number links); applied after the cursor
+        types, tag, artist: Filters, see merged_listing
+
+    Returns:
+        The items, with their Video/Track loaded, and the cursor of the
+        next page (None on the last page)
+
+    Raises:
+        FeedQueryError: The cursor is malformed or belongs to another sort
+    """
+    if sort not in FEED_SORTS:
+        sort = 'newest'
+    keys = FEED_SORTS[sort]
+    listing = merged_listing(types, tag, artist)
+    if listing is None:
+        return FeedPage([], None)
+
+    query = db.session.query(listing)
+    if cursor:
+        query = query.filter(_after(listing.c, keys, decode_cursor(cursor, sort)))
+    order = [desc(listing.c[name]) if descending else listing.c[name] for name, descending in keys]
+    # One extra row tells whether there is a next page
+    rows = query.order_by(*order).offset(offset).limit(limit + 1).all()
+    has_next = len(rows) > limit
+    rows = rows[:limit]
+
+    video_ids = [row.id for row in rows if row.type == 'video']
+    track_ids = [row.id for row in rows if row.type == 'track']
+    objects = {}
+    if video_ids:
+        objects.update({('video', video.id): video for video in Video.query.filter(Video.id.in_(video_ids))})
+    if track_ids:
+        objects.update({('track', track.id): track for track in Track.query.filter(Track.id.in_(track_ids))})
+    items = [{
+        'type': row.type,
+        'id': row.id,
+        'object': objects[(row.type, row.id)]
+    } for row in rows if (row.type, row.id) in objects]
+
+    next_cursor = None
+    if has_next:
+        next_cursor = encode_cursor(sort, [getattr(rows[-1], name) for name, _ in keys])
+    return FeedPage(items, next_cursor)
+
+
+def artists_by_track(track_ids: Iterable[int]) -> Dict[int, List[Artist]]:
+    """Credited artists of each track, in one query"""
+    track_ids = list(track_ids)
+    credits: Dict[int, List[Artist]] = {}
+    if not track_ids:
+        return credits
+    rows = db.session.query(TrackArtist.track_id, Artist).join(Artist, Artist.id == TrackArtist.artist_id)\
+        .filter(TrackArtist.track_id.in_(track_ids)).order_by(TrackArtist.id).all()
+    for track_id, artist in rows:
+        credits.setdefault(track_id, []).append(artist)
+    return credits
@@ -0,0 +1,219 @@
+"""
+File Handles Module
+Keeps the media files players are streaming open between Range requests. A
+player issues dozens of requests per session; each one used to stat, open
+and seek the file again. Instead:
+
+- open descriptors live in a bounded LRU keyed by (path, mtime, size), so a
+  replaced file (e.g. after a trim) is never served from a stale descriptor
+- reads use os.pread, which takes the offset as an argument, so any number
+  of request threads can share one descriptor without locking around seeks
+- posix_fadvise tells the kernel the file is read sequentially and asks it to
+  prefetch the window ahead of each read
+
+stats() reports the hit rate and bytes served per second.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Iterator, Optional, Tuple
+
+# Descriptors kept open per process
+FILE_HANDLE_CACHE_SIZE = int(os.environ.get('EASYCORE_FILE_HANDLES', 64))
+# Bytes read per pread and yielded to the client
+STREAM_CHUNK_SIZE = 256 * 1024
+# Bytes the kernel is asked to prefetch ahead of the read position
+READAHEAD_BYTES = 4 * 1024 * 1024
+# Window for the bytes-per-second figure
+THROUGHPUT_WINDOW_SECONDS = 60
+
+_HAS_FADVISE = hasattr(os, 'posix_fadvise')
+
+
+class _Handle:
+    """One open descriptor. Evicted handles are closed once the last reader
+    lets go of them."""
+
+    def __init__(self, fd: int, size: int):
+        self.fd = fd
+        self.size = size
+        self.refs = 0
+        self.evicted = False
+        # Only used where os.pread is unavailable
+        self.seek_lock = threading.Lock()
+
+    def pread(self, length: int, offset: int) -> bytes:
+        if hasattr(os, 'pread'):
+            return os.pread(self.fd, length, offset)
+        with self.seek_lock:
+            os.lseek(self.fd, offset, os.SEEK_SET)
+            return os.read(self.fd, length)
+
+
+def _advise(fd: int, offset: int, length: int, advice_name: str) -> None:
+    if _HAS_FADVISE:
+        try:
+            os.posix_fadvise(fd, offset, length, getattr(os, advice_name))
+        except OSError:
+            pass
+
+
+class _RangeReader:
+    """Iterator over one byte range of a cached descriptor"""
+
+    def __init__(self, cache: 'FileHandleCache', handle: _Handle, start: int, end: int):
+        self._cache = cache
+        self._handle: Optional[_Handle] = handle
+        self._position = start
+        self._end = end
+        self._prefetched_to = start
+
+    def __iter__(self) -> '_RangeReader':
+        return self
+
+    def __next__(self) -> bytes:
+        handle = self._handle
+        if handle is None or self._position > self._end:
+            self.close()
+            raise StopIteration
+        remaining = self._end + 1 - self._position
+        if self._position >= self._prefetched_to:
+            window = min(READAHEAD_BYTES, remaining)
+            _advise(handle.fd, self._position, window, 'POSIX_FADV_WILLNEED')
+            self._prefetched_to = self._position + window
+        chunk = handle.pread(min(STREAM_CHUNK_SIZE, remaining), self._position)
+        if not chunk:
+            # The file shrank underneath us
+            self.close()
+            raise StopIteration
+        self._position += len(chunk)
+        self._cache._count(len(chunk))
+        return chunk
+
+    def close(self) -> None:
+        """Let go of the descriptor; safe to call more than once"""
+        if self._handle is not None:
+            handle, self._handle = self._handle, None
+            self._cache._release(handle)
+
+
+class FileHandleCache:
+    """Thread-safe LRU of open read-only descriptors."""
+
+    def __init__(self, max_handles: int = FILE_HANDLE_CACHE_SIZE):
+        self.max_handles = max_handles
+        self._handles: 'OrderedDict[Tuple[str, int, int], _Handle]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_served = 0
+        # (whole second, bytes) buckets for the recent throughput
+        self._throughput: Deque[Tuple[int, int]] = deque()
+
+    def _acquire(self, path: str) -> _Handle:
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            handle = self._handles.get(key)
+            if handle is not None:
+                self._handles.move_to_end(key)
+                handle.refs += 1
+                self.hits += 1
+                return handle
+            self.misses += 1
+
+        fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        _advise(fd, 0, 0, 'POSIX_FADV_SEQUENTIAL')
+        handle = _Handle(fd, stat.st_size)
+        handle.refs = 1
+        with self._lock:
+            existing = self._handles.get(key)
+            if existing is not None:
+                # Another thread opened it meanwhile; use theirs
+                existing.refs += 1
+                handle.refs = 0
+                handle.evicted = True
+                self._close_if_unused(handle)
+                return existing
+            # Older versions of the same file are never asked for again
+            for stale_key in [k for k in self._handles if k[0] == path]:
+                self._evict(stale_key)
+            self._handles[key] = handle
+            while len(self._handles) > self.max_handles:
+                self._evict(next(iter(self._handles)))
+        return handle
+
+    def _evict(self, key) -> None:
+        handle = self._handles.pop(key)
+        handle.evicted = True
+        self.evictions += 1
+        self._close_if_unused(handle)
+
+    @staticmethod
+    def _close_if_unused(handle: _Handle) -> None:
+        if handle.evicted and handle.refs == 0:
+            os.close(handle.fd)
+
+    def _release(self, handle: _Handle) -> None:
+        with self._lock:
+            handle.refs -= 1
+            self._close_if_unused(handle)
+
+    def _count(self, nbytes: int) -> None:
+        now = int(time.monotonic())
+        with self._lock:
+            self.bytes_served += nbytes
+            if self._throughput and self._throughput[-1][0] == now:
+                self._throughput[-1] = (now, self._throughput[-1][1] + nbytes)
+            else:
+                self._throughput.append((now, nbytes))
+            while self._throughput[0][0] <= now - THROUGHPUT_WINDOW_SECONDS:
+                self._throughput.popleft()
+
+    def open_range(self, path: str, start: int, end: Optional[int]) -> Tuple[Iterator[bytes], int, int, int]:
+        """
+        Read bytes start..end (inclusive, like an HTTP Range) of a file.
+
+        Args:
+            path: The file
+            start: First byte
+            end: Last byte, or None for the rest of the file; clamped to the size
+
+        Returns:
+            (chunks, start, end, file size). The descriptor stays referenced
+            until chunks is exhausted or closed (WSGI servers close it).
+
+        Raises:
+            ValueError: start is past the end of the file
+        """
+        handle = self._acquire(path)
+        if end is None or end >= handle.size:
+            end = handle.size - 1
+        if start > end:
+            self._release(handle)
+            raise ValueError(f"Range start {start} is past the end of {path} ({handle.size} bytes)")
+        return _RangeReader(self, handle, start, end), start, end, handle.size
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in list(self._handles):
+                self._evict(key)
+
+    def stats(self) -> Dict[str, float]:
+        now = int(time.monotonic())
+        with self._lock:
+            lookups = self.hits + self.misses
+            recent = sum(nbytes for second, nbytes in self._throughput
+                         if second > now - THROUGHPUT_WINDOW_SECONDS)
+            return {
+                'open_handles': len(self._handles),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+                'bytes_served': self.bytes_served,
+                'bytes_per_second': round(recent / THROUGHPUT_WINDOW_SECONDS, 1),
+            }
@@ -0,0 +1,167 @@
+"""
+Image Cache Module
+In-process caches for the image hot path: an id -> file/ETag map and a
+byte-bounded LRU of hot image bytes, plus a bounded map of versions for
+static URLs.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Tuple
+
+# Total bytes of image data kept in memory per process
+IMAGE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Files bigger than this are always streamed from disk
+IMAGE_CACHE_MAX_ENTRY_BYTES = 2 * 1024 * 1024
+# Max number of id -> path mappings remembered
+IMAGE_CACHE_MAX_MAPPINGS = 100000
+# Seconds before a mapping is re-checked against the file's mtime
+IMAGE_CACHE_REVALIDATE_SECONDS = 30
+# Max static file versions remembered per process
+STATIC_VERSION_MAX_ENTRIES = 20000
+
+
+class ImageEntry(NamedTuple):
+    path: str
+    etag: str
+    size: int
+    mtime_ns: int
+    checked_at: float
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+class ImageCache:
+    """Thread-safe LRU keyed by an arbitrary key (e.g. ('video', 12, 320))."""
+
+    def __init__(self, max_bytes: int = IMAGE_CACHE_MAX_BYTES, max_entry_bytes: int = IMAGE_CACHE_MAX_ENTRY_BYTES,
+                 max_mappings: int = IMAGE_CACHE_MAX_MAPPINGS):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.max_mappings = max_mappings
+        self._entries: 'OrderedDict[object, ImageEntry]' = OrderedDict()
+        self._data: 'OrderedDict[str, bytes]' = OrderedDict()
+        self._data_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key) -> Optional[ImageEntry]:
+        """Return the mapping for key, re-stat'ing it if it is due for revalidation."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+        if time.monotonic() - entry.checked_at < IMAGE_CACHE_REVALIDATE_SECONDS:
+            return entry
+        try:
+            stat = os.stat(entry.path)
+        except OSError:
+            self.invalidate(key)
+            return None
+        if stat.st_mtime_ns != entry.mtime_ns or stat.st_size != entry.size:
+            self.invalidate(key)
+            return None
+        entry = entry._replace(checked_at=time.monotonic())
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+    def remember(self, key, path: str) -> ImageEntry:
+        """Map key to path, computing a content-based ETag."""
+        stat = os.stat(path)
+        entry = ImageEntry(path, _file_digest(path), stat.st_size, stat.st_mtime_ns, time.monotonic())
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_mappings:
+                self._entries.popitem(last=False)
+        return entry
+
+    def read(self, entry: ImageEntry) -> Optional[bytes]:
+        """Bytes for entry from memory (or disk, caching them), None if too large to cache."""
+        cache_key = f"{entry.path}:{entry.etag}"
+        with self._lock:
+            data = self._data.get(cache_key)
+            if data is not None:
+                self._data.move_to_end(cache_key)
+                self.hits += 1
+                return data
+            self.misses += 1
+        if entry.size > self.max_entry_bytes:
+            return None
+        with open(entry.path, 'rb') as f:
+            data = f.read()
+        with self._lock:
+            if cache_key not in self._data:
+                self._data[cache_key] = data
+                self._data_bytes += len(data)
+                while self._data_bytes > self.max_bytes and self._data:
+                    _, evicted = self._data.popitem(last=False)
+                    self._data_bytes -= len(evicted)
+        return data
+
+    def invalidate(self, key) -> None:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return
+            data = self._data.pop(f"{entry.path}:{entry.etag}", None)
+            if data is not None:
+                self._data_bytes -= len(data)
+
+    def invalidate_prefix(self, prefix: Tuple) -> None:
+        """Drop every key that is a tuple starting with prefix (e.g. ('video', 12))."""
+        with self._lock:
+            keys = [k for k in self._entries if isinstance(k, tuple) and k[:len(prefix)] == prefix]
+        for key in keys:
+            self.invalidate(key)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'mappings': len(self._entries),
+                'cached_files': len(self._data),
+                'cached_bytes': self._data_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+# path -> (version, or None for a missing file; monotonic time it was checked)
+_versions: 'OrderedDict[str, Tuple[Optional[str], float]]' = OrderedDict()
+_versions_lock = threading.Lock()
+
+
+def static_version(abs_path: str) -> Optional[str]:
+    """Short version for cache-busting static URLs, taken from the file's mtime
+    and size so the file is never read. A version is re-checked at most every
+    IMAGE_CACHE_REVALIDATE_SECONDS, and the least recently used ones are
+    dropped past STATIC_VERSION_MAX_ENTRIES."""
+    now = time.monotonic()
+    with _versions_lock:
+        cached = _versions.get(abs_path)
+        if cached and now - cached[1] < IMAGE_CACHE_REVALIDATE_SECONDS:
+            _versions.move_to_end(abs_path)
+            return cached[0]
+    try:
+        stat = os.stat(abs_path)
+        version = hashlib.sha1(f"{stat.st_mtime_ns}:{stat.st_size}".encode()).hexdigest()[:10]
+    except OSError:
+        version = None
+    with _versions_lock:
+        _versions[abs_path] = (version, now)
+        _versions.move_to_end(abs_path)
+        while len(_versions) > STATIC_VERSION_MAX_ENTRIES:
+            _versions.popitem(last=False)
+    return version
@@ -0,0 +1,185 @@
+"""
+Image Derivatives Module
+Builds downscaled WebP and JPEG copies of thumbnails, covers and avatars so
+listing pages can pick a size through srcset instead of the original upload.
+"""
+
+import os
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+# Pillow is imported where images are processed, not when the app boots
+if TYPE_CHECKING:
+    from PIL import Image
+
+# Widths (in pixels) generated for every image
+DERIVATIVE_WIDTHS = (160, 320, 640, 1280)
+
+# Extension -> (Pillow format, save options)
+DERIVATIVE_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+# Folder (relative to the static folder) that mirrors the layout of the originals
+DERIVED_DIRNAME = 'derived'
+
+# EXIF Orientation values that rotate the image by 90 or 270 degrees
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+# rel_path -> widths available on disk, filled lazily by available_widths()
+_width_cache: Dict[str, Tuple[int, ...]] = {}
+
+
+def derivative_rel_path(rel_path: str, width: int, ext: str) -> str:
+    """Return the static-relative path of one derivative, e.g.
+    covers/cover_x.png -> derived/covers/cover_x_320.webp"""
+    base = os.path.splitext(rel_path.replace('\\', '/'))[0]
+    return f"{DERIVED_DIRNAME}/{base}_{width}.{ext}"
+
+
+def target_widths(source_width: int) -> List[int]:
+    """Width buckets to generate for a source image. Buckets below the source
+    width are downscaled; the first bucket at or above it holds a full-size
+    copy, so we never upscale and every file is named after a known bucket."""
+    widths = [w for w in DERIVATIVE_WIDTHS if w < source_width]
+    larger = [w for w in DERIVATIVE_WIDTHS if w >= source_width]
+    if larger:
+        widths.append(larger[0])
+    return widths
+
+
+def _oriented_size(image: 'Image.Image') -> Tuple[int, int]:
+    """Width and height as displayed, i.e. after exif_transpose"""
+    if image.getexif().get(0x0112) in TRANSPOSED_ORIENTATIONS:
+        return image.height, image.width
+    return image.width, image.height
+
+
+def _open_for_resize(abs_path: str, min_width: int) -> 'Image.Image':
+    """Open an image, letting the JPEG decoder downscale while decoding
+    (draft mode) when we only need a much smaller result."""
+    from PIL import Image, ImageOps
+
+    image = Image.open(abs_path)
+    width, _ = _oriented_size(image)
+    if image.format == 'JPEG' and width > min_width:
+        # draft() takes the size as stored, before the EXIF rotation
+        scale = min_width / width
+        image.draft('RGB', (max(1, int(image.width * scale)), max(1, int(image.height * scale))))
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+    return image
+
+
+def _flatten(image: 'Image.Image') -> 'Image.Image':
+    """JPEG has no alpha channel; composite transparent images onto white."""
+    if image.mode != 'RGBA':
+        return image
+    from PIL import Image
+
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def _save_atomic(image: 'Image.Image', abs_path: str, pil_format: str, options: dict) -> None:
+    tmp_path = f"{abs_path}.tmp"
+    image.save(tmp_path, pil_format, **options)
+    os.replace(tmp_path, abs_path)
+
+
+def generate_derivatives(rel_path: str, static_folder: str, force: bool = False) -> List[int]:
+    """
+    Generate every derivative width/format for an image stored under the static folder.
+
+    Args:
+        rel_path: Path of the original relative to the static folder (as stored in the DB)
+        static_folder: Absolute path of the app's static folder
+        force: Regenerate derivatives that already exist
+
+    Returns:
+        The list of widths that are available after the run
+    """
+    from PIL import Image
+
+    abs_path = os.path.join(static_folder, rel_path)
+    with Image.open(abs_path) as probe:
+        source_width, _ = _oriented_size(probe)
+    widths = sorted(target_widths(source_width), reverse=True)
+
+    pending = [
+        w for w in widths
+        if force or not all(
+            os.path.exists(os.path.join(static_folder, derivative_rel_path(rel_path, w, ext)))
+            for ext in DERIVATIVE_FORMATS
+        )
+    ]
+
+    if pending:
+        out_dir = os.path.dirname(os.path.join(static_folder, derivative_rel_path(rel_path, widths[0], 'jpg')))
+        os.makedirs(out_dir, exist_ok=True)
+
+        # Decode once at (roughly) the largest size we need, then step down
+        image = _open_for_resize(abs_path, pending[0])
+        try:
+            for width in pending:
+                if image.width > width:
+                    height = max(1, round(image.height * width / image.width))
+                    image = image.resize((width, height), Image.LANCZOS)
+                for ext, (pil_format, options) in DERIVATIVE_FORMATS.items():
+                    out_image = _flatten(image) if pil_format == 'JPEG' else image
+                    out_path = os.path.join(static_folder, derivative_rel_path(rel_path, width, ext))
+                    _save_atomic(out_image, out_path, pil_format, options)
+        finally:
+            image.close()
+
+    result = tuple(sorted(widths))
+    _width_cache[rel_path] = result
+    return list(result)
+
+
+def safe_generate_derivatives(rel_path: Optional[str], static_folder: str, force: bool = True) -> None:
+    """Upload-time wrapper: a failed derivative must never fail the upload.
+    Forces by default because the original was usually just (re)written."""
+    if not rel_path:
+        return
+    try:
+        generate_derivatives(rel_path, static_folder, force=force)
+    except Exception as e:
+        print(f"Error generating image derivatives for {rel_path}: {e}")
+
+
+def available_widths(rel_path: Optional[str], static_folder: str) -> Tuple[int, ...]:
+    """Widths that exist on disk for rel_path (memoized per process)."""
+    if not rel_path:
+        return ()
+    cached = _width_cache.get(rel_path)
+    if cached is not None:
+        return cached
+    widths = tuple(
+        w for w in DERIVATIVE_WIDTHS
+        if os.path.exists(os.path.join(static_folder, derivative_rel_path(rel_path, w, 'jpg')))
+    )
+    # Only remember positive results so a later backfill is picked up
+    if widths:
+        _width_cache[rel_path] = widths
+    return widths
+
+
+def forget(rel_path: Optional[str]) -> None:
+    """Drop the memoized widths for rel_path (after a delete or replace)."""
+    if rel_path:
+        _width_cache.pop(rel_path, None)
+
+
+def move_derivatives(old_rel_path: str, new_rel_path: str, static_folder: str) -> None:
+    """Move the derivatives of an image whose original moved (see storage_layout.py)"""
+    for width in DERIVATIVE_WIDTHS:
+        for ext in DERIVATIVE_FORMATS:
+            source = os.path.join(static_folder, derivative_rel_path(old_rel_path, width, ext))
+            if os.path.exists(source):
+                target = os.path.join(static_folder, derivative_rel_path(new_rel_path, width, ext))
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(source, target)
+    forget(old_rel_path)
@@ -0,0 +1,442 @@
+"""
+Ingest Module
+Shared processing for media files that are already in their storage folder:
+naming, transcoding to MP4, thumbnails/storyboards and the database rows.
+Used by the form upload routes and the chunked upload protocol alike.
+
+Video ingest is split in two: prepare_video_media does the ffmpeg work and
+can run in a worker process, add_video_row writes the database row. Each file
+is probed once; the probe drives the thumbnail and storyboard and its
+metadata (duration, size, codecs...) is stored on the row.
+
+Uploads are identified by the SHA-256 of their bytes; callers look the hash
+up with find_duplicate_video/find_duplicate_track *before* saving so a
+re-sent file is never stored, converted or thumbnailed twice. The lookup is
+limited to the upload folder the file would go to, keeping stealth and
+regular uploads apart.
+"""
+
+import hashlib
+import json
+import os
+from concurrent.futures import as_completed
+from datetime import datetime
+from typing import Any, BinaryIO, Callable, Dict, List, Optional
+
+import ffmpeg
+from flask import current_app
+from werkzeug.utils import secure_filename
+
+import image_derivatives
+import ingest_pool
+from jobs import enqueue, job_handler
+from media_metadata import apply_metadata, extract_metadata, safe_probe_metadata
+from models import db, Video, Track, Artist, TrackArtist, PlaylistVideo
+from storage import get_storage, publish_media
+from storage_layout import new_file_id, sharded_path, sharded_rel_path
+from storyboard import safe_generate_storyboard
+from thumbnails import generate_video_thumbnail
+from transcode import execute_plan, plan_from_probe
+
+# Anything but browser-ready MP4 is remuxed or transcoded at ingest (see transcode.py)
+VIDEO_EXTENSIONS = ['.mp4', '.webm', '.mov', '.m4v', '.mkv', '.avi']
+AUDIO_EXTENSIONS = ['.mp3', '.wav', '.ogg', '.oga', '.flac', '.m4a', '.aac']
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.webp']
+
+# Folders uploads are stored in; duplicates are only looked up within one
+UPLOAD_FOLDER_KEYS = ('UPLOAD_FOLDER', 'STEALTH_UPLOAD_FOLDER', 'AUDIO_UPLOAD_FOLDER', 'STEALTH_AUDIO_UPLOAD_FOLDER')
+
+HASH_BUFFER_SIZE = 1024 * 1024
+
+
+def hash_stream(stream: BinaryIO) -> str:
+    """SHA-256 of a seekable stream (e.g. FileStorage.stream), rewound afterwards
+    so it can still be saved"""
+    hasher = hashlib.sha256()
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(HASH_BUFFER_SIZE), b''):
+        hasher.update(chunk)
+    stream.seek(0)
+    return hasher.hexdigest()
+
+
+def hash_file(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hash_stream(f)
+
+
+def allowed_files_message(extensions: List[str]) -> str:
+    """Error for an upload of another type, e.g. "Only MP4 and WEBM files are allowed" """
+    names = [extension.lstrip('.').upper() for extension in extensions]
+    listed = names[0] if len(names) == 1 else f"{', '.join(names[:-1])} and {names[-1]}"
+    return f"Only {listed} files are allowed"
+
+
+def upload_folder_of(path: str) -> Optional[str]:
+    """The configured upload folder (regular or stealth, video or audio) a
+    stored file lives in"""
+    path = os.path.abspath(path)
+    for key in UPLOAD_FOLDER_KEYS:
+        folder = os.path.abspath(current_app.config[key])
+        if path.startswith(folder + os.sep):
+            return folder
+    return None
+
+
+def _find_duplicate(model, content_hash: Optional[str], upload_folder: Optional[str]):
+    if not content_hash:
+        return None
+    query = model.query.filter_by(content_hash=content_hash)
+    if upload_folder:
+        # A stealth upload never resolves to a public copy, and vice versa
+        query = query.filter(model.stored_filepath.startswith(os.path.abspath(upload_folder) + os.sep,
+                                                              autoescape=True))
+    storage = get_storage()
+    for row in query.order_by(model.id):
+        if storage.exists(row.stored_filepath):
+            return row
+    return None
+
+
+def find_duplicate_video(content_hash: Optional[str], upload_folder: Optional[str]) -> Optional[Video]:
+    """Existing video with the same uploaded bytes in the same upload folder
+    whose file is still stored (locally or in the storage backend)"""
+    return _find_duplicate(Video, content_hash, upload_folder)
+
+
+def find_duplicate_track(content_hash: Optional[str], upload_folder: Optional[str]) -> Optional[Track]:
+    """Existing track with the same uploaded bytes in the same upload folder
+    whose file is still stored (locally or in the storage backend)"""
+    return _find_duplicate(Track, content_hash, upload_folder)
+
+
+def link_to_playlist(video: Video, playlist_id: int, position: Optional[int] = None) -> None:
+    db.session.add(PlaylistVideo(playlist_id=playlist_id, video_id=video.id, position=position or 1))
+
+
+def batch_video_nickname(playlist_name: Optional[str], apply_to_videos: bool, tags: Optional[str],
+                         position: int) -> Optional[str]:
+    """Nickname of the position-th (1-based) video of a multi-file upload,
+    from the playlist name and/or tags; None if neither applies"""
+    tag_words = ' '.join(tag.strip() for tag in tags.split(',')) if tags else ''
+    if playlist_name and apply_to_videos:
+        return f"{playlist_name} - {tag_words} {position}" if tags else f"{playlist_name} - {position}"
+    if tags:
+        return f"{tag_words} {datetime.now().strftime('%H%M%S')}_{position}"
+    return None
+
+
+def generate_unique_filename(original_filename, upload_folder):
+    """Name and sharded path for a new audio file; the id makes it unique
+    without checking the folder (see storage_layout.py)"""
+    ext = os.path.splitext(original_filename)[1].lower()
+    filename = secure_filename(f"{new_file_id()}{ext}")
+    return filename, sharded_path(upload_folder, filename)
+
+
+def generate_video_filename(extension, upload_folder):
+    """Name and sharded path for a new video file; the id makes it unique
+    without checking the folder (see storage_layout.py)"""
+    filename = secure_filename(f"{new_file_id()}{extension.lower()}")
+    return filename, sharded_path(upload_folder, filename)
+
+
+def save_track_cover(background, track_filename, cover_folder, static_folder):
+    """Save an optional cover upload for a track; returns its static-relative path or None"""
+    if not background or not background.filename:
+        return None
+    cover_ext = os.path.splitext(background.filename)[1].lower()
+    if cover_ext not in IMAGE_EXTENSIONS:
+        return None
+    cover_filename = secure_filename(f"cover_{os.path.splitext(track_filename)[0]}{cover_ext}")
+    background.save(sharded_path(cover_folder, cover_filename))
+    relative_cover_path = sharded_rel_path('covers', cover_filename)
+    image_derivatives.safe_generate_derivatives(relative_cover_path, static_folder)
+    return relative_cover_path
+
+
+def prepare_video_media(stored_filepath: str, static_folder: str, threads: Optional[int] = None,
+                        progress: Optional[Callable[[str, float], None]] = None) -> Dict[str, Any]:
+    """
+    File-only half of video ingest: probe, transcode plan (remux or re-encode
+    only if the file is not browser-ready), thumbnail and storyboard. It
+    touches no database state, so it can run in a worker process (see
+    ingest_pool.py).
+
+    Args:
+        stored_filepath: Absolute path of the saved upload
+        static_folder: Absolute path of the app's static folder
+        threads: ffmpeg thread budget for this file (None lets ffmpeg decide)
+        progress: Optional callback receiving (stage, fraction); in-process only
+
+    Returns:
+        Dict with the final stored_filepath, the thumbnail_path, the probed
+        metadata (see media_metadata.METADATA_FIELDS) and the transcode_plan
+    """
+    progress = progress or (lambda stage, fraction: None)
+
+    # A previous attempt may have converted the upload to MP4 before failing
+    if not os.path.exists(stored_filepath):
+        converted = os.path.splitext(stored_filepath)[0] + '.mp4'
+        if not os.path.exists(converted):
+            raise FileNotFoundError(f"Uploaded file not found: {stored_filepath}")
+        stored_filepath = converted
+
+    progress('probing', 0.05)
+    probe = ffmpeg.probe(stored_filepath)
+    plan = plan_from_probe(probe, stored_filepath, threads)
+    if plan['action'] != 'keep':
+        progress('converting', 0.1)
+        stored_filepath = execute_plan(stored_filepath, plan)
+        probe = ffmpeg.probe(stored_filepath)
+
+    # Generate thumbnail (middle frame plus resized derivatives) and storyboard
+    progress('thumbnail', 0.6)
+    relative_thumbnail_path = generate_video_thumbnail(stored_filepath, static_folder, probe)
+    progress('storyboard', 0.75)
+    safe_generate_storyboard(stored_filepath, static_folder, probe, threads=threads)
+
+    return {"stored_filepath": stored_filepath, "thumbnail_path": relative_thumbnail_path,
+            "metadata": extract_metadata(probe, stored_filepath), "transcode_plan": plan}
+
+
+def add_video_row(media: Dict[str, Any], original_filepath: str, nickname: Optional[str] = None,
+                  description: Optional[str] = None, tags: Optional[str] = None,
+                  playlist_id: Optional[int] = None, position: Optional[int] = None,
+                  content_hash: Optional[str] = None) -> Video:
+    """
+    Add the Video row for a prepared file to the session. The caller commits.
+
+    Args:
+        media: Result of prepare_video_media
+        original_filepath: File name the user uploaded
+        playlist_id/position: Optionally append the video to a playlist
+        content_hash: SHA-256 of the uploaded bytes, computed by the caller
+    """
+    video = Video(original_filepath=original_filepath,
+                  stored_filepath=media['stored_filepath'],
+                  nickname=nickname,
+                  description=description,
+                  tags=tags,
+                  thumbnail_path=media['thumbnail_path'],
+                  view_count=0,
+                  content_hash=content_hash,
+                  transcode_plan=json.dumps(media['transcode_plan']) if media.get('transcode_plan') else None)
+    apply_metadata(video, media.get('metadata', {}))
+    db.session.add(video)
+
+    if playlist_id:
+        db.session.flush()  # Get video ID
+        link_to_playlist(video, playlist_id, position)
+    return video
+
+
+def ingest_track(stored_filepath: str, original_filepath: str, nickname: Optional[str] = None,
+                 description: Optional[str] = None, tags: Optional[str] = None,
+                 artist_name: Optional[str] = None, background_image_path: Optional[str] = None,
+                 content_hash: Optional[str] = None) -> Track:
+    """Add a saved audio upload (and its optional artist) to the session. The caller commits."""
+    track = Track(
+        original_filepath=original_filepath,
+        stored_filepath=stored_filepath,
+        nickname=nickname,
+        description=description,
+        tags=tags,
+        background_image_path=background_image_path,
+        view_count=0,
+        likes=0,
+        content_hash=content_hash,
+    )
+    # Audio is stored as uploaded, so probing is the only ffmpeg work here
+    apply_metadata(track, safe_probe_metadata(stored_filepath))
+    db.session.add(track)
+    # Optional artist association (create if missing)
+    if artist_name:
+        artist = Artist.query.filter(Artist.name.ilike(artist_name)).first()
+        if not artist:
+            artist = Artist(name=artist_name)
+            db.session.add(artist)
+        db.session.flush()
+        db.session.add(TrackArtist(track_id=track.id, artist_id=artist.id))
+    return track
+
+
+def enqueue_video_ingest(stored_filepath: str, original_filepath: str, **fields):
+    """Queue ingest for one saved upload; fields are add_video_row keyword
+    arguments. The caller commits."""
+    return enqueue('ingest_video', dict(fields, stored_filepath=stored_filepath,
+                                        original_filepath=original_filepath))
+
+
+def enqueue_video_batch(items: List[Dict[str, Any]]):
+    """Queue ingest for several saved uploads at once. Each item holds
+    stored_filepath, original_filepath and add_video_row keyword arguments.
+    The files are processed in parallel and inserted in a single commit."""
+    return enqueue('ingest_video_batch', {"items": items}, units=len(items))
+
+
+def _ingested_row(item: Dict[str, Any]) -> Optional[Video]:
+    """The row an earlier attempt of this job already committed for the item.
+    A job runs again when its commit succeeded but marking it done did not
+    (e.g. on a locked database); the file then belongs to that row."""
+    path = item['stored_filepath']
+    # A converted upload is stored next to the original as MP4
+    return (Video.query.filter(Video.stored_filepath.in_([path, os.path.splitext(path)[0] + '.mp4']))
+            .order_by(Video.id).first())
+
+
+def _queued_duplicate(item: Dict[str, Any]) -> Optional[Video]:
+    """If the same bytes finished ingesting while this item waited in the
+    queue, drop the new file and return the existing video to reuse; the
+    caller links it to the item's playlist"""
+    duplicate = find_duplicate_video(item.get('content_hash'), upload_folder_of(item['stored_filepath']))
+    if not duplicate or duplicate.stored_filepath == item['stored_filepath']:
+        return None
+    _remove_upload(item)
+    return duplicate
+
+
+def _remove_upload(item: Dict[str, Any]) -> None:
+    if os.path.exists(item['stored_filepath']):
+        os.remove(item['stored_filepath'])
+
+
+def _row_fields(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value for key, value in item.items() if key not in ('stored_filepath', 'original_filepath')}
+
+
+@job_handler('ingest_video')
+def run_ingest_video_job(job, payload, progress):
+    video = _ingested_row(payload)
+    if video:
+        publish_media(video.stored_filepath)
+        return {"video_id": video.id}
+
+    duplicate = _queued_duplicate(payload)
+    if duplicate:
+        if payload.get('playlist_id'):
+            link_to_playlist(duplicate, payload['playlist_id'], payload.get('position'))
+        db.session.commit()
+        return {"video_id": duplicate.id, "duplicate": True}
+
+    progress('processing', 0.1)
+    media = ingest_pool.run(prepare_video_media, payload['stored_filepath'], current_app.static_folder,
+                            ingest_pool.FFMPEG_THREADS_PER_JOB)
+    progress('saving', 0.95)
+    video = add_video_row(media, payload['original_filepath'], **_row_fields(payload))
+    db.session.commit()
+    publish_media(video.stored_filepath)
+    return {"video_id": video.id}
+
+
+@job_handler('ingest_video_batch')
+def run_ingest_video_batch_job(job, payload, progress):
+    items = payload['items']
+    video_ids: List[Optional[int]] = [None] * len(items)
+    duplicates, errors = [], []
+
+    # Rows and links are committed together, so one row from an earlier
+    # attempt means the whole batch went in; only the result is rebuilt
+    ingested = {index: _ingested_row(item) for index, item in enumerate(items)}
+    if any(ingested.values()):
+        for index, item in enumerate(items):
+            video = ingested[index]
+            if video:
+                publish_media(video.stored_filepath)
+            else:
+                video = find_duplicate_video(item.get('content_hash'), upload_folder_of(item['stored_filepath']))
+                if video:
+                    duplicates.append(item['original_filepath'])
+                else:
+                    errors.append(f"Error processing {item['original_filepath']}")
+            video_ids[index] = video.id if video else None
+        return {"videos": video_ids, "duplicates": duplicates, "errors": errors}
+    media_by_index: Dict[int, Dict[str, Any]] = {}
+
+    pending = {}
+    first_index_by_hash: Dict[str, int] = {}
+    repeats: Dict[int, int] = {}  # index -> earlier index with the same bytes in this batch
+    existing: Dict[int, Video] = {}  # index -> video that already had the same bytes
+    for index, item in enumerate(items):
+        duplicate = _queued_duplicate(item)
+        if duplicate:
+            existing[index] = duplicate
+            video_ids[index] = duplicate.id
+            duplicates.append(item['original_filepath'])
+            continue
+        content_hash = item.get('content_hash')
+        if content_hash and content_hash in first_index_by_hash:
+            repeats[index] = first_index_by_hash[content_hash]
+            duplicates.append(item['original_filepath'])
+            _remove_upload(item)
+            continue
+        if content_hash:
+            first_index_by_hash[content_hash] = index
+        # Blocks while the machine's ffmpeg slots are full
+        future = ingest_pool.submit(prepare_video_media, item['stored_filepath'], current_app.static_folder,
+                                    ingest_pool.FFMPEG_THREADS_PER_JOB)
+        pending[future] = index
+
+    for done, future in enumerate(as_completed(pending), start=1):
+        index = pending[future]
+        try:
+            media_by_index[index] = future.result()
+        except Exception as e:
+            print(f"Error processing {items[index]['original_filepath']}: {str(e)}")
+            errors.append(f"Error processing {items[index]['original_filepath']}: {str(e)}")
+            # No row will point at the upload
+            _remove_upload(items[index])
+        progress('processing', 0.9 * done / len(pending))
+
+    # All rows and playlist links go in with one commit, in upload order;
+    # progress() commits, so nothing is added to the session before this
+    progress('saving', 0.95)
+    rows = {}
+    for index in sorted(media_by_index):
+        item = items[index]
+        rows[index] = add_video_row(media_by_index[index], item['original_filepath'], **_row_fields(item))
+    db.session.flush()
+    for index, video in existing.items():
+        if items[index].get('playlist_id'):
+            link_to_playlist(video, items[index]['playlist_id'], items[index].get('position'))
+    for index, first in repeats.items():
+        if first in rows and items[index].get('playlist_id'):
+            link_to_playlist(rows[first], items[index]['playlist_id'], items[index].get('position'))
+    db.session.commit()
+    for index, video in rows.items():
+        video_ids[index] = video.id
+        publish_media(video.stored_filepath)
+    for index, first in repeats.items():
+        video_ids[index] = video_ids[first]
+
+    return {"videos": video_ids, "duplicates": duplicates, "errors": errors}
+
+
+def refresh_video_media(video: Video, static_folder: str,
+                        progress: Optional[Callable[[str, float], None]] = None) -> None:
+    """
+    Rebuild metadata, thumbnail, storyboard and content hash after a video's
+    file was replaced (e.g. trimmed). The file must be on local disk (see
+    storage.local_copy). The caller commits.
+    """
+    progress = progress or (lambda stage, fraction: None)
+    progress('probing', 0.1)
+    probe = ffmpeg.probe(video.stored_filepath)
+    apply_metadata(video, extract_metadata(probe, video.stored_filepath))
+    progress('thumbnail', 0.3)
+    video.thumbnail_path = generate_video_thumbnail(video.stored_filepath, static_folder, probe)
+    progress('storyboard', 0.5)
+    safe_generate_storyboard(video.stored_filepath, static_folder, probe)
+    progress('hashing', 0.8)
+    video.content_hash = hash_file(video.stored_filepath)
+
+
+@job_handler('refresh_video_media')
+def run_refresh_video_media_job(job, payload, progress):
+    video = db.session.get(Video, payload['video_id'])
+    if video is None:
+        return {"video_id": payload['video_id'], "deleted": True}
+    with get_storage().local_copy(video.stored_filepath):
+        refresh_video_media(video, current_app.static_folder, progress)
+    db.session.commit()
+    return {"video_id": video.id}
@@ -0,0 +1,189 @@
+"""
+Ingest Pool Module
+Runs the CPU-heavy half of video ingest (conversion, probe, thumbnail,
+storyboard) in a shared process pool so bulk uploads use every core.
+
+Two limits keep the machine from being oversubscribed:
+- at most FFMPEG_CONCURRENCY ffmpeg pipelines run at once, each with a
+  thread budget of FFMPEG_THREADS_PER_JOB; submit() and slot() block when
+  the slots are full, which stalls the job workers instead of piling up work
+- new uploads are refused (HTTP 503) once INGEST_MAX_PENDING_FILES files are
+  queued or running, see admission_check()
+
+The slots are lock files in SLOT_LOCK_DIR held with flock, so the limit is
+shared by every process on the machine: the web server's job workers,
+`flask run-jobs` and batch extracts. Without fcntl (Windows) the limit only
+applies within each process.
+"""
+
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+
+import ffmpeg
+from flask import jsonify
+from sqlalchemy import func
+
+from models import db, Job
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def _cpu_count() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# ffmpeg threads given to each file's pipeline
+FFMPEG_THREADS_PER_JOB = int(os.environ.get('EASYCORE_FFMPEG_THREADS', 2))
+# Files processed at once on the machine; defaults to filling the CPUs with the thread budget above
+FFMPEG_CONCURRENCY = int(os.environ.get('EASYCORE_FFMPEG_CONCURRENCY', 0)) or max(1, _cpu_count() // FFMPEG_THREADS_PER_JOB)
+# Files allowed to wait in the ingest queue before uploads are turned away
+INGEST_MAX_PENDING_FILES = int(os.environ.get('EASYCORE_INGEST_MAX_PENDING', FFMPEG_CONCURRENCY * 25))
+# Suggested client wait when the queue is full
+INGEST_RETRY_AFTER_SECONDS = 30
+INGEST_JOB_KINDS = ('ingest_video', 'ingest_video_batch')
+# Lock files backing the machine-wide slots; every process must use the same folder
+SLOT_LOCK_DIR = os.environ.get('EASYCORE_SLOT_DIR') or os.path.join(tempfile.gettempdir(), 'easycore-ffmpeg-slots')
+# How often a process waiting for a slot held by another process retries
+SLOT_POLL_SECONDS = 0.2
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(FFMPEG_CONCURRENCY)
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: the parent runs worker threads and holds SQLite handles,
+            # neither of which is safe to fork
+            _executor = ProcessPoolExecutor(max_workers=FFMPEG_CONCURRENCY,
+                                            mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+
+def _reset_executor(broken: ProcessPoolExecutor) -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is broken:
+            _executor = None
+    broken.shutdown(wait=False)
+
+
+def _call(fn: Callable, *args, **kwargs):
+    """Runs in the child. ffmpeg.Error cannot be pickled back to the parent
+    (it would break the whole pool), so it is re-raised as a RuntimeError."""
+    try:
+        return fn(*args, **kwargs)
+    except ffmpeg.Error as e:
+        stderr = e.stderr.decode(errors='replace').strip().splitlines() if e.stderr else []
+        raise RuntimeError(f"{e}: {stderr[-1] if stderr else 'no output'}") from None
+
+
+def _acquire_machine_slot() -> Optional[int]:
+    """Lock one of the slot files; returns its descriptor (None without fcntl)"""
+    if fcntl is None:
+        return None
+    os.makedirs(SLOT_LOCK_DIR, exist_ok=True)
+    while True:
+        for index in range(FFMPEG_CONCURRENCY):
+            fd = os.open(os.path.join(SLOT_LOCK_DIR, f"slot-{index}.lock"), os.O_RDWR | os.O_CREAT, 0o666)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        time.sleep(SLOT_POLL_SECONDS)
+
+
+def _acquire() -> Optional[int]:
+    _slots.acquire()
+    try:
+        return _acquire_machine_slot()
+    except Exception:
+        _slots.release()
+        raise
+
+
+def _release(fd: Optional[int]) -> None:
+    if fd is not None:
+        # Closing the descriptor drops its flock
+        os.close(fd)
+    _slots.release()
+
+
+@contextmanager
+def slot():
+    """Hold one ffmpeg slot while running ffmpeg outside the process pool
+    (e.g. a subprocess); blocks while all slots on the machine are busy"""
+    fd = _acquire()
+    try:
+        yield
+    finally:
+        _release(fd)
+
+
+def submit(fn: Callable, *args, **kwargs) -> Future:
+    """Run fn(*args, **kwargs) in the process pool. Blocks while all
+    FFMPEG_CONCURRENCY slots on the machine are busy."""
+    fd = _acquire()
+    try:
+        executor = _get_executor()
+        try:
+            future = executor.submit(_call, fn, *args, **kwargs)
+        except BrokenProcessPool:
+            # A child died (e.g. OOM-killed); start a fresh pool
+            _reset_executor(executor)
+            future = _get_executor().submit(_call, fn, *args, **kwargs)
+    except Exception:
+        _release(fd)
+        raise
+    future.add_done_callback(lambda _: _release(fd))
+    return future
+
+
+def run(fn: Callable, *args, **kwargs):
+    """submit() and wait for the result"""
+    return submit(fn, *args, **kwargs).result()
+
+
+def shutdown() -> None:
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+def pending_ingest_files() -> int:
+    """Files in ingest jobs that are queued or running, across all processes"""
+    return (db.session.query(func.coalesce(func.sum(Job.units), 0))
+            .filter(Job.kind.in_(INGEST_JOB_KINDS), Job.status.in_(('queued', 'running')))
+            .scalar())
+
+
+def admission_check(new_files: int) -> bool:
+    """True if new_files more files may be queued for ingest right now"""
+    return pending_ingest_files() + new_files <= max(INGEST_MAX_PENDING_FILES, new_files)
+
+
+def busy_response():
+    """503 telling the client to retry once the ingest queue drains"""
+    resp = jsonify({"error": "The server is busy processing uploads. Please try again shortly.",
+                    "pending_files": pending_ingest_files()})
+    resp.status_code = 503
+    resp.headers.set('Retry-After', str(INGEST_RETRY_AFTER_SECONDS))
+    return resp
@@ -0,0 +1,246 @@
+"""
+Jobs Module
+A small persistent job queue backed by the `job` table. Requests enqueue work
+and return immediately; a pool of worker threads claims queued jobs, runs the
+registered handler inside an app context and records progress, results and
+errors. Jobs survive restarts: a running job whose worker stops refreshing
+its lease is put back on the queue, and failures are retried with backoff.
+"""
+
+import json
+import os
+import socket
+import threading
+import traceback
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+
+from models import db, Job
+
+# Worker threads started per process
+JOB_WORKERS = int(os.environ.get('EASYCORE_JOB_WORKERS', 2))
+# Seconds an idle worker waits before polling the table again
+JOB_POLL_SECONDS = 2
+# Running jobs refresh locked_at this often...
+JOB_HEARTBEAT_SECONDS = 15
+# ...and are considered abandoned (worker crashed or restarted) after this long
+JOB_LEASE_SECONDS = 120
+# First retry delay; doubles on every further attempt
+JOB_RETRY_SECONDS = 10
+
+# kind -> handler(job, payload, progress) returning a JSON-serialisable result
+_handlers: Dict[str, Callable] = {}
+_wakeup = threading.Event()
+
+
+class JobProgress:
+    """Callable handed to handlers to report progress: progress('thumbnail', 0.5)."""
+
+    def __init__(self, job_id: int):
+        self.job_id = job_id
+
+    def __call__(self, stage: str, fraction: Optional[float] = None) -> None:
+        values = {'stage': stage, 'locked_at': datetime.utcnow()}
+        if fraction is not None:
+            values['progress'] = max(0.0, min(1.0, fraction))
+        try:
+            Job.query.filter_by(id=self.job_id).update(values)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error updating progress for job {self.job_id}: {str(e)}")
+
+
+def job_handler(kind: str):
+    """Register the decorated function as the handler for jobs of this kind"""
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind: str, payload: Optional[Dict[str, Any]] = None, max_attempts: int = 3, units: int = 1) -> Job:
+    """Add a job to the session. The caller commits; workers are woken afterwards.
+    units is the number of files the job covers, used for admission control."""
+    job = Job(kind=kind, payload=json.dumps(payload or {}), status='queued',
+              max_attempts=max_attempts, units=units, run_after=datetime.utcnow())
+    db.session.add(job)
+    _wakeup.set()
+    return job
+
+
+def job_to_dict(job: Job) -> Dict[str, Any]:
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "stage": job.stage,
+        "progress": job.progress or 0.0,
+        "units": job.units,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "error": job.error,
+        "result": json.loads(job.result) if job.result else None,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+    }
+
+
+def requeue_stale_jobs() -> int:
+    """Return jobs whose worker stopped heartbeating to the queue (or fail them
+    if they are out of attempts). Returns the number of jobs touched."""
+    cutoff = datetime.utcnow() - timedelta(seconds=JOB_LEASE_SECONDS)
+    stale = Job.query.filter(Job.status == 'running', Job.locked_at < cutoff).all()
+    for job in stale:
+        job.locked_by = None
+        if job.attempts >= job.max_attempts:
+            job.status = 'failed'
+            job.error = job.error or 'Worker stopped while running the job'
+        else:
+            job.status = 'queued'
+            job.run_after = datetime.utcnow()
+    if stale:
+        db.session.commit()
+    return len(stale)
+
+
+def claim_next_job(worker_id: str) -> Optional[Job]:
+    """Atomically move the oldest runnable job to 'running' for this worker"""
+    while True:
+        candidate = (db.session.query(Job.id)
+                     .filter(Job.status == 'queued', Job.run_after <= datetime.utcnow())
+                     .order_by(Job.id)
+                     .first())
+        if candidate is None:
+            return None
+        now = datetime.utcnow()
+        # The status check in the WHERE clause makes the claim safe across threads and processes
+        claimed = (Job.query
+                   .filter(Job.id == candidate.id, Job.status == 'queued')
+                   .update({'status': 'running', 'locked_by': worker_id, 'locked_at': now,
+                            'attempts': Job.attempts + 1, 'error': None},
+                           synchronize_session=False))
+        db.session.commit()
+        if claimed:
+            return db.session.get(Job, candidate.id)
+
+
+def run_job(job: Job) -> None:
+    """Run one claimed job and record its outcome. The outcome is only
+    recorded while the job is still leased to the worker that claimed it."""
+    job_id, worker_id = job.id, job.locked_by
+    handler = _handlers.get(job.kind)
+    try:
+        if handler is None:
+            raise RuntimeError(f"No handler registered for job kind '{job.kind}'")
+        result = handler(job, json.loads(job.payload or '{}'), JobProgress(job_id))
+        values = {'status': 'done', 'progress': 1.0, 'stage': 'done', 'locked_by': None,
+                  'result': json.dumps(result) if result is not None else None}
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error running job {job_id} ({job.kind}): {str(e)}")
+        traceback.print_exc()
+        job = db.session.get(Job, job_id)
+        values = {'error': str(e), 'locked_by': None}
+        if job.attempts >= job.max_attempts:
+            values['status'] = 'failed'
+        else:
+            values['status'] = 'queued'
+            values['run_after'] = datetime.utcnow() + timedelta(seconds=JOB_RETRY_SECONDS * 2 ** (job.attempts - 1))
+    recorded = (Job.query
+                .filter(Job.id == job_id, Job.status == 'running', Job.locked_by == worker_id)
+                .update(values, synchronize_session=False))
+    db.session.commit()
+    if not recorded:
+        print(f"Job {job_id} lost its lease while running; its outcome was not recorded")
+
+
+class JobWorkerPool:
+    """Worker threads plus a heartbeat thread that keeps running jobs leased."""
+
+    def __init__(self, app, workers: int = JOB_WORKERS):
+        self.app = app
+        self.workers = workers
+        self.worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self._running: Dict[str, int] = {}
+        self._running_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self) -> None:
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, args=(f"{self.worker_prefix}:{index}",),
+                                      name=f"job-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        heartbeat = threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True)
+        heartbeat.start()
+        self._threads.append(heartbeat)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        _wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _work(self, worker_id: str) -> None:
+        while not self._stop.is_set():
+            job_id = None
+            try:
+                with self.app.app_context():
+                    requeue_stale_jobs()
+                    job = claim_next_job(worker_id)
+                    if job is not None:
+                        job_id = job.id
+                        self.run(worker_id, job)
+            except Exception as e:
+                print(f"Job worker {worker_id} error: {str(e)}")
+            if job_id is None:
+                _wakeup.wait(JOB_POLL_SECONDS)
+                _wakeup.clear()
+
+    def run(self, worker_id: str, job: Job) -> None:
+        """Run a job claimed by worker_id, keeping it leased meanwhile"""
+        with self._running_lock:
+            self._running[worker_id] = job.id
+        try:
+            run_job(job)
+        finally:
+            with self._running_lock:
+                self._running.pop(worker_id, None)
+
+    def _heartbeat(self) -> None:
+        while not self._stop.wait(JOB_HEARTBEAT_SECONDS):
+            with self._running_lock:
+                running = dict(self._running)
+            if not running:
+                continue
+            try:
+                with self.app.app_context():
+                    # A job requeued and claimed elsewhere is no longer ours to extend
+                    Job.query.filter(Job.id.in_(running.values()), Job.locked_by.in_(running.keys()),
+                                     Job.status == 'running').update(
+                        {'locked_at': datetime.utcnow()}, synchronize_session=False)
+                    db.session.commit()
+            except Exception as e:
+                print(f"Job heartbeat error: {str(e)}")
+
+
+def run_jobs_until_idle(app, worker_id: Optional[str] = None) -> int:
+    """Drain the queue in the calling thread (CLI and scripts). A heartbeat
+    thread keeps the running job leased as in the pool. Returns jobs run."""
+    pool = JobWorkerPool(app, workers=0)
+    worker_id = worker_id or f"{pool.worker_prefix}:inline"
+    pool.start()
+    count = 0
+    try:
+        with app.app_context():
+            requeue_stale_jobs()
+            while True:
+                job = claim_next_job(worker_id)
+                if job is None:
+                    return count
+                pool.run(worker_id, job)
+                count += 1
+    finally:
+        pool.stop()
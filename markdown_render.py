@@ -0,0 +1,89 @@
+"""
+Markdown Render Module
+Renders user Markdown (bios, and anything passed to the |markdown template
+filter) with one reusable Markdown instance per thread instead of building a
+new parser per call, and keeps the HTML of recently rendered texts in a
+byte-bounded LRU keyed by a hash of the text, so an edited text is simply a
+new key and nothing needs invalidating.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict
+
+MARKDOWN_EXTENSIONS = ['nl2br', 'fenced_code']
+# Total size of rendered HTML kept in memory per process
+MARKDOWN_CACHE_MAX_BYTES = 8 * 1024 * 1024
+# Longer texts are rendered every time
+MARKDOWN_CACHE_MAX_ENTRY_BYTES = 64 * 1024
+
+# Markdown instances keep state between conversions and are not thread-safe
+_local = threading.local()
+
+
+def render_uncached(text: str) -> str:
+    """Render with this thread's Markdown instance, bypassing the cache"""
+    converter = getattr(_local, 'converter', None)
+    if converter is None:
+        import markdown
+        converter = _local.converter = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+    return converter.reset().convert(text)
+
+
+class MarkdownCache:
+    """Thread-safe LRU of rendered HTML keyed by the source text's digest."""
+
+    def __init__(self, max_bytes: int = MARKDOWN_CACHE_MAX_BYTES,
+                 max_entry_bytes: int = MARKDOWN_CACHE_MAX_ENTRY_BYTES):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._html: 'OrderedDict[bytes, str]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, text: str) -> str:
+        if not text:
+            return ''
+        key = hashlib.sha1(text.encode('utf-8')).digest()
+        with self._lock:
+            html = self._html.get(key)
+            if html is not None:
+                self._html.move_to_end(key)
+                self.hits += 1
+                return html
+            self.misses += 1
+        html = render_uncached(text)
+        if len(html) <= self.max_entry_bytes:
+            with self._lock:
+                if key not in self._html:
+                    self._html[key] = html
+                    self._bytes += len(html)
+                    while self._bytes > self.max_bytes:
+                        _, evicted = self._html.popitem(last=False)
+                        self._bytes -= len(evicted)
+        return html
+
+    def clear(self) -> None:
+        with self._lock:
+            self._html.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'entries': len(self._html),
+                'cached_bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+markdown_cache = MarkdownCache()
+
+
+def render_markdown(text: str) -> str:
+    """HTML for a Markdown text, from the cache when it was rendered before"""
+    return markdown_cache.render(text)
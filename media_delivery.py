@@ -0,0 +1,78 @@
+"""
+Media Delivery Module
+Lets a front proxy send media bytes instead of a Python worker. In an offload
+mode the streaming routes still look the file up (and answer 404s, 304s
+etc.) but return an empty response with a header telling the proxy which
+file to send; the proxy then does the zero-copy transfer, Range requests
+included.
+
+MEDIA_DELIVERY (env EASYCORE_MEDIA_DELIVERY):
+- 'direct'      Python serves the bytes (default, no proxy needed)
+- 'x-accel'     nginx X-Accel-Redirect to MEDIA_ACCEL_PREFIX + the path
+                relative to the app folder, e.g. /_media/uploads/3f/a2/<id>.mp4
+- 'x-sendfile'  X-Sendfile with the absolute path (Apache mod_xsendfile,
+                lighttpd)
+
+nginx needs an internal location aliasing the app folder:
+
+    location /_media/ {
+        internal;
+        alias /path/to/easycore/;
+    }
+
+Files outside the app folder cannot be mapped for nginx and are served
+directly.
+"""
+
+import os
+from typing import Optional
+from urllib.parse import quote
+
+from flask import Response, current_app
+
+DELIVERY_MODES = ('direct', 'x-accel', 'x-sendfile')
+DEFAULT_ACCEL_PREFIX = '/_media'
+
+
+def delivery_mode(value: Optional[str]) -> str:
+    """
+    Validated MEDIA_DELIVERY setting; unset means 'direct'.
+
+    Raises:
+        ValueError: The value is not one of DELIVERY_MODES, so a typo fails
+            at startup instead of quietly serving media from Python
+    """
+    mode = (value or 'direct').strip().lower()
+    if mode not in DELIVERY_MODES:
+        raise ValueError(f"Unknown media delivery mode {value!r}; expected one of {', '.join(DELIVERY_MODES)}")
+    return mode
+
+
+def offload_response(path: str, mime_type: str) -> Optional[Response]:
+    """
+    Response handing the file to the front proxy, or None when the app
+    should serve it itself (direct mode, or a path the proxy cannot reach).
+
+    Args:
+        path: Absolute path of the file to send
+        mime_type: Content-Type of the file; the proxy passes it through
+    """
+    mode = current_app.config.get('MEDIA_DELIVERY', 'direct')
+    if mode == 'x-sendfile':
+        header, value = 'X-Sendfile', os.path.abspath(path)
+    elif mode == 'x-accel':
+        root = os.path.abspath(current_app.root_path)
+        abs_path = os.path.abspath(path)
+        if not abs_path.startswith(root + os.sep):
+            return None
+        prefix = current_app.config.get('MEDIA_ACCEL_PREFIX', DEFAULT_ACCEL_PREFIX).rstrip('/')
+        rel_path = os.path.relpath(abs_path, root).replace(os.sep, '/')
+        header, value = 'X-Accel-Redirect', f"{prefix}/{quote(rel_path)}"
+    else:
+        return None
+
+    resp = Response(status=200, mimetype=mime_type)
+    resp.headers.set(header, value)
+    # The proxy answers Range requests itself
+    resp.headers.set('Accept-Ranges', 'bytes')
+    return resp
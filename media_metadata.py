@@ -0,0 +1,130 @@
+"""
+Media Metadata Module
+Turns one ffmpeg.probe result into the columns stored on Video and Track
+(duration, dimensions, codecs, bitrate, size, rotation), so pages, trimming
+and thumbnailing never have to probe a file again just to read them.
+"""
+
+import os
+from typing import Any, Dict, Optional
+
+import ffmpeg
+
+from thumbnails import get_duration
+
+# Columns filled from a probe, shared by Video and Track
+METADATA_FIELDS = ('duration', 'width', 'height', 'video_codec', 'audio_codec',
+                   'bitrate', 'file_size', 'rotation')
+
+
+def first_stream(probe: Dict[str, Any], codec_type: str) -> Optional[Dict[str, Any]]:
+    """First stream of codec_type ('video'/'audio') that is not embedded cover art"""
+    for stream in probe.get('streams', []):
+        if stream.get('codec_type') == codec_type and stream.get('disposition', {}).get('attached_pic') != 1:
+            return stream
+    return None
+
+
+def _int_or_none(value: Any) -> Optional[int]:
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _rotation(stream: Dict[str, Any]) -> int:
+    """Clockwise display rotation in degrees (0, 90, 180 or 270)"""
+    rotate = stream.get('tags', {}).get('rotate')
+    if rotate is None:
+        # Newer ffprobe reports a counter-clockwise display matrix angle instead
+        for side_data in stream.get('side_data_list', []):
+            if 'rotation' in side_data:
+                rotate = -float(side_data['rotation'])
+                break
+    return (_int_or_none(rotate) or 0) % 360
+
+
+def extract_metadata(probe: Dict[str, Any], path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Read the stored metadata columns from an ffmpeg.probe result.
+
+    Args:
+        probe: ffmpeg.probe result for the file
+        path: The probed file, used for the size if the probe lacks it
+
+    Returns:
+        Dict keyed by METADATA_FIELDS; unknown values are None
+    """
+    fmt = probe.get('format', {})
+    video = first_stream(probe, 'video')
+    audio = first_stream(probe, 'audio')
+
+    width = _int_or_none(video.get('width')) if video else None
+    height = _int_or_none(video.get('height')) if video else None
+    rotation = _rotation(video) if video else 0
+    if rotation in (90, 270) and width and height:
+        # Store the dimensions the viewer sees
+        width, height = height, width
+
+    file_size = _int_or_none(fmt.get('size'))
+    if file_size is None and path and os.path.exists(path):
+        file_size = os.path.getsize(path)
+
+    duration = get_duration(probe)
+    return {
+        'duration': duration or None,
+        'width': width,
+        'height': height,
+        'video_codec': video.get('codec_name') if video else None,
+        'audio_codec': audio.get('codec_name') if audio else None,
+        'bitrate': _int_or_none(fmt.get('bit_rate')),
+        'file_size': file_size,
+        'rotation': rotation,
+    }
+
+
+def probe_metadata(path: str) -> Dict[str, Any]:
+    """Probe a file and return its metadata columns. Safe to run in a worker process."""
+    return extract_metadata(ffmpeg.probe(path), path)
+
+
+def safe_probe_metadata(path: str) -> Dict[str, Any]:
+    """probe_metadata that logs and returns {} on failure, for optional metadata"""
+    try:
+        return probe_metadata(path)
+    except ffmpeg.Error as e:
+        print(f"Error probing {path}: {e.stderr.decode() if e.stderr else str(e)}")
+    except Exception as e:
+        print(f"Error probing {path}: {str(e)}")
+    return {}
+
+
+def apply_metadata(row, metadata: Dict[str, Any]) -> None:
+    """Copy metadata columns onto a Video or Track row"""
+    for field in METADATA_FIELDS:
+        if field in metadata:
+            setattr(row, field, metadata[field])
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    """Seconds as m:ss or h:mm:ss; empty when unknown"""
+    if not seconds:
+        return ''
+    total = int(round(seconds))
+    hours, remainder = divmod(total, 3600)
+    minutes, secs = divmod(remainder, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{secs:02d}"
+    return f"{minutes}:{secs:02d}"
+
+
+def format_file_size(size: Optional[int]) -> str:
+    """Bytes as a short human-readable size; empty when unknown"""
+    if not size:
+        return ''
+    value = float(size)
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if value < 1024 or unit == 'GB':
+            return f"{value:.0f} {unit}" if unit == 'B' else f"{value:.1f} {unit}"
+        value /= 1024
+    return ''
@@ -1,4 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect
 from datetime import datetime
 
 db = SQLAlchemy()
@@ -13,6 +14,17 @@ class Video(db.Model):
     thumbnail_path = db.Column(db.String(255))
     view_count = db.Column(db.Integer, default=0)
     likes = db.Column(db.Integer, default=0)
+    content_hash = db.Column(db.String(64), index=True)  # SHA-256 of the file as uploaded
+    # Filled from a single probe at ingest (see media_metadata.py)
+    duration = db.Column(db.Float)  # Seconds
+    width = db.Column(db.Integer)  # As displayed, i.e. after rotation
+    height = db.Column(db.Integer)
+    video_codec = db.Column(db.String(32))
+    audio_codec = db.Column(db.String(32))
+    bitrate = db.Column(db.Integer)  # Bits per second, whole file
+    file_size = db.Column(db.BigInteger)  # Bytes
+    rotation = db.Column(db.Integer, default=0)  # Degrees clockwise
+    transcode_plan = db.Column(db.Text)  # JSON decision made at ingest (see transcode.py)
     playlists = db.relationship('Playlist', secondary='playlist_video',
                                backref=db.backref('videos', lazy='dynamic'))
     artists = db.relationship('Artist', secondary='video_artist', back_populates='videos')
@@ -74,6 +86,16 @@ class Track(db.Model):
     background_image_path = db.Column(db.String(255))
     view_count = db.Column(db.Integer, default=0)
     likes = db.Column(db.Integer, default=0)
+    content_hash = db.Column(db.String(64), index=True)  # SHA-256 of the file as uploaded
+    # Filled from a single probe at ingest (see media_metadata.py)
+    duration = db.Column(db.Float)  # Seconds
+    width = db.Column(db.Integer)  # As displayed, i.e. after rotation
+    height = db.Column(db.Integer)
+    video_codec = db.Column(db.String(32))
+    audio_codec = db.Column(db.String(32))
+    bitrate = db.Column(db.Integer)  # Bits per second, whole file
+    file_size = db.Column(db.BigInteger)  # Bytes
+    rotation = db.Column(db.Integer, default=0)  # Degrees clockwise
     artists = db.relationship('Artist', secondary='track_artist', back_populates='tracks')
 
 
@@ -127,4 +149,65 @@ class AuthorProfile(db.Model):
     display_name = db.Column(db.String(150), nullable=True)
     avatar_path = db.Column(db.String(255), nullable=True)
     bio = db.Column(db.Text, nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
\ No newline at end of file
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class UploadSession(db.Model):
+    """State of a resumable chunked upload (see routes/upload_routes.py)."""
+    id = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # 'video' or 'track'
+    original_filename = db.Column(db.String(255), nullable=False)
+    # Final storage path; bytes are written to stored_filepath + '.part' until finalize
+    stored_filepath = db.Column(db.String(255), nullable=False)
+    total_size = db.Column(db.BigInteger, nullable=False)
+    offset = db.Column(db.BigInteger, nullable=False, default=0)
+    fields = db.Column(db.Text)  # JSON-encoded form fields sent at creation
+    content_hash = db.Column(db.String(64))  # SHA-256, set once every byte has arrived
+    status = db.Column(db.String(20), nullable=False, default='uploading')  # uploading, finalizing, complete
+    result_id = db.Column(db.Integer)  # Video/Track id after finalize
+    job_id = db.Column(db.Integer)  # Background ingest job started by finalize
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+
+class Job(db.Model):
+    """A unit of background work (see jobs.py); the table is the queue."""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)  # handler name, e.g. 'ingest_video'
+    payload = db.Column(db.Text)  # JSON arguments for the handler
+    units = db.Column(db.Integer, nullable=False, default=1)  # Files covered, for admission control
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)  # queued, running, done, failed
+    stage = db.Column(db.String(50))  # Human-readable step, e.g. 'thumbnail'
+    progress = db.Column(db.Float, default=0.0)  # 0..1
+    result = db.Column(db.Text)  # JSON returned by the handler
+    error = db.Column(db.Text)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_after = db.Column(db.DateTime, default=datetime.utcnow)  # Delays retries
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)  # Refreshed by the worker while the job runs
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class CacheVersion(db.Model):
+    """Write counter per page-cache scope, shared by all workers (see page_cache.py)."""
+    __tablename__ = 'cache_version'
+    scope = db.Column(db.String(150), primary_key=True)  # e.g. 'feed', 'tag:rock'
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+def ensure_schema():
+    """create_all() only creates missing tables; add columns and indexes that
+    were added to existing models since the database was created."""
+    db.create_all()
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=db.engine.dialect)
+                    conn.exec_driver_sql(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}')
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
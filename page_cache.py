@@ -0,0 +1,240 @@
+"""
+Page Cache Module
+Keeps rendered HTML of the browse pages (library feed, tracks, artists, tag
+pages, playlists) so repeat visits skip the queries and the Jinja render.
+
+Every entry depends on a few named scopes ('feed', 'tracks', 'tag:rock'...).
+Writes bump the version of the scopes they touch in the cache_version table,
+inside the same transaction as the write; an entry is only served while the
+versions it was rendered at are still current. Because the counters live in
+the database, a write made by any worker (web process, job runner, CLI)
+invalidates the pages cached by all of them, and a rolled back write
+invalidates nothing.
+
+Scopes are derived from ORM flushes (see MODEL_SCOPES): a new video bumps the
+feed and the pages of its tags, a tag description edit only that tag's
+pages, and so on. Bulk query updates/deletes bump the model's scopes and
+'tags' (every tag page), since the affected rows are not known.
+
+Likes and view counts change far more often than anything else and are not
+treated as writes here; pages show them up to PAGE_CACHE_TTL_SECONDS old.
+Tag pages match content tags as substrings, so a page like 'rock' showing a
+'punkrock' video may also lag by up to the TTL.
+"""
+
+import functools
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from flask import request
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import Session
+
+from models import db, CacheVersion
+
+# Total size of rendered pages kept in memory per process (characters)
+PAGE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+# Pages bigger than this are rendered every time
+PAGE_CACHE_MAX_ENTRY_BYTES = 1024 * 1024
+# Upper bound on the age of a cached page (counters are not invalidated)
+PAGE_CACHE_TTL_SECONDS = 30
+# Columns whose changes alone do not invalidate pages
+COUNTER_COLUMNS = frozenset({'view_count', 'likes'})
+# Scopes a write to each model can change; tag scopes are added per tag
+MODEL_SCOPES: Dict[str, Tuple[str, ...]] = {
+    'Video': ('feed', 'artists', 'playlists'),
+    'Track': ('feed', 'tracks', 'artists'),
+    'Artist': ('feed', 'tracks', 'artists'),
+    'TrackArtist': ('feed', 'tracks', 'artists'),
+    'VideoArtist': ('artists',),
+    'Playlist': ('playlists',),
+    'PlaylistVideo': ('playlists',),
+    'TagDescription': (),
+    'TagComment': (),
+}
+TAGGED_MODELS = ('Video', 'Track')
+
+_BUMP_SQL = text('INSERT INTO cache_version (scope, version) VALUES (:scope, 1) '
+                 'ON CONFLICT(scope) DO UPDATE SET version = version + 1')
+
+
+class PageEntry(NamedTuple):
+    body: str
+    versions: Tuple[Tuple[str, int], ...]
+    stored_at: float
+
+
+def tag_scope(tag: str) -> str:
+    return f"tag:{tag.strip().lower()}"
+
+
+def _split_tags(tags: Optional[str]) -> List[str]:
+    return [tag_scope(t) for t in (tags or '').split(',') if t.strip()]
+
+
+def current_versions(scopes: Iterable[str]) -> Tuple[Tuple[str, int], ...]:
+    """(scope, version) pairs, sorted; scopes never written are at version 0"""
+    scopes = sorted(set(scopes))
+    rows = dict(db.session.query(CacheVersion.scope, CacheVersion.version)
+                .filter(CacheVersion.scope.in_(scopes)).all())
+    return tuple((scope, rows.get(scope, 0)) for scope in scopes)
+
+
+class PageCache:
+    """Thread-safe, size-bounded LRU of rendered pages and fragments."""
+
+    def __init__(self, max_bytes: int = PAGE_CACHE_MAX_BYTES, max_entry_bytes: int = PAGE_CACHE_MAX_ENTRY_BYTES,
+                 ttl: float = PAGE_CACHE_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self._entries: 'OrderedDict[object, PageEntry]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def get_or_render(self, key, scopes: Iterable[str], render: Callable[[], object]):
+        """
+        Cached HTML for key, or render() it and cache the result.
+
+        Args:
+            key: Anything hashable identifying the page or fragment
+            scopes: Scopes the content depends on
+            render: Builds the content; anything but a str (a redirect, a
+                response object) is returned without being cached
+
+        Returns:
+            The cached or freshly rendered content
+        """
+        # Read before rendering: a write landing mid-render leaves the entry
+        # at the old versions, so it is re-rendered on the next request
+        versions = current_versions(scopes)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.versions == versions and time.monotonic() - entry.stored_at < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry.body
+                self.stale += 1
+                self._drop(key)
+            self.misses += 1
+
+        body = render()
+        if isinstance(body, str) and len(body) <= self.max_entry_bytes:
+            with self._lock:
+                if key in self._entries:
+                    self._drop(key)
+                self._entries[key] = PageEntry(body, versions, time.monotonic())
+                self._bytes += len(body)
+                while self._bytes > self.max_bytes:
+                    self._drop(next(iter(self._entries)))
+        return body
+
+    def _drop(self, key) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry.body)
+
+    def cached(self, *scopes: str):
+        """
+        Cache a GET view's rendered page per endpoint, URL arguments and
+        query string (page, sort...).
+
+        Args:
+            scopes: Scopes the page depends on; may use the view's URL
+                arguments, e.g. 'tag:{tag}'
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(**view_args):
+                if request.method != 'GET':
+                    return view(**view_args)
+                key = (request.endpoint, tuple(sorted(view_args.items())),
+                       tuple(sorted(request.args.items(multi=True))))
+                page_scopes = [scope.format(**view_args).lower() for scope in scopes]
+                return self.get_or_render(key, page_scopes, lambda: view(**view_args))
+            return wrapper
+        return decorator
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'pages': len(self._entries),
+                'cached_bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+def invalidate(session, scopes: Iterable[str]) -> None:
+    """Bump scopes as part of the session's current transaction"""
+    scopes = sorted(set(scopes))
+    if scopes:
+        session.connection().execute(_BUMP_SQL, [{'scope': scope} for scope in scopes])
+
+
+def _changed_keys(obj) -> Set[str]:
+    return {attr.key for attr in inspect(obj).attrs if attr.history.has_changes()}
+
+
+def _written_scopes(session) -> Set[str]:
+    scopes: Set[str] = set()
+    for obj in list(session.new) + list(session.deleted):
+        name = type(obj).__name__
+        if name in MODEL_SCOPES:
+            scopes.update(MODEL_SCOPES[name])
+            if name in TAGGED_MODELS:
+                scopes.update(_split_tags(obj.tags))
+            elif hasattr(obj, 'tag_name'):
+                scopes.add(tag_scope(obj.tag_name))
+    for obj in session.dirty:
+        name = type(obj).__name__
+        if name not in MODEL_SCOPES:
+            continue
+        changed = _changed_keys(obj)
+        if not changed - COUNTER_COLUMNS:
+            continue
+        scopes.update(MODEL_SCOPES[name])
+        if name in TAGGED_MODELS:
+            scopes.update(_split_tags(obj.tags))
+            if 'tags' in changed:
+                for old_tags in inspect(obj).attrs.tags.history.deleted:
+                    scopes.update(_split_tags(old_tags))
+        elif hasattr(obj, 'tag_name'):
+            scopes.add(tag_scope(obj.tag_name))
+    return scopes
+
+
+def _after_flush(session, flush_context) -> None:
+    invalidate(session, _written_scopes(session))
+
+
+def _after_bulk(orm_execute_state) -> None:
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    name = mapper.class_.__name__ if mapper is not None else None
+    if name in MODEL_SCOPES:
+        scopes = set(MODEL_SCOPES[name])
+        if name in TAGGED_MODELS or name in ('TagDescription', 'TagComment'):
+            scopes.add('tags')
+        invalidate(orm_execute_state.session, scopes)
+
+
+def install_invalidation() -> None:
+    """Bump scopes on every ORM write; call once at startup"""
+    if not event.contains(Session, 'after_flush', _after_flush):
+        event.listen(Session, 'after_flush', _after_flush)
+        event.listen(Session, 'do_orm_execute', _after_bulk)
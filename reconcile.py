@@ -0,0 +1,357 @@
+"""
+Storage Reconciler Module
+Compares what is on disk with what the database points at, in one pass:
+
+- every storage root (upload, stealth, audio folders and the static image
+  folders) is walked once with os.scandir into a set of paths
+- every path column is read with one query per column, limited to the rows
+  whose files live under those roots
+- the two are diffed as sets, so no file is stat'ed per row
+
+Rows whose file is gone are "missing"; files no row, storyboard, derivative,
+upload session or pending ingest job accounts for are "orphans". That covers
+leftovers such as abandoned .part files, *_trimmed.mp4 and
+*.transcoding.mp4 outputs, temp_trim_* folders and temp_* files from
+interrupted extractions. Both can be fixed: missing videos, tracks and upload
+sessions are deleted (as cleanup_stealth always did for stealth videos),
+missing images are unset, and orphans are removed.
+
+Fixing deletes rows, so a storage view that looks wrong stops the run
+instead: a root that does not exist while rows point into it (an unmounted
+share, a renamed folder) raises StorageRootMissing, and a fix that would
+delete more than MAX_MISSING_SHARE of the checked rows raises
+TooManyMissing unless forced.
+"""
+
+import json
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import false, or_
+
+from image_derivatives import DERIVED_DIRNAME, DERIVATIVE_FORMATS, DERIVATIVE_WIDTHS
+from models import db, Video, Track, Artist, AuthorProfile, UploadSession, Job
+from storage import get_storage
+from storyboard import STORYBOARD_DIRNAME, remove_storyboard, storyboard_rel_dir
+
+# Static subfolders written by the app (css/js are shipped, not reconciled)
+STATIC_ROOTS = ('thumbnails', 'covers', 'avatars', DERIVED_DIRNAME, STORYBOARD_DIRNAME)
+# Upload folder config keys
+UPLOAD_ROOT_KEYS = ('UPLOAD_FOLDER', 'STEALTH_UPLOAD_FOLDER', 'AUDIO_UPLOAD_FOLDER', 'STEALTH_AUDIO_UPLOAD_FOLDER')
+# Files younger than this may belong to an upload or job that has not written its row yet
+ORPHAN_MIN_AGE_SECONDS = 24 * 3600
+# (model, column) pairs holding static-relative image paths
+IMAGE_COLUMNS = (
+    (Video, 'thumbnail_path'),
+    (Track, 'background_image_path'),
+    (Artist, 'avatar_path'),
+    (AuthorProfile, 'avatar_path'),
+)
+# Jobs whose payload names files that have no row yet
+INGEST_JOB_KINDS = ('ingest_video', 'ingest_video_batch')
+# A fix that would delete more than this share of the checked rows needs force
+MAX_MISSING_SHARE = 0.2
+
+
+class ReconcileError(RuntimeError):
+    """The storage view cannot be trusted; nothing was changed"""
+
+
+class StorageRootMissing(ReconcileError):
+    """A storage root does not exist but rows point into it"""
+
+
+class TooManyMissing(ReconcileError):
+    """A fix would delete more than MAX_MISSING_SHARE of the checked rows"""
+
+
+def _norm(path: str) -> str:
+    return os.path.normpath(os.path.abspath(path))
+
+
+def storage_roots(config: Dict[str, Any], static_folder: str) -> List[str]:
+    """Absolute paths of every folder the app writes media to"""
+    roots = [config[key] for key in UPLOAD_ROOT_KEYS if config.get(key)]
+    roots += [os.path.join(static_folder, name) for name in STATIC_ROOTS]
+    return [_norm(root) for root in roots]
+
+
+def scan_files(root: str) -> Set[str]:
+    """
+    Every file below root, walked once with os.scandir (no per-file stat).
+
+    Raises:
+        FileNotFoundError: root itself does not exist (folders removed below
+            it during the walk are skipped)
+    """
+    files: Set[str] = set()
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    else:
+                        files.add(entry.path)
+        except FileNotFoundError:
+            if folder == root:
+                raise
+    return files
+
+
+def _under(path: str, roots: Iterable[str]) -> bool:
+    return any(path == root or path.startswith(root + os.sep) for root in roots)
+
+
+def _path_filter(column, roots: List[str]):
+    """SQL filter for an absolute path column: the rows under roots. LIKE may
+    match more loosely than _under (case), never less, so callers re-check."""
+    return or_(*[column.startswith(root + os.sep, autoescape=True) for root in roots])
+
+
+def _static_path_filter(column, roots: List[str], static_folder: str):
+    """SQL filter for a static-relative path column: the rows under roots"""
+    if _under(static_folder, roots):
+        return None
+    prefixes = [os.path.relpath(root, static_folder).replace(os.sep, '/') + '/'
+                for root in roots if _under(root, [static_folder])]
+    if not prefixes:
+        return false()
+    return or_(*[column.startswith(prefix, autoescape=True) for prefix in prefixes])
+
+
+def _pending_ingest_paths() -> Set[str]:
+    """Files named by queued or running ingest jobs, and the MP4s they will produce"""
+    paths: Set[str] = set()
+    jobs = (db.session.query(Job.payload)
+            .filter(Job.kind.in_(INGEST_JOB_KINDS), Job.status.in_(('queued', 'running'))))
+    for (payload,) in jobs:
+        payload = json.loads(payload or '{}')
+        for item in payload.get('items', [payload]):
+            if item.get('stored_filepath'):
+                path = _norm(item['stored_filepath'])
+                paths.update((path, os.path.splitext(path)[0] + '.mp4'))
+    return paths
+
+
+def _is_derivative_of(rel_path: str, image_bases: Set[str]) -> bool:
+    """derived/covers/x_320.webp belongs to covers/x.* if that image is referenced"""
+    stem, ext = os.path.splitext(rel_path[len(DERIVED_DIRNAME) + 1:])
+    base, _, width = stem.rpartition('_')
+    return (ext[1:] in DERIVATIVE_FORMATS and width.isdigit() and int(width) in DERIVATIVE_WIDTHS
+            and base in image_bases)
+
+
+def reconcile(config: Dict[str, Any], static_folder: str, roots: Optional[List[str]] = None,
+              fix: bool = False, remove_orphans: bool = True,
+              min_age: float = ORPHAN_MIN_AGE_SECONDS, force: bool = False) -> Dict[str, Any]:
+    """
+    Diff storage against the database and optionally fix what differs.
+
+    Args:
+        config: App config holding the upload folder paths
+        static_folder: Absolute path of the app's static folder
+        roots: Folders to reconcile (default: storage_roots()); only rows
+            whose files live under them are checked
+        fix: Delete/unset rows with missing files and (with remove_orphans)
+            remove orphan files; otherwise only report
+        remove_orphans: Whether fix also removes orphans
+        min_age: Orphans modified more recently than this many seconds ago
+            are reported as recent and never removed
+        force: Fix even when more than MAX_MISSING_SHARE of the checked
+            rows are missing
+
+    Returns:
+        Report dict: scanned_files, checked_rows, missing (list of {kind, id,
+        path}), orphans, orphan_bytes, recent_orphans, deleted_video_ids,
+        fixed_rows, removed_files and elapsed_seconds
+
+    Raises:
+        StorageRootMissing: A root does not exist and rows point into it
+        TooManyMissing: fix without force would delete more than
+            MAX_MISSING_SHARE of the checked rows
+    """
+    started = time.monotonic()
+    static_folder = _norm(static_folder)
+    roots = [_norm(root) for root in (roots or storage_roots(config, static_folder))]
+
+    on_disk: Set[str] = set()
+    absent_roots: List[str] = []
+    for root in roots:
+        try:
+            on_disk |= scan_files(root)
+        except FileNotFoundError:
+            absent_roots.append(root)
+    # Media published to object storage (one listing, not one request per row)
+    remote = get_storage().remote_paths()
+
+    def exists(path: str) -> bool:
+        return path in on_disk or path in remote
+
+    missing: List[Dict[str, Any]] = []
+    expected: Set[str] = set()
+    checked = 0
+
+    # Media files. Only rows under the roots are checked, except that every
+    # video's storyboard counts when the storyboard folder is reconciled.
+    storyboard_dirs: Set[str] = set()
+    all_storyboards = _under(_norm(os.path.join(static_folder, STORYBOARD_DIRNAME)), roots)
+    for model, kind in ((Video, 'video'), (Track, 'track')):
+        query = db.session.query(model.id, model.stored_filepath)
+        if not (kind == 'video' and all_storyboards):
+            query = query.filter(_path_filter(model.stored_filepath, roots))
+        for row_id, stored in query:
+            path = _norm(stored)
+            checked_row = _under(path, roots)
+            checked += checked_row
+            if checked_row and not exists(path):
+                missing.append({'kind': kind, 'id': row_id, 'path': path})
+                continue
+            expected.add(path)
+            if kind == 'video':
+                storyboard_dirs.add(_norm(os.path.join(static_folder, storyboard_rel_dir(path))))
+    missing_videos = {item['id'] for item in missing if item['kind'] == 'video'}
+
+    # Chunked uploads: the .part while uploading, the final file once complete
+    for session_id, stored, status in (db.session.query(UploadSession.id, UploadSession.stored_filepath,
+                                                        UploadSession.status)
+                                       .filter(_path_filter(UploadSession.stored_filepath, roots))):
+        path = _norm(stored)
+        if not _under(path, roots):
+            continue
+        if status == 'uploading':
+            checked += 1
+            if exists(path + '.part'):
+                expected.add(path + '.part')
+            else:
+                missing.append({'kind': 'upload_session', 'id': session_id, 'path': path + '.part'})
+        else:
+            expected.add(path)
+    expected |= _pending_ingest_paths()
+
+    # Images, with their derivatives
+    image_bases: Set[str] = set()
+    for model, column_name in IMAGE_COLUMNS:
+        column = getattr(model, column_name)
+        query = db.session.query(model.id, column).filter(column.isnot(None), column != '')
+        in_roots = _static_path_filter(column, roots, static_folder)
+        if in_roots is not None:
+            query = query.filter(in_roots)
+        for row_id, rel_path in query:
+            if model is Video and row_id in missing_videos:
+                continue
+            path = _norm(os.path.join(static_folder, rel_path))
+            if not _under(path, roots):
+                continue
+            checked += 1
+            if exists(path):
+                expected.add(path)
+                image_bases.add(os.path.splitext(rel_path.replace('\\', '/'))[0])
+            else:
+                missing.append({'kind': f"{model.__tablename__}.{column_name}", 'id': row_id, 'path': path})
+
+    stranded = [root for root in absent_roots if any(_under(item['path'], [root]) for item in missing)]
+    if stranded:
+        raise StorageRootMissing(f"{', '.join(stranded)} does not exist but rows point into it; "
+                                 f"is the storage mounted? Nothing was changed.")
+    if fix and not force and len(missing) > checked * MAX_MISSING_SHARE:
+        raise TooManyMissing(f"{len(missing)} of {checked} checked rows have no file, over the "
+                             f"{MAX_MISSING_SHARE:.0%} limit for fixing; nothing was changed.")
+
+    orphans: List[str] = []
+    recent: List[str] = []
+    orphan_bytes = 0
+    now = time.time()
+    storyboard_root = os.path.join(static_folder, STORYBOARD_DIRNAME) + os.sep
+    derived_root = os.path.join(static_folder, DERIVED_DIRNAME) + os.sep
+    for path in sorted(on_disk - expected):
+        if path.startswith(storyboard_root):
+            if os.path.dirname(path) in storyboard_dirs:
+                continue
+        elif path.startswith(derived_root):
+            if _is_derivative_of(os.path.relpath(path, static_folder).replace(os.sep, '/'), image_bases):
+                continue
+        try:
+            stat = os.lstat(path)
+        except FileNotFoundError:
+            continue
+        if now - stat.st_mtime < min_age:
+            recent.append(path)
+        else:
+            orphans.append(path)
+            orphan_bytes += stat.st_size
+
+    report: Dict[str, Any] = {'scanned_files': len(on_disk), 'checked_rows': checked, 'missing': missing, 'orphans': orphans,
+                              'orphan_bytes': orphan_bytes, 'recent_orphans': recent, 'deleted_video_ids': [], 'fixed_rows': 0,
+                              'removed_files': 0}
+    if fix:
+        _fix_missing(missing, static_folder, report)
+        if remove_orphans:
+            _remove_orphans(orphans, roots, report)
+    report['elapsed_seconds'] = round(time.monotonic() - started, 2)
+    return report
+
+
+def _fix_missing(missing: List[Dict[str, Any]], static_folder: str, report: Dict[str, Any]) -> None:
+    by_kind: Dict[str, List[Any]] = {}
+    for item in missing:
+        by_kind.setdefault(item['kind'], []).append(item['id'])
+
+    for video in Video.query.filter(Video.id.in_(by_kind.get('video', []))):
+        remove_storyboard(video.stored_filepath, static_folder)
+        if video.thumbnail_path:
+            thumbnail_path = os.path.join(static_folder, video.thumbnail_path)
+            if os.path.exists(thumbnail_path):
+                os.remove(thumbnail_path)
+        report['deleted_video_ids'].append(video.id)
+        db.session.delete(video)
+        report['fixed_rows'] += 1
+    for model, kind in ((Track, 'track'), (UploadSession, 'upload_session')):
+        for row in model.query.filter(model.id.in_(by_kind.get(kind, []))):
+            db.session.delete(row)
+            report['fixed_rows'] += 1
+    for model, column_name in IMAGE_COLUMNS:
+        ids = by_kind.get(f"{model.__tablename__}.{column_name}", [])
+        if ids:
+            report['fixed_rows'] += (model.query.filter(model.id.in_(ids))
+                                     .update({column_name: None}, synchronize_session=False))
+    db.session.commit()
+
+
+def _remove_orphans(orphans: List[str], roots: List[str], report: Dict[str, Any]) -> None:
+    parents: Set[str] = set()
+    for path in orphans:
+        try:
+            os.remove(path)
+            report['removed_files'] += 1
+            parents.add(os.path.dirname(path))
+        except FileNotFoundError:
+            # e.g. the thumbnail of a video row deleted just before
+            parents.add(os.path.dirname(path))
+        except OSError as e:
+            print(f"Error removing {path}: {str(e)}")
+
+    # Drop folders the removals emptied (storyboards, temp_trim_*), never a root
+    for folder in sorted(parents, key=len, reverse=True):
+        while folder not in roots and _under(folder, roots):
+            try:
+                os.rmdir(folder)
+            except OSError:
+                break
+            folder = os.path.dirname(folder)
+
+
+def format_report(report: Dict[str, Any], verbose: bool = False) -> List[str]:
+    """Summary lines (and with verbose, one line per finding) for the CLI"""
+    lines: List[str] = []
+    if verbose:
+        lines += [f"missing {item['kind']} {item['id']}: {item['path']}" for item in report['missing']]
+        lines += [f"orphan: {path}" for path in report['orphans']]
+        lines += [f"recent (kept): {path}" for path in report['recent_orphans']]
+    lines.append(f"Scanned {report['scanned_files']} files in {report['elapsed_seconds']}s: "
+                 f"{len(report['missing'])} of {report['checked_rows']} rows with missing files, {len(report['orphans'])} orphan files "
+                 f"({report['orphan_bytes'] / (1024 * 1024):.1f} MB), {len(report['recent_orphans'])} too recent to judge.")
+    return lines
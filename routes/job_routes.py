@@ -0,0 +1,44 @@
+from flask import request, jsonify
+from datetime import datetime
+
+from . import jobs_bp
+from models import db, Job
+from jobs import job_to_dict
+
+
+@jobs_bp.route('/<int:job_id>')
+def job_status(job_id):
+    job = Job.query.get_or_404(job_id)
+    resp = jsonify(job_to_dict(job))
+    resp.headers.set('Cache-Control', 'no-store')
+    return resp
+
+
+@jobs_bp.route('')
+def job_statuses():
+    """Status of several jobs at once: /jobs?ids=1,2,3"""
+    try:
+        job_ids = [int(job_id) for job_id in request.args.get('ids', '').split(',') if job_id.strip()]
+    except ValueError:
+        return jsonify({"error": "ids must be a comma-separated list of integers"}), 400
+    jobs = Job.query.filter(Job.id.in_(job_ids)).all() if job_ids else []
+    resp = jsonify({"jobs": [job_to_dict(job) for job in jobs]})
+    resp.headers.set('Cache-Control', 'no-store')
+    return resp
+
+
+@jobs_bp.route('/<int:job_id>/retry', methods=['POST'])
+def retry_job(job_id):
+    job = Job.query.get_or_404(job_id)
+    if job.status != 'failed':
+        return jsonify({"error": "Only failed jobs can be retried"}), 409
+    try:
+        job.status = 'queued'
+        job.attempts = 0
+        job.error = None
+        job.run_after = datetime.utcnow()
+        db.session.commit()
+        return jsonify(job_to_dict(job)), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
@@ -0,0 +1,567 @@
+"""
+Resumable chunked uploads (a small tus-like protocol).
+
+    POST   /uploads                     create: JSON {filename, size, kind?, fields?}
+    HEAD   /uploads/<id>                current offset in the Upload-Offset header
+    GET    /uploads/<id>                session status as JSON
+    PATCH  /uploads/<id>                append the request body at Upload-Offset
+    POST   /uploads/<id>/finalize       hand the file to the ingest pipeline
+    POST   /uploads/finalize            finalize several video uploads as one batch job
+    DELETE /uploads/<id>                abort and remove the partial file
+
+Chunks are streamed straight into <final path>.part inside the storage folder
+and hashed as they arrive, so memory use stays flat and finalize only renames.
+
+A PATCH holds an flock on the .part file while it checks the offset and
+appends, so two requests for one upload never write at once, whichever
+worker process they reach. The new offset is then claimed with a conditional
+UPDATE on the old one. Without fcntl (Windows) only that claim guards
+against concurrent chunks.
+
+Finalize claims the session the same way (status 'uploading' -> 'finalizing'),
+so of two concurrent finalizes only one moves the file; the other answers
+409 with Retry-After and a retry gets the finished result.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from flask import request, jsonify, current_app, make_response, url_for
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import InvalidRequestError
+from werkzeug.exceptions import ClientDisconnected
+
+from . import upload_bp
+from models import db, UploadSession
+from ingest import (generate_video_filename, generate_unique_filename, enqueue_video_ingest, enqueue_video_batch,
+                    ingest_track, save_track_cover, find_duplicate_video, find_duplicate_track, link_to_playlist,
+                    upload_folder_of, batch_video_nickname, allowed_files_message, VIDEO_EXTENSIONS,
+                    AUDIO_EXTENSIONS)
+import ingest_pool
+from storage import publish_media
+
+# Bytes read from the request stream per write
+STREAM_BUFFER_SIZE = 1024 * 1024
+# Chunk size suggested to clients
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Running hashes of uploads this process has not seen a chunk of for this
+# long are dropped (abandoned uploads); the next chunk re-reads the file
+HASHER_IDLE_SECONDS = 3600
+# A finalize still 'finalizing' after this long died part-way and may be taken over
+FINALIZE_LEASE_SECONDS = 300
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# upload id -> (offset, running sha256, last use) so each byte is hashed exactly once
+_hashers = {}
+# Request threads add and drop entries concurrently
+_hashers_lock = threading.Lock()
+
+
+def _part_path(upload):
+    return upload.stored_filepath + '.part'
+
+
+def _lock_part(f):
+    """Take the upload's write lock (an flock on its open .part file) without
+    waiting; False if another request holds it"""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+
+def _remember_hasher(upload_id, offset, hasher):
+    now = time.monotonic()
+    with _hashers_lock:
+        for stale_id in [key for key, (_, _, used) in _hashers.items() if now - used > HASHER_IDLE_SECONDS]:
+            del _hashers[stale_id]
+        _hashers[upload_id] = (offset, hasher, now)
+
+
+def _forget_hasher(upload_id):
+    with _hashers_lock:
+        _hashers.pop(upload_id, None)
+
+
+def _resume_hasher(upload):
+    """Return a sha256 object covering the first `upload.offset` bytes.
+    After a restart (or on another worker) the partial file is re-read once.
+    The cached object is taken out of the registry, so only the request
+    appending the next chunk updates it."""
+    with _hashers_lock:
+        cached = _hashers.pop(upload.id, None)
+    if cached and cached[0] == upload.offset:
+        return cached[1]
+    hasher = hashlib.sha256()
+    remaining = upload.offset
+    with open(_part_path(upload), 'rb') as f:
+        while remaining > 0:
+            chunk = f.read(min(STREAM_BUFFER_SIZE, remaining))
+            if not chunk:
+                break
+            hasher.update(chunk)
+            remaining -= len(chunk)
+    return hasher
+
+
+def _offset_response(upload, status=204):
+    resp = make_response('', status)
+    resp.headers.set('Upload-Offset', str(upload.offset))
+    resp.headers.set('Upload-Length', str(upload.total_size))
+    resp.headers.set('Cache-Control', 'no-store')
+    return resp
+
+
+def _session_json(upload):
+    return {
+        "upload_id": upload.id,
+        "kind": upload.kind,
+        "filename": upload.original_filename,
+        "offset": upload.offset,
+        "size": upload.total_size,
+        "status": upload.status,
+        "content_hash": upload.content_hash,
+        "result_id": upload.result_id,
+        "chunk_size": UPLOAD_CHUNK_SIZE,
+    }
+
+
+def _finalized_response(upload):
+    if upload.job_id:
+        return jsonify({"success": True, "job_id": upload.job_id, "content_hash": upload.content_hash,
+                        "status_url": url_for('jobs.job_status', job_id=upload.job_id)}), 202
+    return jsonify({"success": True, f"{upload.kind}_id": upload.result_id, "content_hash": upload.content_hash}), 200
+
+
+def _video_item(upload, fields):
+    """Ingest arguments for a finished video upload and its form fields"""
+    nickname = fields.get('nickname')
+    tags = fields.get('tags')
+    position = int(fields.get('position') or 1)
+    if not nickname and 'playlist_name' in fields:
+        # Sent by the add-multiple form, named like its form route does
+        nickname = batch_video_nickname(fields['playlist_name'], fields.get('apply_to_videos') in (True, 'on', 'true', '1'),
+                                        tags, position)
+    elif not nickname and tags:
+        nickname = ' '.join(tag.strip() for tag in tags.split(','))
+    playlist_id = fields.get('playlist_id')
+    return {
+        "stored_filepath": upload.stored_filepath,
+        "original_filepath": upload.original_filename,
+        "nickname": nickname,
+        "description": fields.get('description'),
+        "tags": tags,
+        "playlist_id": int(playlist_id) if playlist_id else None,
+        "position": position,
+        "content_hash": upload.content_hash,
+    }
+
+
+def _reload(upload):
+    """Re-read an upload's row; False if it was deleted (aborted)"""
+    try:
+        db.session.refresh(upload)
+        return True
+    except InvalidRequestError:
+        return False
+
+
+def _claim_finalize(upload):
+    """Move a fully uploaded session to 'finalizing' for this request. The
+    status check in the WHERE clause lets only one finalize (in any process)
+    claim it, as claim_next_job does for jobs."""
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=FINALIZE_LEASE_SECONDS)
+    claimed = (UploadSession.query
+               .filter(UploadSession.id == upload.id, UploadSession.offset == UploadSession.total_size,
+                       or_(UploadSession.status == 'uploading',
+                           and_(UploadSession.status == 'finalizing', UploadSession.updated_at < stale)))
+               .update({'status': 'finalizing', 'updated_at': now}, synchronize_session=False))
+    db.session.commit()
+    return bool(claimed)
+
+
+def _release_finalize(upload_ids):
+    """Hand claimed sessions back after a failed finalize so it can be retried"""
+    try:
+        (UploadSession.query
+         .filter(UploadSession.id.in_(upload_ids), UploadSession.status == 'finalizing')
+         .update({'status': 'uploading'}, synchronize_session=False))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error releasing uploads {', '.join(upload_ids)}: {str(e)}")
+
+
+def _finalize_in_progress(error, **extra):
+    resp = jsonify({"error": error, **extra})
+    resp.status_code = 409
+    resp.headers.set('Retry-After', '1')
+    return resp
+
+
+def _move_part(upload):
+    """Move the finished .part file to its final path. Returns whether this
+    call moved it: an interrupted earlier finalize may already have done so."""
+    if os.path.exists(_part_path(upload)):
+        os.replace(_part_path(upload), upload.stored_filepath)
+        return True
+    if not os.path.exists(upload.stored_filepath):
+        raise FileNotFoundError(f"Uploaded file not found: {_part_path(upload)}")
+    return False
+
+
+def _offset_mismatch(upload):
+    resp = jsonify({"error": "Offset mismatch", "offset": upload.offset})
+    resp.status_code = 409
+    resp.headers.set('Upload-Offset', str(upload.offset))
+    return resp
+
+
+def _append_chunk(upload, f):
+    """Write the request body at the upload's offset and claim the new offset.
+    Runs with the .part file locked (see _lock_part)."""
+    start = upload.offset
+    try:
+        hasher = _resume_hasher(upload)
+        written = 0
+        too_large = False
+        # Drop anything past the committed offset (a chunk cut off mid-write)
+        f.seek(start)
+        f.truncate()
+        try:
+            while True:
+                chunk = request.stream.read(STREAM_BUFFER_SIZE)
+                if not chunk:
+                    break
+                room = upload.total_size - start - written
+                if len(chunk) > room:
+                    chunk = chunk[:room]
+                    too_large = True
+                f.write(chunk)
+                hasher.update(chunk)
+                written += len(chunk)
+                if too_large:
+                    break
+        except ClientDisconnected:
+            # Keep what arrived; the client resumes from the new offset
+            pass
+        f.flush()
+        os.fsync(f.fileno())
+
+        values = {'offset': start + written, 'updated_at': datetime.utcnow()}
+        if start + written == upload.total_size:
+            values['content_hash'] = hasher.hexdigest()
+        # Only moves the offset if no other request claimed it first
+        claimed = (UploadSession.query
+                   .filter_by(id=upload.id, offset=start, status='uploading')
+                   .update(values, synchronize_session=False))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+    # _resume_hasher took the running hash out of the registry; it only goes
+    # back once this chunk's offset is claimed
+    if not claimed:
+        if not _reload(upload):
+            return jsonify({"error": "Upload was aborted"}), 410
+        return _offset_mismatch(upload)
+    db.session.refresh(upload)
+    if upload.offset < upload.total_size:
+        # Finalize only needs content_hash
+        _remember_hasher(upload.id, upload.offset, hasher)
+
+    if too_large:
+        resp = jsonify({"error": "Chunk exceeds the declared upload size", "offset": upload.offset})
+        resp.status_code = 413
+        resp.headers.set('Upload-Offset', str(upload.offset))
+        return resp
+    return _offset_response(upload)
+
+
+@upload_bp.route('', methods=['POST'])
+def create_upload():
+    data = request.get_json(silent=True) or {}
+    filename = (data.get('filename') or '').strip()
+    size = data.get('size')
+    fields = data.get('fields') or {}
+
+    if not filename or not isinstance(size, int) or size <= 0:
+        return jsonify({"error": "filename and a positive size are required"}), 400
+
+    extension = os.path.splitext(filename)[1].lower()
+    kind = data.get('kind') or ('track' if extension in AUDIO_EXTENSIONS else 'video')
+    stealth = fields.get('stealth') in (True, 'on', 'true', '1')
+
+    if kind == 'video':
+        if extension not in VIDEO_EXTENSIONS:
+            return jsonify({"error": allowed_files_message(VIDEO_EXTENSIONS)}), 400
+        upload_folder = current_app.config['STEALTH_UPLOAD_FOLDER'] if stealth else current_app.config['UPLOAD_FOLDER']
+        os.makedirs(upload_folder, exist_ok=True)
+        _, stored_filepath = generate_video_filename(extension, upload_folder)
+    elif kind == 'track':
+        if extension not in AUDIO_EXTENSIONS:
+            return jsonify({"error": "Unsupported audio format"}), 400
+        upload_folder = current_app.config['STEALTH_AUDIO_UPLOAD_FOLDER'] if stealth else current_app.config['AUDIO_UPLOAD_FOLDER']
+        os.makedirs(upload_folder, exist_ok=True)
+        base_filename = (fields.get('nickname') or os.path.splitext(filename)[0]) + extension
+        _, stored_filepath = generate_unique_filename(base_filename, upload_folder)
+    else:
+        return jsonify({"error": "kind must be 'video' or 'track'"}), 400
+
+    upload = UploadSession(
+        id=uuid.uuid4().hex,
+        kind=kind,
+        original_filename=filename,
+        stored_filepath=stored_filepath,
+        total_size=size,
+        offset=0,
+        fields=json.dumps(fields),
+    )
+    try:
+        # Reserve the partial file in the final storage folder
+        open(_part_path(upload), 'wb').close()
+        db.session.add(upload)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+    resp = jsonify(_session_json(upload))
+    resp.status_code = 201
+    resp.headers.set('Location', url_for('upload.upload_status', upload_id=upload.id))
+    resp.headers.set('Upload-Offset', '0')
+    return resp
+
+
+@upload_bp.route('/<upload_id>', methods=['HEAD'])
+def upload_offset(upload_id):
+    upload = UploadSession.query.get_or_404(upload_id)
+    return _offset_response(upload, 200)
+
+
+@upload_bp.route('/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    upload = UploadSession.query.get_or_404(upload_id)
+    return jsonify(_session_json(upload))
+
+
+@upload_bp.route('/<upload_id>', methods=['PATCH'])
+def upload_chunk(upload_id):
+    upload = UploadSession.query.get_or_404(upload_id)
+    if upload.status != 'uploading':
+        return jsonify({"error": "Upload is already complete"}), 409
+
+    client_offset = request.headers.get('Upload-Offset', type=int)
+    if client_offset is None:
+        return jsonify({"error": "Upload-Offset header is required"}), 400
+
+    try:
+        part = open(_part_path(upload), 'r+b')
+    except FileNotFoundError:
+        return jsonify({"error": "Upload was aborted"}), 410
+    with part as f:
+        if not _lock_part(f):
+            return jsonify({"error": "Another chunk for this upload is in progress"}), 409
+        # The row may have moved on since it was read above
+        if not _reload(upload):
+            return jsonify({"error": "Upload was aborted"}), 410
+        if upload.status != 'uploading':
+            return jsonify({"error": "Upload is already complete"}), 409
+        if client_offset != upload.offset:
+            return _offset_mismatch(upload)
+        return _append_chunk(upload, f)
+
+
+@upload_bp.route('/<upload_id>/finalize', methods=['POST'])
+def finalize_upload(upload_id):
+    upload = UploadSession.query.get_or_404(upload_id)
+    if upload.status == 'complete':
+        # Finalize is idempotent so a client can retry after a dropped response
+        return _finalized_response(upload)
+    if upload.offset != upload.total_size:
+        return jsonify({"error": "Upload is incomplete", "offset": upload.offset, "size": upload.total_size}), 409
+
+    if not _claim_finalize(upload):
+        if not _reload(upload):
+            return jsonify({"error": "Upload was aborted"}), 410
+        if upload.status == 'complete':
+            return _finalized_response(upload)
+        return _finalize_in_progress("Upload is being finalized")
+
+    fields = json.loads(upload.fields or '{}')
+    fields.update(request.form.to_dict())
+    part_path = _part_path(upload)
+
+    # Same bytes uploaded before: drop the partial file and point at the existing row
+    duplicate = (find_duplicate_video if upload.kind == 'video' else find_duplicate_track)(
+        upload.content_hash, upload_folder_of(upload.stored_filepath))
+    if duplicate:
+        try:
+            if upload.kind == 'video' and fields.get('playlist_id'):
+                link_to_playlist(duplicate, int(fields['playlist_id']), int(fields.get('position') or 1))
+            upload.result_id = duplicate.id
+            upload.status = 'complete'
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            _release_finalize([upload_id])
+            return jsonify({"error": str(e)}), 500
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        _forget_hasher(upload.id)
+        return jsonify({"success": True, f"{upload.kind}_id": duplicate.id, "duplicate": True,
+                        "content_hash": upload.content_hash}), 200
+
+    if upload.kind == 'video' and not ingest_pool.admission_check(1):
+        _release_finalize([upload_id])
+        return ingest_pool.busy_response()
+
+    moved = False
+    try:
+        moved = _move_part(upload)
+        if upload.kind == 'video':
+            # Conversion and thumbnailing run in the background job queue
+            item = _video_item(upload, fields)
+            job = enqueue_video_ingest(item.pop('stored_filepath'), item.pop('original_filepath'), **item)
+            db.session.flush()
+            upload.job_id = job.id
+        else:
+            relative_cover_path = save_track_cover(request.files.get('background'),
+                                                   os.path.basename(upload.stored_filepath),
+                                                   current_app.config['COVER_FOLDER'],
+                                                   current_app.static_folder)
+            result = ingest_track(upload.stored_filepath, upload.original_filename,
+                                  nickname=fields.get('nickname'),
+                                  description=fields.get('description'),
+                                  tags=fields.get('tags'),
+                                  artist_name=(fields.get('artist_name') or '').strip(),
+                                  background_image_path=relative_cover_path,
+                                  content_hash=upload.content_hash)
+            db.session.flush()
+            upload.result_id = result.id
+        upload.status = 'complete'
+        db.session.commit()
+        if upload.kind != 'video':
+            publish_media(upload.stored_filepath)
+    except Exception as e:
+        db.session.rollback()
+        # Put back only what this request moved, so finalize can be retried
+        if moved:
+            os.replace(upload.stored_filepath, part_path)
+        _release_finalize([upload_id])
+        return jsonify({"error": str(e)}), 500
+
+    _forget_hasher(upload.id)
+    return _finalized_response(upload)
+
+
+@upload_bp.route('/finalize', methods=['POST'])
+def finalize_upload_batch():
+    """Finalize several finished video uploads as one ingest job, so they are
+    processed in parallel and inserted with a single commit.
+    JSON body: {"upload_ids": [...]}"""
+    data = request.get_json(silent=True) or {}
+    upload_ids = data.get('upload_ids') or []
+    if not upload_ids:
+        return jsonify({"error": "upload_ids is required"}), 400
+
+    uploads = UploadSession.query.filter(UploadSession.id.in_(upload_ids)).all()
+    uploads.sort(key=lambda upload: upload_ids.index(upload.id))
+    if len(uploads) != len(set(upload_ids)):
+        return jsonify({"error": "Unknown upload id"}), 404
+    if any(upload.kind != 'video' for upload in uploads):
+        return jsonify({"error": "Only video uploads can be finalized as a batch"}), 400
+    incomplete = [upload.id for upload in uploads if upload.status != 'complete' and upload.offset != upload.total_size]
+    if incomplete:
+        return jsonify({"error": "Some uploads are incomplete", "incomplete": incomplete}), 409
+
+    pending = [upload for upload in uploads if upload.status != 'complete']
+    if pending and not ingest_pool.admission_check(len(pending)):
+        return ingest_pool.busy_response()
+
+    claimed = [upload for upload in pending if _claim_finalize(upload)]
+    if len(claimed) != len(pending):
+        # Another request is finalizing some of them (or just finished)
+        _release_finalize([upload.id for upload in claimed])
+        busy = sorted(set(upload.id for upload in pending) - set(upload.id for upload in claimed))
+        return _finalize_in_progress("Some uploads are being finalized", uploads=busy)
+
+    items, renamed, moved, duplicate_parts = [], [], [], []
+    try:
+        for upload in pending:
+            fields = json.loads(upload.fields or '{}')
+            duplicate = find_duplicate_video(upload.content_hash, upload_folder_of(upload.stored_filepath))
+            if duplicate:
+                if fields.get('playlist_id'):
+                    link_to_playlist(duplicate, int(fields['playlist_id']), int(fields.get('position') or 1))
+                upload.result_id = duplicate.id
+                upload.status = 'complete'
+                duplicate_parts.append(_part_path(upload))
+                continue
+            if _move_part(upload):
+                moved.append((upload.stored_filepath, _part_path(upload)))
+            renamed.append(upload)
+            items.append(_video_item(upload, fields))
+
+        if items:
+            job = enqueue_video_batch(items)
+            db.session.flush()
+            for upload in renamed:
+                upload.job_id = job.id
+                upload.status = 'complete'
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        # Put back only what this request moved, so finalize can be retried
+        for stored_filepath, part_path in moved:
+            os.replace(stored_filepath, part_path)
+        _release_finalize([upload.id for upload in pending])
+        return jsonify({"error": str(e)}), 500
+
+    for part_path in duplicate_parts:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+    for upload in pending:
+        _forget_hasher(upload.id)
+
+    job_ids = sorted({upload.job_id for upload in uploads if upload.job_id})
+    return jsonify({
+        "success": True,
+        "jobs": job_ids,
+        # Uploads that matched videos already in the library
+        "videos": {upload.id: upload.result_id for upload in uploads if upload.result_id},
+    }), 202 if job_ids else 200
+
+
+@upload_bp.route('/<upload_id>', methods=['DELETE'])
+def abort_upload(upload_id):
+    upload = UploadSession.query.get_or_404(upload_id)
+    if upload.status == 'complete':
+        return jsonify({"error": "Upload is already complete"}), 409
+    if upload.status == 'finalizing':
+        return _finalize_in_progress("Upload is being finalized")
+    try:
+        if os.path.exists(_part_path(upload)):
+            os.remove(_part_path(upload))
+        db.session.delete(upload)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+    _forget_hasher(upload_id)
+    return jsonify({"success": True}), 200
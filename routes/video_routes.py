@@ -3,13 +3,11 @@ from . import video_bp
 from models import db, Video, Comment, AuthorProfile
 from sqlalchemy import desc
 import os
-import ffmpeg
-from werkzeug.utils import secure_filename
-from datetime import datetime
-import random
-import string
 import re
 import unicodedata
+from storyboard import has_storyboard, storyboard_index_rel_path
+from ingest import generate_video_filename, enqueue_video_ingest, hash_stream, find_duplicate_video
+import ingest_pool
 
 def slugify_author(author_name: str) -> str:
     """Create a URL-safe slug from an author name.
@@ -36,53 +34,6 @@ def slugify_author(author_name: str) -> str:
     slug = ''.join(slug_chars).strip('-')
     return slug
 
-def generate_unique_filename(original_filename, upload_folder):
-    """Generate a unique filename by adding timestamp and random string if needed"""
-    name, ext = os.path.splitext(original_filename)
-    filename = secure_filename(name + ext)
-    filepath = os.path.join(upload_folder, filename)
-    
-    # If file already exists, add timestamp and random string
-    if os.path.exists(filepath):
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        random_string = ''.join(random.choices(string.ascii_lowercase + string.digits, k=4))
-        filename = secure_filename(f"{name}_{timestamp}_{random_string}{ext}")
-        filepath = os.path.join(upload_folder, filename)
-    
-    return filename, filepath
-
-def generate_video_filename(extension, upload_folder):
-    """Generate a unique video filename using yyyymmdd format + random characters"""
-    date_str = datetime.now().strftime('%Y%m%d')
-    random_string = ''.join(random.choices(string.ascii_lowercase + string.digits, k=8))
-    filename = secure_filename(f"{date_str}_{random_string}{extension}")
-    filepath = os.path.join(upload_folder, filename)
-    
-    # If file already exists, add more random characters to ensure uniqueness
-    while os.path.exists(filepath):
-        random_string = ''.join(random.choices(string.ascii_lowercase + string.digits, k=8))
-        filename = secure_filename(f"{date_str}_{random_string}{extension}")
-        filepath = os.path.join(upload_folder, filename)
-    
-    return filename, filepath
-
-def convert_webm_to_mp4(input_path):
-    """Convert WebM file to MP4 and return the new filepath"""
-    output_path = os.path.splitext(input_path)[0] + '.mp4'
-    try:
-        (
-            ffmpeg
-            .input(input_path)
-            .output(output_path, acodec='aac', vcodec='h264', **{'b:v': '2M'})
-            .overwrite_output()
-            .run(capture_stdout=True, capture_stderr=True)
-        )
-        os.remove(input_path)  # Remove original WebM file
-        return output_path
-    except ffmpeg.Error as e:
-        print(f"Error converting WebM to MP4: {e.stderr.decode()}")
-        raise
-
 def get_related_videos(current_video, limit=8):
     if not current_video.tags:
         return []
@@ -155,61 +106,27 @@ def add_video():
         new_filename, stored_filepath = generate_video_filename(original_extension, upload_folder)
         
         try:
+            # Same bytes uploaded before: point at the existing video instead
+            content_hash = hash_stream(file.stream)
+            duplicate = find_duplicate_video(content_hash, upload_folder)
+            if duplicate:
+                return jsonify({"success": True, "video_id": duplicate.id, "duplicate": True}), 200
+            if not ingest_pool.admission_check(1):
+                return ingest_pool.busy_response()
+
             os.makedirs(upload_folder, exist_ok=True)
             file.save(stored_filepath)
             
-            # Convert WebM to MP4 if necessary
-            if original_extension == '.webm':
-                stored_filepath = convert_webm_to_mp4(stored_filepath)
-                new_filename = os.path.basename(stored_filepath)
-            
-            # Generate thumbnail
-            thumbnail_filename = f"thumbnail_{os.path.splitext(new_filename)[0]}.jpg"
-            thumbnails_dir = os.path.join(current_app.static_folder, 'thumbnails')
-            os.makedirs(thumbnails_dir, exist_ok=True)
-            thumbnail_path = os.path.join(thumbnails_dir, thumbnail_filename)
-            
-            # Get video duration more robustly
-            probe = ffmpeg.probe(stored_filepath)
-            duration = None
-            # Try different methods to get duration
-            for stream in probe['streams']:
-                if 'duration' in stream:
-                    duration = float(stream['duration'])
-                    break
-            
-            # If duration not found in streams, try format
-            if duration is None and 'format' in probe and 'duration' in probe['format']:
-                duration = float(probe['format']['duration'])
-            
-            # If still no duration, use a default timestamp
-            if duration is None:
-                duration = 0
-            
-            # Extract middle frame
-            (
-                ffmpeg
-                .input(stored_filepath, ss=duration/2 if duration > 0 else 0)
-                .filter('scale', 320, -1)
-                .output(thumbnail_path, vframes=1)
-                .overwrite_output()
-                .run(capture_stdout=True, capture_stderr=True)
-            )
-            
-            # Set the thumbnail_path to be relative to the static folder
-            relative_thumbnail_path = os.path.join('thumbnails', thumbnail_filename).replace('\\', '/')
-            
-            new_video = Video(original_filepath=original_filepath, 
-                              stored_filepath=stored_filepath,
-                              nickname=nickname, 
-                              description=description, 
-                              tags=tags,
-                              thumbnail_path=relative_thumbnail_path,
-                              view_count=0)  # Initialize view_count to 0
-            db.session.add(new_video)
+            # Conversion, thumbnailing and the database row happen in a background job
+            job = enqueue_video_ingest(stored_filepath, original_filepath,
+                                       nickname=nickname,
+                                       description=description,
+                                       tags=tags,
+                                       content_hash=content_hash)
             db.session.commit()
             
-            return jsonify({"success": True, "video_id": new_video.id}), 200
+            return jsonify({"success": True, "job_id": job.id,
+                            "status_url": url_for('jobs.job_status', job_id=job.id)}), 202
         except Exception as e:
             db.session.rollback()
             return jsonify({"error": str(e)}), 500
@@ -254,7 +171,10 @@ def video_detail(video_id):
             if p.avatar_path:
                 avatars[p.slug] = p.avatar_path
     db.session.commit()
-    return render_template('video_detail.html', video=video, related_videos=related_videos, comments=comments, author_avatars=avatars)
+    storyboard_url = None
+    if has_storyboard(video.stored_filepath, current_app.static_folder):
+        storyboard_url = url_for('static', filename=storyboard_index_rel_path(video.stored_filepath))
+    return render_template('video_detail.html', video=video, related_videos=related_videos, comments=comments, author_avatars=avatars, storyboard_url=storyboard_url)
 
 @video_bp.route('/video/<int:video_id>')
 def legacy_video_detail(video_id):
@@ -0,0 +1,309 @@
+"""
+Smart Trim Module
+Frame-accurate trimming without re-encoding the whole video. Only the partial
+GOPs at either end of the cut are re-encoded; the keyframe-aligned middle is
+stream-copied and the pieces are joined with the concat demuxer:
+
+    [start, k1) re-encode | [k1, k2) copy | [k2, end) re-encode
+
+k1 is the first keyframe at or after start, k2 the last keyframe at or before
+end. Audio is cut separately and copied when it is already browser-compatible.
+Trims run as 'trim_video' background jobs in the ingest process pool.
+
+The edges are encoded with the source's profile, level, reference frame count
+and pixel format, but their SPS/PPS still differ from the copied middle's.
+The concat demuxer puts each MP4 part's parameter sets in-band in front of
+its keyframes (h264_mp4toannexb), and the output is tagged avc3 so decoders
+use those instead of the single set in the sample entry. Sources whose SPS
+libx264 cannot match (10-bit, 4:2:2, interlaced, unknown profiles) are
+re-encoded whole.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import ffmpeg
+from flask import current_app
+
+import ingest_pool
+from ingest import hash_file, refresh_video_media
+from jobs import enqueue, job_handler
+from media_metadata import first_stream
+from models import db, Video
+from storage import get_storage, publish_media
+from transcode import COMPATIBLE_AUDIO_CODECS, COMPATIBLE_PIXEL_FORMATS
+
+# Only the edges of long cuts are scanned for keyframes
+KEYFRAME_SEARCH_SECONDS = 30
+# Codecs whose edges can be re-encoded to match the copied middle
+SMART_TRIM_CODECS = ('h264',)
+# Below this much copyable video the whole cut is simply re-encoded
+MIN_COPY_SECONDS = 1.0
+# The re-encoded edges are short, so spend bits on matching the copied middle
+EDGE_CRF = 18
+EDGE_PRESET = 'fast'
+# Scratch directories live next to the video so the final rename stays on one filesystem
+TRIM_TEMP_PREFIX = 'temp_trim_'
+# Slack for comparing timestamps printed by ffprobe
+TIME_EPSILON = 0.001
+
+# Field orders of progressive video, as ffprobe reports them
+PROGRESSIVE_FIELD_ORDERS = (None, 'progressive', 'unknown')
+
+_X264_PROFILES = {'constrained baseline': 'baseline', 'baseline': 'baseline', 'main': 'main', 'high': 'high'}
+
+
+def _positive_int(value: Any) -> Optional[int]:
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return None
+    return number if number > 0 else None
+
+
+def edge_settings(video: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    libx264 options for edges whose SPS matches the source stream's profile,
+    level, reference frames and bit depth.
+
+    Args:
+        video: The source's video stream from ffmpeg.probe
+
+    Returns:
+        The options, or None if libx264 cannot produce a matching stream
+        (the cut is then re-encoded whole)
+    """
+    profile = _X264_PROFILES.get((video.get('profile') or '').lower())
+    if (profile is None or video.get('pix_fmt') not in COMPATIBLE_PIXEL_FORMATS
+            or video.get('field_order') not in PROGRESSIVE_FIELD_ORDERS):
+        return None
+    settings: Dict[str, Any] = {'profile:v': profile, 'pix_fmt': video['pix_fmt']}
+    # ffprobe reports the level as level_idc (31 for 3.1), which x264 accepts
+    level = _positive_int(video.get('level'))
+    if level:
+        settings['level'] = level
+    # Never need a bigger decoded picture buffer than the copied middle
+    refs = _positive_int(video.get('refs'))
+    if refs:
+        settings['refs'] = refs
+    return settings
+
+
+def find_keyframes(path: str, start: float, end: float, window: float = KEYFRAME_SEARCH_SECONDS) -> List[float]:
+    """
+    Keyframe times of the first video stream between start and end. Only
+    packet headers are read (nothing is decoded), and for long ranges only
+    the windows at either end.
+    """
+    if end - start > 2 * window:
+        intervals = f"{start}%+{window},{end - window}%{end + 1}"
+    else:
+        intervals = f"{start}%{end + 1}"
+    probe = ffmpeg.probe(path, select_streams='v:0', show_entries='packet=pts_time,flags',
+                         read_intervals=intervals)
+    keyframes = set()
+    for packet in probe.get('packets', []):
+        if 'K' in packet.get('flags', '') and packet.get('pts_time') not in (None, 'N/A'):
+            pts_time = float(packet['pts_time'])
+            if start - TIME_EPSILON <= pts_time <= end + TIME_EPSILON:
+                keyframes.add(pts_time)
+    return sorted(keyframes)
+
+
+def plan_trim(path: str, start: float, end: float, video_codec: Optional[str] = None,
+              video: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Work out which parts of a cut are re-encoded and which are copied.
+
+    Args:
+        path: The video file
+        start/end: The cut, in seconds
+        video_codec: Codec of the video stream if already known (e.g. stored
+            metadata); codecs other than SMART_TRIM_CODECS are then not probed
+        video: The probed video stream, if at hand; also decides whether
+            the edges can match it (see edge_settings)
+
+    Returns:
+        Dict with the mode ('smart' or 'encode'), the segments in order (each
+        with start, end and mode 'copy' or 'encode'), and the encoded and
+        copied seconds
+    """
+    if video is None and (video_codec is None or video_codec in SMART_TRIM_CODECS):
+        # Whether the edges can match the stream depends on its profile and pixel format
+        video = first_stream(ffmpeg.probe(path, select_streams='v:0'), 'video')
+    if video is not None:
+        video_codec = video.get('codec_name')
+
+    segments = [{'start': start, 'end': end, 'mode': 'encode'}]
+    mode, reason = 'encode', None
+    if video_codec not in SMART_TRIM_CODECS:
+        reason = f"{video_codec or 'unknown'} video is always re-encoded"
+    elif video is not None and edge_settings(video) is None:
+        reason = (f"edges cannot match {video.get('profile') or 'unknown'} profile "
+                  f"{video.get('pix_fmt') or 'unknown'} video")
+    else:
+        keyframes = find_keyframes(path, start, end)
+        k1 = next((k for k in keyframes if k >= start - TIME_EPSILON), None)
+        k2 = next((k for k in reversed(keyframes) if k <= end + TIME_EPSILON), None)
+        if k1 is None or k2 is None or k2 - k1 < MIN_COPY_SECONDS:
+            reason = 'no keyframe-aligned middle to copy'
+        else:
+            mode = 'smart'
+            segments = []
+            if k1 - start > TIME_EPSILON:
+                segments.append({'start': start, 'end': k1, 'mode': 'encode'})
+            segments.append({'start': k1, 'end': k2, 'mode': 'copy'})
+            if end - k2 > TIME_EPSILON:
+                segments.append({'start': k2, 'end': end, 'mode': 'encode'})
+
+    def seconds(kind):
+        return round(sum(s['end'] - s['start'] for s in segments if s['mode'] == kind), 3)
+
+    return {'start': start, 'end': end, 'mode': mode, 'reason': reason, 'segments': segments,
+            'encoded_seconds': seconds('encode'), 'copied_seconds': seconds('copy')}
+
+
+def _encode_segment(src: str, part: str, segment: Dict[str, Any], settings: Dict[str, Any],
+                    thread_args: Dict[str, Any]) -> None:
+    output_args = {'vcodec': 'libx264', 'crf': EDGE_CRF, 'preset': EDGE_PRESET, **settings}
+    (
+        ffmpeg
+        .input(src, ss=segment['start'], t=segment['end'] - segment['start'], **thread_args)
+        .video
+        .output(part, **output_args, **thread_args)
+        .overwrite_output()
+        .run(capture_stdout=True, capture_stderr=True)
+    )
+
+
+def _copy_segment(src: str, part: str, segment: Dict[str, Any]) -> None:
+    # segment['start'] is a keyframe, so input seeking lands exactly on it.
+    # -t cuts stream copies by decode time and would keep the keyframe at
+    # segment['end'] too, so packets are dropped by presentation time instead.
+    duration = segment['end'] - segment['start']
+    (
+        ffmpeg
+        .input(src, ss=segment['start'], t=duration)
+        .video
+        .output(part, vcodec='copy', **{'bsf:v': f"noise=drop=gte(pts*tb\\,{duration - TIME_EPSILON:.6f})"})
+        .overwrite_output()
+        .run(capture_stdout=True, capture_stderr=True)
+    )
+
+
+def _cut_audio(src: str, output: str, start: float, end: float, audio: Dict[str, Any]) -> None:
+    codec_args = ({'acodec': 'copy'} if audio.get('codec_name') in COMPATIBLE_AUDIO_CODECS
+                  else {'acodec': 'aac', 'audio_bitrate': '192k'})
+    (
+        ffmpeg
+        .input(src, ss=start, t=end - start)
+        .audio
+        .output(output, **codec_args)
+        .overwrite_output()
+        .run(capture_stdout=True, capture_stderr=True)
+    )
+
+
+def smart_trim(src: str, dst: str, start: float, end: float, threads: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Write the [start, end) cut of src to dst as MP4. Safe to run in a worker
+    process (see ingest_pool.py).
+
+    Returns:
+        The plan_trim result plus elapsed_seconds
+    """
+    started = time.monotonic()
+    probe = ffmpeg.probe(src)
+    video = first_stream(probe, 'video')
+    audio = first_stream(probe, 'audio')
+    if video is None:
+        raise ValueError(f"No video stream in {src}")
+    plan = plan_trim(src, start, end, video=video)
+    thread_args = {'threads': threads} if threads else {}
+    if plan['mode'] == 'smart':
+        settings = edge_settings(video)
+        # The parts' parameter sets differ; avc3 makes decoders read them in-band
+        mux_args = {'tag:v': 'avc3'}
+    else:
+        # A whole re-encode only has to be browser-compatible
+        settings = {'pix_fmt': 'yuv420p'}
+        mux_args = {}
+
+    work_dir = tempfile.mkdtemp(prefix=TRIM_TEMP_PREFIX, dir=os.path.dirname(dst))
+    try:
+        list_path = os.path.join(work_dir, 'parts.txt')
+        with open(list_path, 'w') as parts:
+            for index, segment in enumerate(plan['segments']):
+                part = os.path.join(work_dir, f"part{index}.mp4")
+                if segment['mode'] == 'copy':
+                    _copy_segment(src, part, segment)
+                else:
+                    _encode_segment(src, part, segment, settings, thread_args)
+                # Explicit durations keep the parts back to back on the output timeline
+                parts.write(f"file '{os.path.basename(part)}'\nduration {segment['end'] - segment['start']:.6f}\n")
+
+        # auto_convert (on by default) moves each part's SPS/PPS in-band
+        streams = [ffmpeg.input(list_path, f='concat', safe=0).video]
+        if audio is not None:
+            audio_path = os.path.join(work_dir, 'audio.m4a')
+            _cut_audio(src, audio_path, start, end, audio)
+            streams.append(ffmpeg.input(audio_path).audio)
+        (
+            ffmpeg
+            .output(*streams, dst, c='copy', movflags='+faststart', **mux_args)
+            .overwrite_output()
+            .run(capture_stdout=True, capture_stderr=True)
+        )
+    except ffmpeg.Error as e:
+        print(f"Error trimming {src}: {e.stderr.decode()}")
+        raise
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    plan['elapsed_seconds'] = round(time.monotonic() - started, 2)
+    return plan
+
+
+def enqueue_trim(video: Video, start: float, end: float):
+    """Queue a smart trim of a video. The caller commits."""
+    # The hash tells a retry whether the file was already replaced
+    return enqueue('trim_video', {"video_id": video.id, "start": start, "end": end,
+                                  "source_hash": video.content_hash})
+
+
+@job_handler('trim_video')
+def run_trim_video_job(job, payload, progress):
+    video = db.session.get(Video, payload['video_id'])
+    if video is None:
+        return {"video_id": payload['video_id'], "deleted": True}
+
+    storage = get_storage()
+    plan = None
+    # With remote storage the file is trimmed in a local working copy
+    with storage.local_copy(video.stored_filepath) as source:
+        if video.content_hash == payload.get('source_hash'):
+            base = os.path.splitext(source)[0]
+            trimmed = base + '_trimmed.mp4'
+            progress('trimming', 0.1)
+            plan = ingest_pool.run(smart_trim, source, trimmed, payload['start'], payload['end'],
+                                   ingest_pool.FFMPEG_THREADS_PER_JOB)
+            final = base + '.mp4'
+            os.replace(trimmed, final)
+            if final != source:
+                os.remove(source)
+                video.stored_filepath = final
+            video.content_hash = hash_file(final)
+            db.session.commit()
+
+        # Metadata, thumbnail and storyboard follow the new file
+        refresh_video_media(video, current_app.static_folder,
+                            lambda stage, fraction: progress(stage, 0.6 + 0.4 * fraction))
+        db.session.commit()
+        if plan is not None:
+            publish_media(video.stored_filepath)
+            if video.stored_filepath != source:
+                storage.delete(source)
+    return {"video_id": video.id, "plan": plan}
@@ -0,0 +1,130 @@
+(() => {
+    // Client for the resumable /uploads protocol: create a session, PATCH the
+    // file in slices at the server's offset, then finalize. Interrupted
+    // uploads resume from the last acknowledged byte, including after a page
+    // reload (the session id is kept in localStorage per file).
+    //
+    //   const data = await easycoreUpload.upload(file, { tags, stealth }, {
+    //       kind: 'video',           // or 'track'; inferred from the extension if omitted
+    //       onProgress: fraction => ...,
+    //       finalizeData: formData,  // extra multipart fields (e.g. a cover image)
+    //       finalize: false          // stop after the bytes are uploaded (see finalizeBatch)
+    //   });
+
+    const UPLOADS_URL = '/uploads';
+    const MAX_RETRIES = 5;
+    const STORAGE_PREFIX = 'easycore-upload:';
+
+    const sleep = ms => new Promise(resolve => setTimeout(resolve, ms));
+    const storageKey = file => `${STORAGE_PREFIX}${file.name}:${file.size}:${file.lastModified}`;
+
+    const readError = async (response, fallback) => {
+        try {
+            const data = await response.json();
+            return data.error || fallback;
+        } catch (error) {
+            return fallback;
+        }
+    };
+
+    const createSession = async (file, fields, kind) => {
+        const response = await fetch(UPLOADS_URL, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ filename: file.name, size: file.size, kind, fields })
+        });
+        if (!response.ok) throw new Error(await readError(response, 'Could not start upload'));
+        return response.json();
+    };
+
+    const resumeSession = async file => {
+        const uploadId = localStorage.getItem(storageKey(file));
+        if (!uploadId) return null;
+        const response = await fetch(`${UPLOADS_URL}/${uploadId}`);
+        if (!response.ok) {
+            localStorage.removeItem(storageKey(file));
+            return null;
+        }
+        const session = await response.json();
+        return session.status === 'uploading' ? session : null;
+    };
+
+    const currentOffset = async uploadId => {
+        const response = await fetch(`${UPLOADS_URL}/${uploadId}`, { method: 'HEAD' });
+        if (!response.ok) throw new Error('Upload session was lost');
+        return parseInt(response.headers.get('Upload-Offset'), 10);
+    };
+
+    const upload = async (file, fields = {}, options = {}) => {
+        const onProgress = options.onProgress || (() => {});
+        const session = (await resumeSession(file)) || (await createSession(file, fields, options.kind));
+        const uploadId = session.upload_id;
+        const chunkSize = session.chunk_size;
+        localStorage.setItem(storageKey(file), uploadId);
+
+        let offset = session.offset;
+        let failures = 0;
+        onProgress(offset / file.size);
+
+        while (offset < file.size) {
+            try {
+                const response = await fetch(`${UPLOADS_URL}/${uploadId}`, {
+                    method: 'PATCH',
+                    headers: {
+                        'Content-Type': 'application/offset+octet-stream',
+                        'Upload-Offset': String(offset)
+                    },
+                    body: file.slice(offset, offset + chunkSize)
+                });
+                if (response.status === 409) {
+                    offset = await currentOffset(uploadId);
+                    continue;
+                }
+                if (!response.ok) throw new Error(await readError(response, 'Chunk upload failed'));
+                offset = parseInt(response.headers.get('Upload-Offset'), 10);
+                failures = 0;
+                onProgress(offset / file.size);
+            } catch (error) {
+                failures += 1;
+                if (failures > MAX_RETRIES) throw error;
+                await sleep(1000 * 2 ** failures);
+                // The server may have stored part of the chunk before the drop
+                offset = await currentOffset(uploadId);
+            }
+        }
+
+        localStorage.removeItem(storageKey(file));
+        if (options.finalize === false) return { upload_id: uploadId };
+
+        return postWhenAdmitted(`${UPLOADS_URL}/${uploadId}/finalize`, () => ({
+            method: 'POST',
+            body: options.finalizeData || new FormData()
+        }));
+    };
+
+    // The server answers 503 + Retry-After while its ingest queue is full,
+    // and 409 + Retry-After while another request finalizes the same upload
+    const postWhenAdmitted = async (url, makeRequest) => {
+        while (true) {
+            const response = await fetch(url, makeRequest());
+            if (response.status === 503 || (response.status === 409 && response.headers.has('Retry-After'))) {
+                const retryAfter = parseInt(response.headers.get('Retry-After'), 10) || 30;
+                await sleep(retryAfter * 1000);
+                continue;
+            }
+            const data = await response.json();
+            if (!response.ok || !data.success) throw new Error(data.error || 'Upload failed');
+            return data;
+        }
+    };
+
+    // Finalize uploads made with {finalize: false} as one batch, so the server
+    // processes them in parallel and adds them together
+    const finalizeBatch = uploadIds => postWhenAdmitted(`${UPLOADS_URL}/finalize`, () => ({
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ upload_ids: uploadIds })
+    }));
+
+    window.easycoreUpload = { upload, finalizeBatch };
+})();
@@ -0,0 +1,72 @@
+(() => {
+    // Lists marked with data-feed-url load their next page from the /api/v1
+    // listing endpoints as the end of the list scrolls into view. The server
+    // renders the cards (fields=html), so only the new cards are sent rather
+    // than a whole page with its navbar and player. Every appended batch is
+    // announced with a "feed:append" event that bubbles up from the list.
+    // The page links named by data-feed-pagination stay as the fallback
+    // without JavaScript or after a failed request.
+    if (!('IntersectionObserver' in window)) return;
+
+    // Start loading this far ahead of the viewport
+    const PRELOAD_MARGIN = '800px 0px';
+
+    const setup = list => {
+        let cursor = list.dataset.nextCursor;
+        if (!cursor) return;
+        const pagination = list.dataset.feedPagination
+            ? document.querySelector(list.dataset.feedPagination)
+            : null;
+        if (pagination) pagination.style.display = 'none';
+
+        const sentinel = document.createElement('div');
+        sentinel.className = 'feed-sentinel';
+        sentinel.setAttribute('aria-hidden', 'true');
+        list.after(sentinel);
+
+        let loading = false;
+        const observer = new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting)) loadNext();
+        }, { rootMargin: PRELOAD_MARGIN });
+
+        const stop = () => {
+            observer.disconnect();
+            sentinel.remove();
+        };
+
+        const loadNext = async () => {
+            if (loading || !cursor) return;
+            loading = true;
+            const url = new URL(list.dataset.feedUrl, window.location.href);
+            url.searchParams.set('cursor', cursor);
+            url.searchParams.set('fields', 'html');
+            try {
+                const response = await fetch(url, { headers: { Accept: 'application/json' } });
+                if (!response.ok) throw new Error(`HTTP ${response.status}`);
+                const data = await response.json();
+                const template = document.createElement('template');
+                template.innerHTML = data.items.map(item => item.html).join('');
+                const elements = Array.from(template.content.children);
+                list.append(template.content);
+                cursor = data.next_cursor;
+                list.dispatchEvent(new CustomEvent('feed:append', { bubbles: true, detail: { elements } }));
+            } catch (error) {
+                console.error('Error loading more items:', error);
+                cursor = null;
+                if (pagination) pagination.style.display = '';
+            } finally {
+                loading = false;
+            }
+            if (!cursor) {
+                stop();
+            } else if (sentinel.getBoundingClientRect().top < window.innerHeight) {
+                // Short pages: keep going until the viewport is filled
+                loadNext();
+            }
+        };
+
+        observer.observe(sentinel);
+    };
+
+    document.querySelectorAll('[data-feed-url]').forEach(setup);
+})();
@@ -0,0 +1,45 @@
+(() => {
+    // Poll background jobs until they finish:
+    //   const jobs = await easycoreJobs.wait([12, 13], jobs => render(jobs));
+    // Resolves with the final job objects (status 'done' or 'failed').
+
+    const JOBS_URL = '/jobs';
+    const POLL_MS = 1000;
+    const FINISHED = ['done', 'failed'];
+
+    const sleep = ms => new Promise(resolve => setTimeout(resolve, ms));
+
+    const stageLabel = job => {
+        if (job.status === 'queued') return job.attempts ? 'Waiting to retry' : 'Queued';
+        if (job.status === 'failed') return `Failed: ${job.error || 'unknown error'}`;
+        if (job.status === 'done') return 'Done';
+        return job.stage ? job.stage.charAt(0).toUpperCase() + job.stage.slice(1) : 'Processing';
+    };
+
+    const wait = async (jobIds, onUpdate = () => {}) => {
+        const ids = jobIds.filter(id => id !== null && id !== undefined);
+        if (!ids.length) return [];
+        while (true) {
+            try {
+                const response = await fetch(`${JOBS_URL}?ids=${ids.join(',')}`, { cache: 'no-store' });
+                if (response.ok) {
+                    const { jobs } = await response.json();
+                    onUpdate(jobs);
+                    if (jobs.length === ids.length && jobs.every(job => FINISHED.includes(job.status))) {
+                        return jobs;
+                    }
+                }
+            } catch (error) {
+                // Keep polling through brief network errors or server restarts
+                console.error('Error polling jobs:', error);
+            }
+            await sleep(POLL_MS);
+        }
+    };
+
+    const overallProgress = jobs => jobs.length
+        ? jobs.reduce((sum, job) => sum + (job.status === 'done' ? 1 : job.progress || 0), 0) / jobs.length
+        : 1;
+
+    window.easycoreJobs = { wait, stageLabel, overallProgress };
+})();
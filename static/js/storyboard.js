@@ -0,0 +1,79 @@
+(() => {
+    // Hover previews from storyboard sprite sheets. Markup:
+    //   <div class="storyboard-scrubber" data-storyboard-url="..." data-video="#main-video"></div>
+    // Hovering shows the nearest frame; clicking seeks the video and fires a
+    // "storyboard:select" event with {time, shiftKey} for other UIs (trim page).
+
+    const formatTime = seconds => {
+        if (!Number.isFinite(seconds)) return '0:00';
+        return `${Math.floor(seconds / 60)}:${Math.floor(seconds % 60).toString().padStart(2, '0')}`;
+    };
+
+    const initScrubber = async scrubber => {
+        const indexUrl = scrubber.dataset.storyboardUrl;
+        const video = scrubber.dataset.video ? document.querySelector(scrubber.dataset.video) : null;
+        let index;
+        try {
+            const response = await fetch(indexUrl);
+            if (!response.ok) return;
+            index = await response.json();
+        } catch (error) {
+            console.error('Error loading storyboard:', error);
+            return;
+        }
+        if (!index.sheets || !index.sheets.length) return;
+
+        const sheetUrls = index.sheets.map(name => new URL(name, new URL(indexUrl, window.location.href)).href);
+        const perSheet = index.columns * index.rows;
+        const duration = index.duration || (video && video.duration) || index.frame_count * index.interval;
+
+        const preview = document.createElement('div');
+        preview.className = 'storyboard-preview';
+        preview.hidden = true;
+        preview.style.width = `${index.tile_width}px`;
+        preview.style.height = `${index.tile_height}px`;
+        const label = document.createElement('span');
+        label.className = 'storyboard-time';
+        preview.appendChild(label);
+        scrubber.appendChild(preview);
+        scrubber.hidden = false;
+
+        const timeAt = event => {
+            const rect = scrubber.getBoundingClientRect();
+            const ratio = Math.min(Math.max((event.clientX - rect.left) / rect.width, 0), 1);
+            return { time: ratio * duration, offset: ratio * rect.width };
+        };
+
+        scrubber.addEventListener('mousemove', event => {
+            const { time, offset } = timeAt(event);
+            const frame = Math.min(Math.floor(time / index.interval), index.frame_count - 1);
+            const sheet = Math.min(Math.floor(frame / perSheet), sheetUrls.length - 1);
+            const cell = frame - sheet * perSheet;
+            const column = cell % index.columns;
+            const row = Math.floor(cell / index.columns);
+            preview.style.backgroundImage = `url('${sheetUrls[sheet]}')`;
+            preview.style.backgroundPosition = `-${column * index.tile_width}px -${row * index.tile_height}px`;
+            const half = index.tile_width / 2;
+            preview.style.left = `${Math.min(Math.max(offset - half, 0), scrubber.clientWidth - index.tile_width)}px`;
+            label.textContent = formatTime(time);
+            preview.hidden = false;
+        });
+
+        scrubber.addEventListener('mouseleave', () => {
+            preview.hidden = true;
+        });
+
+        scrubber.addEventListener('click', event => {
+            const { time } = timeAt(event);
+            if (video) video.currentTime = time;
+            scrubber.dispatchEvent(new CustomEvent('storyboard:select', {
+                bubbles: true,
+                detail: { time, shiftKey: event.shiftKey }
+            }));
+        });
+    };
+
+    document.addEventListener('DOMContentLoaded', () => {
+        document.querySelectorAll('.storyboard-scrubber[data-storyboard-url]').forEach(initScrubber);
+    });
+})();
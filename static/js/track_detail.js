@@ -35,7 +35,8 @@
         syncPlayButton(isCurrentTrack && event.detail.playing);
         if (!isCurrentTrack) return;
         currentTime.textContent = formatTime(event.detail.currentTime);
-        duration.textContent = formatTime(event.detail.duration);
+        // The stored duration covers the moment before the audio's metadata loads
+        duration.textContent = formatTime(event.detail.duration || config.duration);
         pageProgress.value = event.detail.duration
             ? Math.round((event.detail.currentTime / event.detail.duration) * 1000)
             : 0;
@@ -0,0 +1,194 @@
+"""
+Storage Module
+Where media files live once they are ingested. Uploads are always written,
+converted and thumbnailed on local disk (ffmpeg needs files); the backend
+decides what happens afterwards:
+
+- LocalStorage (default): files stay where they were written
+- S3Storage: files are uploaded to an S3-compatible bucket (AWS, MinIO...)
+  and the local copy is dropped. Streams redirect to short-lived presigned
+  URLs so the object store sends the bytes; trims and thumbnail refreshes
+  download a working copy first.
+
+Rows keep storing the local path. For S3 the object key is that path
+relative to the app folder (plus S3_PREFIX), e.g. uploads/3f/a2/<id>.mp4,
+so a file that has not been published yet (or failed to) is simply served
+from disk.
+
+Configured with STORAGE_BACKEND ('local' or 's3', env EASYCORE_STORAGE) and,
+for S3, S3_BUCKET, S3_ENDPOINT_URL, S3_REGION, S3_PREFIX and
+S3_URL_SECONDS (env EASYCORE_S3_*). Credentials come from the usual AWS
+environment variables or config files. S3 needs boto3.
+"""
+
+import mimetypes
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, Optional, Set
+
+from flask import current_app
+
+# Lifetime of presigned stream URLs
+DEFAULT_URL_SECONDS = 300
+
+
+class LocalStorage:
+    """Media stays on local disk where it was written"""
+
+    # Whether published files leave local disk
+    remote = False
+
+    def publish(self, path: str) -> None:
+        """Hand a finished local file to the backend"""
+
+    def exists(self, path: str) -> bool:
+        return os.path.exists(path)
+
+    @contextmanager
+    def local_copy(self, path: str) -> Iterator[str]:
+        """A local file to run ffmpeg on; the path itself for local storage"""
+        yield path
+
+    def open(self, path: str) -> BinaryIO:
+        return open(path, 'rb')
+
+    def move(self, source: str, target: str) -> None:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(source, target)
+
+    def delete(self, path: str) -> None:
+        if os.path.exists(path):
+            os.remove(path)
+
+    def stream_url(self, path: str, mime_type: str) -> Optional[str]:
+        """URL to redirect a stream to, or None to serve the file from here"""
+        return None
+
+    def remote_paths(self) -> Set[str]:
+        """Paths of files held by the backend rather than on local disk"""
+        return set()
+
+
+class S3Storage(LocalStorage):
+    """Media is published to an S3-compatible bucket and served from there"""
+
+    remote = True
+
+    def __init__(self, root: str, bucket: str, endpoint_url: Optional[str] = None, region: Optional[str] = None,
+                 prefix: str = '', url_seconds: int = DEFAULT_URL_SECONDS):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError("STORAGE_BACKEND 's3' needs boto3 (pip install boto3)")
+        self.root = os.path.abspath(root)
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.url_seconds = url_seconds
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region)
+        self._client_error = ClientError
+
+    def key(self, path: str) -> str:
+        rel_path = os.path.relpath(os.path.abspath(path), self.root)
+        if rel_path.startswith('..'):
+            raise ValueError(f"{path} is outside the app folder and has no object key")
+        return self.prefix + rel_path.replace(os.sep, '/')
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, *key[len(self.prefix):].split('/'))
+
+    def publish(self, path: str) -> None:
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.client.upload_file(path, self.bucket, self.key(path), ExtraArgs={'ContentType': content_type})
+        os.remove(path)
+
+    def exists(self, path: str) -> bool:
+        if os.path.exists(path):
+            return True
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(path))
+            return True
+        except self._client_error:
+            return False
+
+    @contextmanager
+    def local_copy(self, path: str) -> Iterator[str]:
+        """Download the object to its local path for the duration of the
+        block. Publish changes inside the block; an unchanged working copy
+        is dropped afterwards."""
+        if os.path.exists(path):
+            yield path
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.client.download_file(self.bucket, self.key(path), path + '.download')
+        os.replace(path + '.download', path)
+        downloaded = os.stat(path).st_mtime_ns
+        try:
+            yield path
+        finally:
+            # A copy that was changed but could not be published is kept (and
+            # served) locally rather than lost
+            if os.path.exists(path) and os.stat(path).st_mtime_ns == downloaded:
+                os.remove(path)
+
+    def open(self, path: str) -> BinaryIO:
+        if os.path.exists(path):
+            return open(path, 'rb')
+        spool = tempfile.TemporaryFile()
+        self.client.download_fileobj(self.bucket, self.key(path), spool)
+        spool.seek(0)
+        return spool
+
+    def move(self, source: str, target: str) -> None:
+        if os.path.exists(source):
+            super().move(source, target)
+            return
+        self.client.copy_object(Bucket=self.bucket, Key=self.key(target),
+                                CopySource={'Bucket': self.bucket, 'Key': self.key(source)})
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(source))
+
+    def delete(self, path: str) -> None:
+        super().delete(path)
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(path))
+
+    def stream_url(self, path: str, mime_type: str) -> Optional[str]:
+        if os.path.exists(path):
+            return None
+        return self.client.generate_presigned_url(
+            'get_object', ExpiresIn=self.url_seconds,
+            Params={'Bucket': self.bucket, 'Key': self.key(path), 'ResponseContentType': mime_type})
+
+    def remote_paths(self) -> Set[str]:
+        paths = set()
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            paths.update(self.path(item['Key']) for item in page.get('Contents', []))
+        return paths
+
+
+def get_storage() -> LocalStorage:
+    """The current app's storage backend, built from its config on first use"""
+    storage = current_app.extensions.get('easycore_storage')
+    if storage is None:
+        config = current_app.config
+        backend = config.get('STORAGE_BACKEND', 'local')
+        if backend == 's3':
+            storage = S3Storage(current_app.root_path, config['S3_BUCKET'], config.get('S3_ENDPOINT_URL'),
+                                config.get('S3_REGION'), config.get('S3_PREFIX', ''),
+                                int(config.get('S3_URL_SECONDS', DEFAULT_URL_SECONDS)))
+        elif backend == 'local':
+            storage = LocalStorage()
+        else:
+            raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}")
+        current_app.extensions['easycore_storage'] = storage
+    return storage
+
+
+def publish_media(path: str) -> None:
+    """Publish a newly committed media file. A failure is logged and the file
+    stays on local disk, where it keeps being served from."""
+    try:
+        get_storage().publish(path)
+    except Exception as e:
+        print(f"Error publishing {path} to storage: {str(e)}")
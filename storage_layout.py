@@ -0,0 +1,111 @@
+"""
+Storage Layout Module
+Where media files go inside a storage folder. Instead of one flat directory,
+files are spread over two levels of hash-prefix folders:
+
+    uploads/3f/a2/<id>.mp4
+    static/thumbnails/9c/04/thumbnail_<id>.jpg
+
+The shard is taken from an MD5 of the file name, so it can be computed for
+any name (new ids and legacy names alike) without looking at the disk, and
+no folder ever holds more than a few hundred files. New uploads are named by
+a random 128-bit id, which needs no existence check to be unique.
+
+migrate_rows() moves files stored under the old flat layout into their shard
+and rewrites the database paths; see the migrate-storage CLI.
+"""
+
+import hashlib
+import os
+import uuid
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Folder levels, and hex characters per level (256 folders each)
+SHARD_DEPTH = 2
+SHARD_CHARS = 2
+
+
+def new_file_id() -> str:
+    """A random id for a new media file; collisions are not a practical concern"""
+    return uuid.uuid4().hex
+
+
+def shard_prefix(filename: str) -> str:
+    """'ab/cd' for a file name"""
+    digest = hashlib.md5(filename.encode('utf-8')).hexdigest()
+    return '/'.join(digest[level * SHARD_CHARS:(level + 1) * SHARD_CHARS] for level in range(SHARD_DEPTH))
+
+
+def sharded_rel_path(folder_rel: str, filename: str) -> str:
+    """Static-relative path of a file in a sharded static folder, e.g.
+    ('covers', 'cover_x.png') -> 'covers/ab/cd/cover_x.png'"""
+    return f"{folder_rel}/{shard_prefix(filename)}/{filename}"
+
+
+def sharded_path(folder: str, filename: str) -> str:
+    """Absolute path of a file in a sharded folder. The shard folder is
+    created, so the result can be written to straight away."""
+    path = os.path.join(folder, *shard_prefix(filename).split('/'), filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def is_sharded(path: str) -> bool:
+    """Whether a path (absolute or static-relative) already sits in its shard"""
+    path = path.replace('\\', '/')
+    filename = os.path.basename(path)
+    return path.endswith(f"/{shard_prefix(filename)}/{filename}")
+
+
+def shard_target(path: str) -> Optional[str]:
+    """Where a flat-layout file belongs, or None if it is already sharded"""
+    if is_sharded(path):
+        return None
+    head, filename = os.path.split(path.replace('\\', '/'))
+    return f"{head}/{shard_prefix(filename)}/{filename}" if head else f"{shard_prefix(filename)}/{filename}"
+
+
+def move_file(source: str, target: str) -> bool:
+    """
+    Move a file into its shard. Safe to repeat: a file that was moved by an
+    earlier, interrupted run is left alone.
+
+    Returns:
+        True if the file is at target afterwards
+    """
+    if os.path.exists(source):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(source, target)
+        return True
+    return os.path.exists(target)
+
+
+def migrate_rows(rows: Iterable[Tuple[int, str]], resolve: Callable[[str], str],
+                 move_extra: Optional[Callable[[str, str], None]] = None) -> Tuple[Dict[int, str], List[str]]:
+    """
+    Move the files of one batch of rows into the sharded layout.
+
+    Args:
+        rows: (row id, stored path) pairs
+        resolve: Maps a stored path to the absolute file path (identity for
+            absolute media paths, joins the static folder for images)
+        move_extra: Called with the old and new stored path after a move,
+            for files that follow the main one (derivatives, storyboards)
+
+    Returns:
+        The new stored path per moved row id, and the paths whose file was
+        found in neither place
+    """
+    moved: Dict[int, str] = {}
+    missing: List[str] = []
+    for row_id, stored in rows:
+        target = shard_target(stored)
+        if target is None:
+            continue
+        if not move_file(resolve(stored), resolve(target)):
+            missing.append(stored)
+            continue
+        if move_extra is not None:
+            move_extra(stored, target)
+        moved[row_id] = target
+    return moved, missing
@@ -0,0 +1,146 @@
+"""
+Storyboard Module
+Builds sprite sheets of evenly spaced frames plus a JSON index so the player
+and trim UI can show hover previews without reading the video file.
+"""
+
+import glob
+import json
+import math
+import os
+from typing import Any, Dict, Optional
+
+import ffmpeg
+
+from storage_layout import shard_prefix
+from thumbnails import get_duration
+
+# Seconds between storyboard frames (raised for long videos, see frame_interval)
+STORYBOARD_INTERVAL = 5
+# Upper bound on frames per video so long videos don't produce hundreds of sheets
+STORYBOARD_MAX_FRAMES = 400
+STORYBOARD_TILE_WIDTH = 160
+STORYBOARD_COLUMNS = 10
+STORYBOARD_ROWS = 10
+STORYBOARD_DIRNAME = 'storyboards'
+STORYBOARD_INDEX = 'index.json'
+
+
+def storyboard_rel_dir(video_path: str) -> str:
+    """Folder (relative to the static folder) holding a video's storyboard"""
+    stem = os.path.splitext(os.path.basename(video_path))[0]
+    return f"{STORYBOARD_DIRNAME}/{shard_prefix(stem)}/{stem}"
+
+
+def storyboard_index_rel_path(video_path: str) -> str:
+    return f"{storyboard_rel_dir(video_path)}/{STORYBOARD_INDEX}"
+
+
+def has_storyboard(video_path: str, static_folder: str) -> bool:
+    return os.path.exists(os.path.join(static_folder, storyboard_index_rel_path(video_path)))
+
+
+def frame_interval(duration: float) -> float:
+    """Seconds between frames, stretched so we stay under STORYBOARD_MAX_FRAMES"""
+    if duration <= 0:
+        return STORYBOARD_INTERVAL
+    return max(STORYBOARD_INTERVAL, math.ceil(duration / STORYBOARD_MAX_FRAMES))
+
+
+def _tile_height(probe: Dict[str, Any]) -> int:
+    for stream in probe.get('streams', []):
+        if stream.get('codec_type') == 'video' and stream.get('width') and stream.get('height'):
+            height = round(STORYBOARD_TILE_WIDTH * int(stream['height']) / int(stream['width']))
+            return max(2, height - height % 2)
+    return round(STORYBOARD_TILE_WIDTH * 9 / 16)
+
+
+def generate_storyboard(video_path: str, static_folder: str, probe: Optional[Dict[str, Any]] = None,
+                        threads: Optional[int] = None) -> str:
+    """
+    Extract one frame every few seconds in a single ffmpeg pass and tile them
+    into sprite sheets under static/storyboards/<video>/.
+
+    Args:
+        video_path: Absolute path of the stored video
+        static_folder: Absolute path of the app's static folder
+        probe: An existing ffmpeg.probe result for video_path, if the caller has one
+        threads: ffmpeg thread budget (None lets ffmpeg decide)
+
+    Returns:
+        The index path relative to the static folder
+    """
+    if probe is None:
+        probe = ffmpeg.probe(video_path)
+    duration = get_duration(probe)
+    interval = frame_interval(duration)
+    tile_height = _tile_height(probe)
+
+    rel_dir = storyboard_rel_dir(video_path)
+    out_dir = os.path.join(static_folder, rel_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    for stale in glob.glob(os.path.join(out_dir, 'sheet_*.jpg')):
+        os.remove(stale)
+
+    # Decoding only keyframes is much faster; the fps filter then picks the
+    # nearest keyframe for each slot, which is plenty for a preview
+    thread_args = {'threads': threads} if threads else {}
+    (
+        ffmpeg
+        .input(video_path, skip_frame='nokey', **thread_args)
+        .filter('fps', fps=f'1/{interval}')
+        .filter('scale', STORYBOARD_TILE_WIDTH, tile_height)
+        .filter('tile', f'{STORYBOARD_COLUMNS}x{STORYBOARD_ROWS}')
+        .output(os.path.join(out_dir, 'sheet_%03d.jpg'), vsync='vfr', **{'q:v': 5}, **thread_args)
+        .overwrite_output()
+        .run(capture_stdout=True, capture_stderr=True)
+    )
+
+    sheets = sorted(os.path.basename(p) for p in glob.glob(os.path.join(out_dir, 'sheet_*.jpg')))
+    index = {
+        'interval': interval,
+        'duration': duration,
+        'frame_count': math.ceil(duration / interval) if duration > 0 else len(sheets) * STORYBOARD_COLUMNS * STORYBOARD_ROWS,
+        'tile_width': STORYBOARD_TILE_WIDTH,
+        'tile_height': tile_height,
+        'columns': STORYBOARD_COLUMNS,
+        'rows': STORYBOARD_ROWS,
+        # Sheet file names, relative to the index file
+        'sheets': sheets,
+    }
+    index_path = os.path.join(out_dir, STORYBOARD_INDEX)
+    with open(f"{index_path}.tmp", 'w') as f:
+        json.dump(index, f)
+    os.replace(f"{index_path}.tmp", index_path)
+    return f"{rel_dir}/{STORYBOARD_INDEX}"
+
+
+def safe_generate_storyboard(video_path: str, static_folder: str, probe: Optional[Dict[str, Any]] = None,
+                             threads: Optional[int] = None) -> Optional[str]:
+    """Ingest-time wrapper: a failed storyboard must never fail the upload"""
+    try:
+        return generate_storyboard(video_path, static_folder, probe, threads)
+    except ffmpeg.Error as e:
+        print(f"Error generating storyboard for {video_path}: {e.stderr.decode() if e.stderr else e}")
+    except Exception as e:
+        print(f"Error generating storyboard for {video_path}: {str(e)}")
+    return None
+
+
+def remove_storyboard(video_path: str, static_folder: str) -> None:
+    out_dir = os.path.join(static_folder, storyboard_rel_dir(video_path))
+    if not os.path.isdir(out_dir):
+        return
+    for name in os.listdir(out_dir):
+        os.remove(os.path.join(out_dir, name))
+    os.rmdir(out_dir)
+
+
+def migrate_legacy_storyboard(video_path: str, static_folder: str) -> None:
+    """Move a storyboard from the old flat storyboards/<stem> folder into its shard"""
+    stem = os.path.splitext(os.path.basename(video_path))[0]
+    legacy_dir = os.path.join(static_folder, STORYBOARD_DIRNAME, stem)
+    out_dir = os.path.join(static_folder, storyboard_rel_dir(video_path))
+    if os.path.isdir(legacy_dir) and not os.path.exists(out_dir):
+        os.makedirs(os.path.dirname(out_dir), exist_ok=True)
+        os.replace(legacy_dir, out_dir)
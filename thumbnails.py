@@ -0,0 +1,73 @@
+"""
+Video Thumbnail Module
+Shared ffmpeg thumbnail extraction used by every video ingest path
+"""
+
+import os
+from typing import Any, Dict, Optional
+
+import ffmpeg
+
+from image_derivatives import safe_generate_derivatives
+from storage_layout import sharded_path, sharded_rel_path
+
+# Width of the stored thumbnail; smaller sizes come from the derivative pipeline
+THUMBNAIL_MAX_WIDTH = 640
+
+
+def get_duration(probe: Dict[str, Any]) -> float:
+    """Read a duration from an ffmpeg.probe result, falling back to 0"""
+    for stream in probe.get('streams', []):
+        if 'duration' in stream:
+            return float(stream['duration'])
+    if 'format' in probe and 'duration' in probe['format']:
+        return float(probe['format']['duration'])
+    return 0
+
+
+def get_video_width(probe: Dict[str, Any]) -> Optional[int]:
+    """Width of the first video stream in an ffmpeg.probe result"""
+    for stream in probe.get('streams', []):
+        if stream.get('codec_type') == 'video' and stream.get('width'):
+            return int(stream['width'])
+    return None
+
+
+def generate_video_thumbnail(video_path: str, static_folder: str, probe: Optional[Dict[str, Any]] = None,
+                             duration: Optional[float] = None, width: Optional[int] = None) -> str:
+    """
+    Extract the middle frame of a video into static/thumbnails and build its
+    resized derivatives.
+
+    Args:
+        video_path: Absolute path of the stored video
+        static_folder: Absolute path of the app's static folder
+        probe: An existing ffmpeg.probe result for video_path, if the caller has one
+        duration/width: Stored metadata (see media_metadata.py); when the
+            duration is given the file is not probed
+
+    Returns:
+        The thumbnail path relative to the static folder
+    """
+    if probe is None and not duration:
+        probe = ffmpeg.probe(video_path)
+    if probe is not None:
+        duration = get_duration(probe)
+        width = get_video_width(probe)
+    width = min(width or THUMBNAIL_MAX_WIDTH, THUMBNAIL_MAX_WIDTH)
+
+    thumbnail_filename = f"thumbnail_{os.path.splitext(os.path.basename(video_path))[0]}.jpg"
+    thumbnail_path = sharded_path(os.path.join(static_folder, 'thumbnails'), thumbnail_filename)
+
+    (
+        ffmpeg
+        .input(video_path, ss=duration/2 if duration > 0 else 0)
+        .filter('scale', width, -2)
+        .output(thumbnail_path, vframes=1)
+        .overwrite_output()
+        .run(capture_stdout=True, capture_stderr=True)
+    )
+
+    relative_thumbnail_path = sharded_rel_path('thumbnails', thumbnail_filename)
+    safe_generate_derivatives(relative_thumbnail_path, static_folder)
+    return relative_thumbnail_path
@@ -0,0 +1,235 @@
+"""
+Transcode Planner Module
+Decides, from a file's probed streams, the cheapest way to make an upload
+playable in every browser as MP4, and carries the decision out:
+
+- keep:      already H.264/AAC (or MP3) in MP4, nothing to do
+- remux:     the streams are fine but the container is not, copy them into MP4
+- transcode: re-encode what is not compatible (copying whatever is) with
+             CRF, preset and threads chosen from the resolution
+
+Plans are plain dicts so they can be stored on the Video row and returned from
+worker processes. estimate_plan() projects the time and size of a plan next to
+the previous fixed policy (re-encode WebM at 2 Mb/s, keep MP4), which the
+plan-transcodes CLI uses as a dry run over the library.
+"""
+
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import ffmpeg
+
+from media_metadata import extract_metadata, first_stream
+
+# Codecs every current browser plays from an MP4
+COMPATIBLE_VIDEO_CODECS = ('h264',)
+COMPATIBLE_AUDIO_CODECS = ('aac', 'mp3')
+COMPATIBLE_PIXEL_FORMATS = ('yuv420p', 'yuvj420p')
+
+# (max height, crf, preset, threads, typical kb/s of the result), smallest first.
+# Larger frames get a slightly higher CRF and a faster preset so encode time
+# stays bounded; the thread count is capped by the caller's budget.
+ENCODE_PROFILES: List[Tuple[Optional[int], int, str, int, int]] = [
+    (480, 22, 'medium', 2, 900),
+    (720, 23, 'medium', 4, 1800),
+    (1080, 23, 'fast', 6, 3500),
+    (None, 24, 'faster', 8, 9000),
+]
+AUDIO_BITRATE = '128k'
+
+# Rough single-thread encode cost, in seconds per second of 720p video
+PRESET_COST = {'faster': 0.35, 'fast': 0.5, 'medium': 0.65}
+# Rough stream-copy throughput, bytes per second
+COPY_BYTES_PER_SECOND = 150 * 1024 * 1024
+# The policy this planner replaced: WebM re-encoded with libx264 at default
+# preset and 2 Mb/s with AAC audio, MP4 kept as uploaded
+LEGACY_VIDEO_KBPS = 2000
+LEGACY_AUDIO_KBPS = 128
+LEGACY_PRESET = 'medium'
+LEGACY_THREADS = 2
+
+
+def _is_mp4(format_name: Optional[str]) -> bool:
+    return 'mp4' in (format_name or '').split(',')
+
+
+def _encode_profile(height: Optional[int]) -> Tuple[Optional[int], int, str, int, int]:
+    for profile in ENCODE_PROFILES:
+        if profile[0] is None or (height or 0) <= profile[0]:
+            return profile
+    return ENCODE_PROFILES[-1]
+
+
+def plan_transcode(metadata: Dict[str, Any], format_name: Optional[str] = None,
+                   pix_fmt: Optional[str] = None, threads: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Choose how to turn a file into browser-playable MP4.
+
+    Args:
+        metadata: media_metadata columns for the file (stored or freshly probed)
+        format_name: ffprobe format_name, e.g. 'matroska,webm'
+        pix_fmt: Pixel format of the video stream, if known
+        threads: ffmpeg thread budget; caps the profile's thread count
+
+    Returns:
+        Dict with the action ('keep', 'remux' or 'transcode'), the per-stream
+        decisions, encode settings (if any) and a human-readable reason
+    """
+    video_codec = metadata.get('video_codec')
+    audio_codec = metadata.get('audio_codec')
+    reasons = []
+
+    video_ok = video_codec in COMPATIBLE_VIDEO_CODECS and (pix_fmt is None or pix_fmt in COMPATIBLE_PIXEL_FORMATS)
+    if video_codec is None:
+        video_action = 'none'
+    elif video_ok:
+        video_action = 'copy'
+    else:
+        video_action = 'encode'
+        reasons.append(f"video {video_codec}{'/' + pix_fmt if pix_fmt else ''} is not browser-compatible")
+
+    if audio_codec is None:
+        audio_action = 'none'
+    elif audio_codec in COMPATIBLE_AUDIO_CODECS:
+        audio_action = 'copy'
+    else:
+        audio_action = 'encode'
+        reasons.append(f"audio {audio_codec} is not browser-compatible")
+
+    container_ok = _is_mp4(format_name)
+    if not container_ok:
+        reasons.append(f"container {format_name or 'unknown'} is not MP4")
+
+    plan: Dict[str, Any] = {'video': video_action, 'audio': audio_action, 'source_format': format_name,
+                            'source_video_codec': video_codec, 'source_audio_codec': audio_codec}
+    if 'encode' in (video_action, audio_action):
+        plan['action'] = 'transcode'
+    elif not container_ok:
+        plan['action'] = 'remux'
+    else:
+        plan['action'] = 'keep'
+        reasons.append('already browser-compatible MP4')
+
+    if video_action == 'encode':
+        _, crf, preset, profile_threads, _ = _encode_profile(metadata.get('height'))
+        plan.update(crf=crf, preset=preset, threads=min(profile_threads, threads) if threads else profile_threads)
+    elif plan['action'] != 'keep' and threads:
+        plan['threads'] = threads
+    plan['reason'] = '; '.join(reasons)
+    return plan
+
+
+def plan_from_probe(probe: Dict[str, Any], path: Optional[str] = None,
+                    threads: Optional[int] = None) -> Dict[str, Any]:
+    """plan_transcode for an ffmpeg.probe result"""
+    video = first_stream(probe, 'video')
+    return plan_transcode(extract_metadata(probe, path), probe.get('format', {}).get('format_name'),
+                          video.get('pix_fmt') if video else None, threads)
+
+
+def probe_plan(path: str, threads: Optional[int] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Probe a file and plan it; returns the plan and the file's metadata columns"""
+    probe = ffmpeg.probe(path)
+    return plan_from_probe(probe, path, threads), extract_metadata(probe, path)
+
+
+def execute_plan(input_path: str, plan: Dict[str, Any]) -> str:
+    """
+    Carry out a plan. The source file is replaced by the MP4 result.
+
+    Args:
+        input_path: The file that was planned
+        plan: Result of plan_transcode/plan_from_probe; elapsed_seconds and
+            output_size are added to it
+
+    Returns:
+        Path of the browser-playable file
+    """
+    if plan['action'] == 'keep':
+        return input_path
+
+    output_path = os.path.splitext(input_path)[0] + '.mp4'
+    # Never write over the input while ffmpeg is still reading it
+    work_path = output_path + '.transcoding.mp4' if output_path == input_path else output_path
+
+    # Only the first video and audio stream go into the MP4; subtitle and data
+    # tracks (timed text, chapters, GPMF...) would make the mux fail
+    output_args: Dict[str, Any] = {'movflags': '+faststart', 'sn': None, 'dn': None}
+    if plan['video'] == 'encode':
+        output_args.update({'c:v': 'libx264', 'crf': plan['crf'], 'preset': plan['preset'], 'pix_fmt': 'yuv420p'})
+    elif plan['video'] == 'copy':
+        output_args['c:v'] = 'copy'
+    if plan['audio'] == 'encode':
+        output_args.update({'c:a': 'aac', 'b:a': AUDIO_BITRATE})
+    elif plan['audio'] == 'copy':
+        output_args['c:a'] = 'copy'
+    thread_args = {'threads': plan['threads']} if plan.get('threads') else {}
+
+    source = ffmpeg.input(input_path, **thread_args)
+    streams = []
+    if plan['video'] != 'none':
+        streams.append(source['v:0'])
+    if plan['audio'] != 'none':
+        streams.append(source['a:0?'])
+
+    started = time.monotonic()
+    try:
+        (
+            ffmpeg
+            .output(*streams, work_path, **output_args, **thread_args)
+            .overwrite_output()
+            .run(capture_stdout=True, capture_stderr=True)
+        )
+    except ffmpeg.Error as e:
+        print(f"Error running {plan['action']} for {input_path}: {e.stderr.decode()}")
+        if os.path.exists(work_path):
+            os.remove(work_path)
+        raise
+    plan['elapsed_seconds'] = round(time.monotonic() - started, 2)
+
+    if work_path != output_path:
+        os.replace(work_path, output_path)
+    else:
+        os.remove(input_path)
+    plan['output_size'] = os.path.getsize(output_path)
+    print(f"Transcode plan for {os.path.basename(input_path)}: {plan['action']} ({plan['reason']}) "
+          f"in {plan['elapsed_seconds']}s")
+    return output_path
+
+
+def estimate_plan(plan: Dict[str, Any], metadata: Dict[str, Any]) -> Dict[str, float]:
+    """
+    Projected seconds and bytes for a plan and for the legacy policy, which
+    re-encoded WebM uploads at a fixed bitrate and kept MP4 uploads as they
+    were. These are rough, hardware-independent figures meant for comparing
+    policies.
+
+    Returns:
+        Dict with seconds, size, legacy_seconds and legacy_size
+    """
+    duration = metadata.get('duration') or 0
+    size = metadata.get('file_size') or 0
+    pixels = (metadata.get('width') or 1280) * (metadata.get('height') or 720)
+    scale = pixels / (1280 * 720)
+
+    if _is_mp4(plan.get('source_format')):
+        legacy_seconds, legacy_size = 0.0, size
+    else:
+        legacy_seconds = duration * scale * PRESET_COST[LEGACY_PRESET] / LEGACY_THREADS
+        legacy_size = duration * (LEGACY_VIDEO_KBPS + LEGACY_AUDIO_KBPS) * 1000 / 8
+
+    if plan['action'] == 'keep':
+        seconds, projected_size = 0.0, size
+    elif plan['video'] != 'encode':
+        seconds, projected_size = size / COPY_BYTES_PER_SECOND, size
+    else:
+        *_, typical_kbps = _encode_profile(metadata.get('height'))
+        seconds = duration * scale * PRESET_COST[plan['preset']] / (plan.get('threads') or 1)
+        # CRF output never needs more bits than the source already used
+        kbps = typical_kbps + LEGACY_AUDIO_KBPS
+        if metadata.get('bitrate'):
+            kbps = min(kbps, metadata['bitrate'] / 1000)
+        projected_size = duration * kbps * 1000 / 8
+    return {'seconds': seconds, 'size': projected_size,
+            'legacy_seconds': legacy_seconds, 'legacy_size': legacy_size}